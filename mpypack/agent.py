@@ -0,0 +1,153 @@
+try:
+    from pyboard import Pyboard, PyboardError
+    from tracing import tracer
+except ImportError:
+    from mpypack.pyboard import Pyboard, PyboardError
+    from mpypack.tracing import tracer
+import struct
+from os import path as syspath
+from typing import List, Tuple
+
+AGENT_SOURCE_FILE = syspath.join(syspath.dirname(syspath.abspath(__file__)), "mpyagent.py")
+AGENT_REMOTE_PATH = "/.mpypack_agent.py"
+AGENT_CHUNK_SIZE = 1024
+HASH_ALL = 0xFFFFFFFF
+
+OP_QUIT = 0
+OP_STAT = 1
+OP_LS = 2
+OP_WALK = 3
+OP_READ = 4
+OP_WRITE = 5
+OP_HASH = 6
+OP_MKDIR = 7
+OP_RM = 8
+OP_RENAME = 9
+OP_PING = 15
+
+STATUS_OK = 0
+STATUS_ERROR = 255
+
+ENTRY_DIRECTORY = 0
+ENTRY_FILE = 1
+
+class AgentError(PyboardError):
+    ''' the agent answered with an error, errno is set for OSError on the board '''
+    def __init__(self, status, message):
+        super().__init__("agent error {}: {}".format(status, message))
+        self.errno = None if status == STATUS_ERROR else status
+
+def read_agent_source() -> bytes:
+    with open(AGENT_SOURCE_FILE, "rb") as f:
+        return f.read()
+
+def agent_version(source:bytes) -> str:
+    # the first line of the agent source, e.g. "# mpypack agent 1"
+    return source.split(b"\n", 1)[0].decode("utf-8").lstrip("# ").strip()
+
+def _pack_str(s:str) -> bytes:
+    b = str(s).encode("utf-8")
+    return struct.pack("<H", len(b)) + b
+
+def _unpack_entries(data:bytes) -> List[Tuple[str, int, int]]:
+    entries = []
+    p = 0
+    while p < len(data):
+        kind, size, n = struct.unpack_from("<BIH", data, p)
+        p += 7
+        entries.append((data[p:p+n].decode("utf-8"), kind, size))
+        p += n
+    return entries
+
+class RemoteAgent:
+    ''' Host side of mpyagent.py, talks to the agent while it owns the raw REPL '''
+    def __init__(self, device:Pyboard, remote_path=AGENT_REMOTE_PATH):
+        self.__device = device
+        self.remote_path = remote_path
+        self.source = read_agent_source()
+        self.version = agent_version(self.source)
+        self.running = False
+
+    def is_installed(self):
+        # called while the raw REPL is free
+        try:
+            line = self.__device.eval("open('{}').readline()".format(self.remote_path))
+        except PyboardError:
+            return False
+        return line.decode("utf-8").lstrip("# ").strip() == self.version
+
+    def start(self):
+        if self.running:
+            return
+        self.__device.exec_raw_no_follow("exec(open('{}').read())".format(self.remote_path))
+        self.running = True
+        try:
+            version = self.call(OP_PING, timeout=2).decode("utf-8")
+        except PyboardError:
+            self.abort()
+            raise
+        if version != self.version:
+            self.stop()
+            raise AgentError(STATUS_ERROR, "unexpected agent version: {}".format(version))
+
+    def stop(self):
+        if not self.running:
+            return
+        self.call(OP_QUIT)
+        self.running = False
+        # the exec started by start() ends here
+        self.__device.follow(10)
+
+    def abort(self):
+        # give up on the agent and get the raw REPL back
+        self.running = False
+        try:
+            self.__device.serial.write(struct.pack("<BI", OP_QUIT, 0))
+        except: pass
+        self.__device.resync_raw_repl()
+
+    def call(self, op, payload=b"", timeout=10) -> bytes:
+        if not self.running:
+            raise PyboardError("agent is not running")
+        tracer.count("agent.requests")
+        tracer.count("device.round_trips")
+        with tracer.span("call", "agent", op=op, bytes=len(payload)):
+            self.__device.serial.write(struct.pack("<BI", op, len(payload)) + payload)
+            header = self.__device.read_exact(5, timeout)
+            if len(header) != 5:
+                raise PyboardError("timeout waiting for agent response")
+            status, length = struct.unpack("<BI", header)
+            data = self.__device.read_exact(length, timeout)
+            if len(data) != length:
+                raise PyboardError("timeout waiting for agent response")
+        if status != STATUS_OK:
+            raise AgentError(status, data.decode("utf-8", "replace"))
+        return data
+
+    # operations
+    def stat(self, path) -> Tuple[int, int]:
+        return struct.unpack("<BI", self.call(OP_STAT, _pack_str(path)))
+
+    def ls(self, path) -> List[Tuple[str, int, int]]:
+        return _unpack_entries(self.call(OP_LS, _pack_str(path)))
+
+    def walk(self, path) -> List[Tuple[str, int, int]]:
+        return _unpack_entries(self.call(OP_WALK, _pack_str(path), timeout=30))
+
+    def read(self, path, offset, length) -> bytes:
+        return self.call(OP_READ, _pack_str(path) + struct.pack("<II", offset, length))
+
+    def write(self, path, data, append=False):
+        self.call(OP_WRITE, _pack_str(path) + (b"\x01" if append else b"\x00") + bytes(data))
+
+    def hash(self, path, length=HASH_ALL) -> bytes:
+        return self.call(OP_HASH, _pack_str(path) + struct.pack("<I", length), timeout=30)
+
+    def mkdir(self, path):
+        self.call(OP_MKDIR, _pack_str(path))
+
+    def rm(self, path):
+        self.call(OP_RM, _pack_str(path))
+
+    def rename(self, src, dst):
+        self.call(OP_RENAME, _pack_str(src) + _pack_str(dst))
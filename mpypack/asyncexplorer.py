@@ -0,0 +1,456 @@
+try:
+    from pyboard import PyboardError
+    from fileexplorer import FileEntity, FileEntityType, FileExplorerError, FileExplorerStatus, PathObject, ProgressCallback, REMOTE_INIT_COMMANDS, FILE_SIZE_UNKNOWN
+    from fileexplorer import resolve_remote_path, parse_stat_result, parse_ilistdir_result, convert_to_pathstr, _was_remote_exception
+except ImportError:
+    from mpypack.pyboard import PyboardError
+    from mpypack.fileexplorer import FileEntity, FileEntityType, FileExplorerError, FileExplorerStatus, PathObject, ProgressCallback, REMOTE_INIT_COMMANDS, FILE_SIZE_UNKNOWN
+    from mpypack.fileexplorer import resolve_remote_path, parse_stat_result, parse_ilistdir_result, convert_to_pathstr, _was_remote_exception
+import os, asyncio, binascii
+from pathlib import PurePosixPath
+from io import BytesIO
+from typing import Iterator, List, Union
+
+import serial
+
+class AsyncPyboard:
+    ''' Pyboard over a non-blocking serial fd, driven by the running event loop '''
+    POLL_INTERVAL = 0.005 # only used when the port has no selectable fd
+    def __init__(self, device, baudrate=115200):
+        self.device = device
+        self.baudrate = int(baudrate)
+        self.serial = None
+        self.__fd = None
+        self.__loop = None
+        self.__buffer = bytearray()
+        self.__data_event = None
+
+    async def init(self):
+        self.__loop = asyncio.get_event_loop()
+        self.__data_event = asyncio.Event()
+        self.__buffer = bytearray()
+        try:
+            self.serial = serial.Serial(self.device, baudrate=self.baudrate, timeout=0, write_timeout=None)
+        except (OSError, IOError, serial.SerialException):
+            raise PyboardError("failed to access " + self.device)
+        try:
+            self.__fd = self.serial.fileno()
+            os.set_blocking(self.__fd, False)
+            self.__loop.add_reader(self.__fd, self.__on_readable)
+        except (AttributeError, NotImplementedError, OSError):
+            # windows: no selectable handle, fall back to polling
+            self.__fd = None
+
+    def close(self):
+        if self.__fd != None:
+            try: self.__loop.remove_reader(self.__fd)
+            except: pass
+            self.__fd = None
+        if self.serial != None:
+            self.serial.close()
+
+    def __on_readable(self):
+        try:
+            data = os.read(self.__fd, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if data:
+            self.__buffer.extend(data)
+            self.__data_event.set()
+
+    async def __fill(self, timeout):
+        # wait for more data, return False on timeout
+        if self.__fd == None:
+            n = self.serial.in_waiting
+            if n > 0:
+                self.__buffer.extend(self.serial.read(n))
+                return True
+            await asyncio.sleep(min(self.POLL_INTERVAL, timeout))
+            return False
+        self.__data_event.clear()
+        try:
+            await asyncio.wait_for(self.__data_event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def __take(self, n):
+        data = bytes(self.__buffer[:n])
+        del self.__buffer[:n]
+        return data
+
+    async def write(self, data):
+        if self.__fd == None:
+            self.serial.write(data)
+            return
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                n = os.write(self.__fd, view)
+            except BlockingIOError:
+                n = 0
+            view = view[n:]
+            if len(view) > 0:
+                await asyncio.sleep(self.POLL_INTERVAL)
+
+    async def read(self, num_bytes, timeout=10):
+        deadline = self.__loop.time() + timeout
+        while len(self.__buffer) < num_bytes:
+            remain = deadline - self.__loop.time()
+            if remain <= 0:
+                break
+            await self.__fill(remain)
+        return self.__take(num_bytes)
+
+    async def read_until(self, ending, timeout=10, data_consumer=None):
+        # timeout counts from the last received byte, like Pyboard.read_until
+        idle = 0
+        while True:
+            index = self.__buffer.find(ending)
+            if index >= 0:
+                data = self.__take(index + len(ending))
+                break
+            if data_consumer and len(self.__buffer) >= len(ending):
+                data_consumer(self.__take(len(self.__buffer) - len(ending) + 1))
+            if await self.__fill(timeout - idle):
+                idle = 0
+                continue
+            idle += self.POLL_INTERVAL if self.__fd == None else timeout
+            if idle >= timeout:
+                data = self.__take(len(self.__buffer))
+                break
+        if data_consumer:
+            if data.endswith(ending):
+                data_consumer(data[:-len(ending)])
+                return ending
+            data_consumer(data)
+            return b""
+        return data
+
+    def flush_input(self):
+        self.__buffer = bytearray()
+        if self.serial.in_waiting > 0:
+            self.serial.reset_input_buffer()
+
+    async def enter_raw_repl(self):
+        await self.write(b"\r\x03\x03")  # ctrl-C twice: interrupt any running program
+        await asyncio.sleep(0.01)
+        self.flush_input()
+        await self.write(b"\r\x01")  # ctrl-A: enter raw REPL
+        data = await self.read_until(b"raw REPL; CTRL-B to exit\r\n>", timeout=0.1)
+        if not data.endswith(b"raw REPL; CTRL-B to exit\r\n>"):
+            raise PyboardError("could not enter raw repl")
+        await self.write(b"\x04")  # ctrl-D: soft reset
+        data = await self.read_until(b"soft reboot\r\n")
+        if not data.endswith(b"soft reboot\r\n"):
+            raise PyboardError("could not enter raw repl")
+        data = await self.read_until(b"raw REPL; CTRL-B to exit\r\n")
+        if not data.endswith(b"raw REPL; CTRL-B to exit\r\n"):
+            raise PyboardError("could not enter raw repl")
+
+    async def exit_raw_repl(self):
+        await self.write(b"\r\x02")  # ctrl-B: enter friendly REPL
+
+    async def follow(self, timeout, data_consumer=None):
+        # wait for normal output
+        data = await self.read_until(b"\x04", timeout=timeout, data_consumer=data_consumer)
+        if not data.endswith(b"\x04"):
+            raise PyboardError("timeout waiting for first EOF reception")
+        data = data[:-1]
+        # wait for error output
+        data_err = await self.read_until(b"\x04", timeout=timeout)
+        if not data_err.endswith(b"\x04"):
+            raise PyboardError("timeout waiting for second EOF reception")
+        data_err = data_err[:-1]
+        return data, data_err
+
+    async def exec_raw_no_follow(self, command):
+        if isinstance(command, bytes):
+            command_bytes = command
+        else:
+            command_bytes = bytes(command, encoding="utf8")
+        # check we have a prompt
+        data = await self.read_until(b">")
+        if not data.endswith(b">"):
+            raise PyboardError("could not enter raw repl")
+        # write command
+        for i in range(0, len(command_bytes), 256):
+            await self.write(command_bytes[i : min(i + 256, len(command_bytes))])
+            await asyncio.sleep(0.01)
+        await self.write(b"\x04")
+        # check if we could exec command
+        data = await self.read(2)
+        if data != b"OK":
+            raise PyboardError("could not exec command (response: %r)" % data)
+
+    async def exec_raw(self, command, timeout=10, data_consumer=None):
+        await self.exec_raw_no_follow(command)
+        return await self.follow(timeout, data_consumer)
+
+    async def eval(self, expression):
+        ret = await self.exec("print({})".format(expression))
+        return ret.strip()
+
+    async def exec(self, command, data_consumer=None):
+        ret, ret_err = await self.exec_raw(command, data_consumer=data_consumer)
+        if ret_err:
+            raise PyboardError("exception", ret, ret_err)
+        return ret
+
+class AsyncFileExplorer:
+    ''' asyncio version of FileExplorer, safe to share between tasks of one event loop '''
+    @property
+    def CHUNK_SIZE(self): return 512
+    def __init__(self, port, baudrate=115200):
+        self.__device = AsyncPyboard(port, baudrate)
+        self.__current_path = PurePosixPath("/")
+        self.__status = FileExplorerStatus.UNKNOWN
+        self.sysname = ""
+        self.__device_lock = None
+
+    def __lock(self):
+        if self.__device_lock == None:
+            self.__device_lock = asyncio.Lock()
+        return self.__device_lock
+
+    def __protect(fn):
+        async def func(self, *args, **kwargs):
+            async with self.__lock():
+                return await fn(self, *args, **kwargs)
+        return func
+
+    async def __aenter__(self):
+        await self.init()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_tb):
+        await self.close()
+
+    @property
+    def status(self):
+        if self.__status == FileExplorerStatus.READY and self.__lock().locked():
+            return FileExplorerStatus.BUSY
+        return self.__status
+
+    @property
+    def is_ready(self):
+        return self.__status == FileExplorerStatus.READY
+
+    @__protect
+    async def init(self):
+        if self.is_ready:
+            return
+        await self.__device.init()
+        try:
+            await self.__device.enter_raw_repl()
+        except PyboardError:
+            await asyncio.sleep(0.5)
+            await self.__device.enter_raw_repl() # try again
+        for command in REMOTE_INIT_COMMANDS:
+            await self.__device.exec(command)
+        self.__current_path = PurePosixPath("/", (await self.__device.eval("uos.getcwd()")).decode("utf8"))
+        self.sysname = (await self.__device.eval("uos.uname()[0]")).decode("utf-8")
+        self.__status = FileExplorerStatus.READY
+
+    @__protect
+    async def close(self):
+        try: await self.__device.exit_raw_repl()
+        except: pass
+        try: self.__device.close()
+        except: pass
+        self.__status = FileExplorerStatus.UNKNOWN
+
+    # utils function
+    def abspath(self, path:PathObject) -> PurePosixPath:
+        return resolve_remote_path(self.__current_path, path)
+
+    def pwd(self):
+        return convert_to_pathstr(self.__current_path)
+
+    # file explorer function, callers must hold the lock
+    async def __stat(self, path:PathObject) -> FileEntity:
+        posixpath = self.abspath(path)
+        try:
+            res = await self.__device.eval("uos.stat('{}')".format(posixpath))
+        except Exception as e:
+            if _was_remote_exception(e):
+                raise FileExplorerError("No such file or directory: {}".format(posixpath))
+            else:
+                raise PyboardError(e)
+        return parse_stat_result(res, self.__current_path, path)
+
+    async def __exist(self, path:PathObject) -> Union[FileEntity, bool]:
+        try:
+            return await self.__stat(path)
+        except FileExplorerError:
+            return False
+
+    async def __ls(self, path:PathObject) -> List[FileEntity]:
+        posixpath = self.abspath(path)
+        try:
+            res = await self.__device.eval("list(uos.ilistdir('{}'))".format(posixpath))
+        except Exception as e:
+            if _was_remote_exception(e):
+                raise FileExplorerError("No such directory: {}".format(posixpath))
+            else:
+                raise PyboardError(e)
+        return parse_ilistdir_result(res, posixpath)
+
+    async def __rm(self, file:FileEntity):
+        posixpath = self.abspath(file)
+        try:
+            if file.type == FileEntityType.DIRECTORY:
+                await self.__device.eval("uos.rmdir('{}')".format(posixpath))
+            else:
+                await self.__device.eval("uos.remove('{}')".format(posixpath))
+        except PyboardError as e:
+            if _was_remote_exception(e):
+                raise FileExplorerError("Directory not empty: {}".format(posixpath))
+            else:
+                raise e
+
+    async def __mkdir(self, path:PathObject) -> FileEntity:
+        posixpath = self.abspath(path)
+        try:
+            await self.__device.eval("uos.mkdir('{}')".format(posixpath))
+        except PyboardError as e:
+            if _was_remote_exception(e):
+                raise FileExplorerError("Directory may be invalid or exists: {}".format(posixpath))
+            else:
+                raise e
+        return FileEntity(posixpath, "", FileEntityType.DIRECTORY, FILE_SIZE_UNKNOWN)
+
+    async def __mkdirs(self, path:PathObject) -> FileEntity:
+        posixpath = self.abspath(path)
+        exist = await self.__exist(posixpath)
+        if exist and exist.type == FileEntityType.DIRECTORY:
+            return exist
+        parts = posixpath.parts
+        last = None
+        for p in range(len(parts)):
+            dir = PurePosixPath(*parts[:p+1])
+            if await self.__exist(dir):
+                continue
+            last = await self.__mkdir(dir)
+        return last
+
+    async def __walk(self, dir:FileEntity, topdown) -> List[FileEntity]:
+        lst = []
+        files = await self.__ls(dir)
+        if topdown:
+            lst.append(dir)
+            lst.extend(f for f in files if f.type != FileEntityType.DIRECTORY)
+        for file in files:
+            if file.type == FileEntityType.DIRECTORY:
+                lst.extend(await self.__walk(file, topdown))
+        if not topdown:
+            lst.append(dir)
+            lst.extend(f for f in files if f.type != FileEntityType.DIRECTORY)
+        return lst
+
+    @__protect
+    async def stat(self, path:PathObject) -> FileEntity:
+        return await self.__stat(path)
+
+    @__protect
+    async def exist(self, path:PathObject) -> Union[FileEntity, bool]:
+        return await self.__exist(path)
+
+    @__protect
+    async def cd(self, path:PathObject="/"):
+        posixpath = self.abspath(path)
+        file = await self.__exist(posixpath)
+        if file and file.type == FileEntityType.DIRECTORY:
+            self.__current_path = posixpath
+        else:
+            raise FileExplorerError("No such directory: {}".format(posixpath))
+
+    @__protect
+    async def ls(self, path:PathObject="") -> List[FileEntity]:
+        return await self.__ls(path)
+
+    @__protect
+    async def rm(self, path:PathObject):
+        await self.__rm(await self.__stat(path))
+
+    @__protect
+    async def rmtree(self, path:PathObject):
+        file = await self.__exist(path)
+        if not file:
+            return
+        files = [file]
+        if file.type == FileEntityType.DIRECTORY:
+            files = await self.__walk(file, topdown=False)
+        for f in files:
+            await self.__rm(f)
+
+    @__protect
+    async def mkdir(self, path:PathObject) -> FileEntity:
+        return await self.__mkdir(path)
+
+    @__protect
+    async def mkdirs(self, path:PathObject) -> FileEntity:
+        return await self.__mkdirs(path)
+
+    @__protect
+    async def walk(self, path:PathObject, topdown=True) -> List[FileEntity]:
+        posixpath = self.abspath(path)
+        dir = await self.__exist(posixpath)
+        if dir == False or dir.type != FileEntityType.DIRECTORY:
+            raise FileExplorerError("Target is not directory: {}".format(posixpath))
+        return await self.__walk(dir, topdown)
+
+    @__protect
+    async def download(self, path:PathObject, progress_callback:ProgressCallback=None) -> bytes:
+        posixpath = self.abspath(path)
+        file = await self.__exist(path)
+        if file == False or file.type == FileEntityType.DIRECTORY:
+            raise FileExplorerError("Target is directory: {}".format(posixpath))
+        try:
+            dst = BytesIO()
+            await self.__device.exec("f = open('{}', 'rb')".format(posixpath))
+            while dst.tell() < file.size:
+                chunck = await self.__device.exec("c = ubinascii.b2a_base64(f.read({}))\r\nsys.stdout.write(c)\r\n".format(self.CHUNK_SIZE))
+                dst.write(binascii.a2b_base64(chunck))
+                if progress_callback != None:
+                    progress_callback(dst.tell(), file.size)
+            await self.__device.exec("f.close()")
+            assert dst.tell() == file.size
+            return dst.getvalue()
+        except PyboardError as e:
+            if _was_remote_exception(e):
+                raise FileExplorerError("Read file failed: {}".format(posixpath))
+            else:
+                raise e
+
+    @__protect
+    async def upload(self, path:PathObject, data:Iterator, progress_callback:ProgressCallback=None):
+        posixpath = self.abspath(path)
+        file = await self.__exist(path)
+        if file and file.type == FileEntityType.DIRECTORY:
+            raise FileExplorerError("Target is directory: {}".format(posixpath))
+        filedir = PurePosixPath(*posixpath.parts[:-1])
+        filename = posixpath.parts[-1]
+        await self.__mkdirs(filedir)
+        try:
+            size = len(data)
+            await self.__device.exec("f = open('{}', 'wb')".format(posixpath))
+            for p in range(0, size, self.CHUNK_SIZE):
+                chunck = binascii.b2a_base64(data[p:p+self.CHUNK_SIZE]).decode("utf-8").replace("\r","").replace("\n","")
+                await self.__device.exec("f.write(ubinascii.a2b_base64('{}'))".format(chunck))
+                if progress_callback != None:
+                    progress_callback(min(p + self.CHUNK_SIZE, size), size)
+            await self.__device.exec("f.close()")
+            return FileEntity(filedir, filename, FileEntityType.FILE, size)
+        except PyboardError as e:
+            if _was_remote_exception(e):
+                raise FileExplorerError("Write file failed: {}".format(posixpath))
+            else:
+                raise e
+
+    # extra function
+    @__protect
+    async def exec(self, command, data_consumer=None):
+        return await self.__device.exec(command, data_consumer)
@@ -0,0 +1,90 @@
+try:
+    from pyboard import error_message
+    from fileexplorer import FileExplorer
+    from filesync import get_compiled_file_content
+except ImportError:
+    from mpypack.pyboard import error_message
+    from mpypack.fileexplorer import FileExplorer
+    from mpypack.filesync import get_compiled_file_content
+from os import PathLike, path as syspath
+from pathlib import PurePosixPath
+from typing import Callable, List, Tuple, Union
+
+BENCH_REMOTE_DIR = "/.mpypack_bench"
+# name, mpy-cross options (None ships the source)
+DEFAULT_VARIANTS = [
+    ("py", None),
+    ("mpy", []),
+    ("mpy -O3", ["-O3"]),
+    ("native", ["-X", "emit=native"]),
+]
+BENCH_COMMAND = """
+import sys, gc, utime
+sys.path.insert(0, {dir!r})
+try:
+    _m = __import__({module!r})
+    _f = getattr(_m, {function!r})
+    _f()
+    gc.collect()
+    _t = utime.ticks_us()
+    for _i in range({repeat}):
+        _f()
+    print(utime.ticks_diff(utime.ticks_us(), _t))
+finally:
+    sys.path.remove({dir!r})
+    try:
+        del sys.modules[{module!r}]
+    except KeyError:
+        pass
+    _m = _f = None
+    gc.collect()
+"""
+BenchProgressCallback = Union[None, Callable[[int, int, str],None]]
+Variant = Tuple[str, Union[List[str], None]]
+
+class BenchResult():
+    def __init__(self, name:str, options:Union[List[str], None], repeat:int):
+        self.name = name
+        self.options = options
+        self.repeat = repeat
+        self.size = 0
+        self.total_us = None
+        self.error = None
+
+    @property
+    def per_call_us(self) -> Union[float, None]:
+        if self.total_us == None:
+            return None
+        return self.total_us / self.repeat
+
+def run_benchmark(fe:FileExplorer, source:PathLike, function="bench", variants:List[Variant]=DEFAULT_VARIANTS, arch=None, repeat=10, progress_callback:BenchProgressCallback=None) -> List[BenchResult]:
+    '''
+    Upload the module source compiled each way in variants, call function() once to warm up
+    and then repeat times, timed on the board with utime.ticks_us.
+    '''
+    module = PurePosixPath(syspath.basename(source)).stem
+    results = []
+    try:
+        for index, (name, options) in enumerate(variants):
+            if progress_callback != None:
+                progress_callback(index, len(variants), name)
+            result = BenchResult(name, options, repeat)
+            results.append(result)
+            remote_dir = PurePosixPath(BENCH_REMOTE_DIR).joinpath(str(index))
+            try:
+                if options == None:
+                    with open(source, "rb") as f:
+                        data = f.read()
+                    remote_file = remote_dir.joinpath(module + ".py")
+                else:
+                    data = get_compiled_file_content(source, arch=arch, options=options)
+                    remote_file = remote_dir.joinpath(module + ".mpy")
+                result.size = len(data)
+                fe.upload(remote_file, data)
+                out = fe.exec(BENCH_COMMAND.format(dir=str(remote_dir), module=module, function=function, repeat=repeat))
+                result.total_us = int(out.decode("utf-8").strip().splitlines()[-1])
+            except Exception as e:
+                result.error = error_message(e)
+    finally:
+        fe.rmtree(BENCH_REMOTE_DIR)
+    return results
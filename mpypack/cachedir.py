@@ -0,0 +1,23 @@
+import os, stat, sys
+from os import path as syspath
+
+def user_cache_dir(name:str) -> str:
+    ''' per-user cache folder: $XDG_CACHE_HOME/mpypack/name, ~/.cache/mpypack/name or %LOCALAPPDATA%\\mpypack\\name '''
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or syspath.expanduser("~\\AppData\\Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or syspath.expanduser("~/.cache")
+    return syspath.join(base, "mpypack", name)
+
+def make_cache_dir(folder:str):
+    # private to the user, the mode only applies to the folders created here
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+
+def owned_by_user(path) -> bool:
+    ''' a regular file of the current user that nobody else can write, cache entries are trusted only then '''
+    st = os.lstat(path)
+    if not stat.S_ISREG(st.st_mode):
+        return False
+    if not hasattr(os, "getuid"):
+        return True # windows: the profile folder is private
+    return st.st_uid == os.getuid() and not (st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
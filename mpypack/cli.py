@@ -1,15 +1,20 @@
+# only light modules here, the serial and sync stack is imported by the commands that use it
 try:
-    from fileexplorer import FileExplorer, FileExplorerStatus
-    from filesync import FileSync, PATTERN_INCLUDE, PATTERN_EXCLUDE
+    from filecopy import COPY_STRATEGIES
+    from fsimage import IMAGE_FORMATS
+    from tracing import tracer
+    from progress import ProgressTracker, PHASE_DONE
     from mpycross import set_mpy_cross_executable
 except ImportError:
-    from mpypack.fileexplorer import FileExplorer, FileExplorerStatus
-    from mpypack.filesync import FileSync, PATTERN_INCLUDE, PATTERN_EXCLUDE
+    from mpypack.filecopy import COPY_STRATEGIES
+    from mpypack.fsimage import IMAGE_FORMATS
+    from mpypack.tracing import tracer
+    from mpypack.progress import ProgressTracker, PHASE_DONE
     from mpypack.mpycross import set_mpy_cross_executable
 
-import re, platform
+import re, shlex, json, sys
 from configparser import ConfigParser
-from os.path import exists
+from os.path import exists, abspath, normcase
 
 import click
 
@@ -17,9 +22,20 @@ import click
 ENV_PREFIX = "MPYPACK_{}"
 DEFAULT_CONFIG_FILE = ".mpypack.conf"
 CONFIG_FILE_SECTION = "mpypack_config"
+PROFILE_SECTION_PREFIX = "profile:"
+PROFILE_VARIANTS = ["py", "mpy", "deployed"] # importprofile.VARIANTS
+SIMBENCH_SCENARIOS = ["small", "big", "deep"] # simbench.SCENARIOS
+PROGRESS_LINE = "line"
+PROGRESS_JSON = "json"
+PROGRESS_NONE = "none"
 
 CONFIG_OPTION_PORT = "port"
 CONFIG_OPTION_BAUD = "baud"
+CONFIG_OPTION_FAST_BAUD = "fastbaud"
+CONFIG_OPTION_REPL_UART = "repluart"
+CONFIG_OPTION_WINDOW = "window"
+CONFIG_OPTION_WINDOW_BYTES = "windowbytes"
+CONFIG_OPTION_AGENT = "agent"
 CONFIG_OPTION_COMPILE = "compile"
 CONFIG_OPTION_ARCH = "arch"
 CONFIG_OPTION_MPYCORSS = "mpycross"
@@ -30,6 +46,23 @@ CONFIG_OPTION_EXCLUDE = "exclude"
 CONFIG_OPTION_HIDDEN = "hidden"
 CONFIG_OPTION_SOURCE = "source"
 CONFIG_OPTION_OUTPUT = "output"
+CONFIG_OPTION_COPY = "copy"
+CONFIG_OPTION_JOBS = "jobs"
+CONFIG_OPTION_REACHABLE = "reachable"
+CONFIG_OPTION_ENTRY = "entry"
+CONFIG_OPTION_DATA = "data"
+CONFIG_OPTION_MINIFY = "minify"
+CONFIG_OPTION_FREEZE = "freeze"
+CONFIG_OPTION_MINIFY_LINES = "minifylines"
+CONFIG_OPTION_IMAGE = "image"
+CONFIG_OPTION_IMAGE_FS = "imagefs"
+CONFIG_OPTION_BLOCK_SIZE = "blocksize"
+CONFIG_OPTION_BLOCK_COUNT = "blockcount"
+CONFIG_OPTION_TARGETS = "targets"
+CONFIG_OPTION_PULL_LOCAL = "pulllocal"
+CONFIG_OPTION_PULL_REMOTE = "pullremote"
+CONFIG_OPTION_PROGRESS = "progress"
+CONFIG_OPTION_PROGRESS_INTERVAL = "progressinterval"
 
 # global value -------->
 conf:ConfigParser = ConfigParser()
@@ -49,6 +82,54 @@ def print_progress(p, t, sub_p, sub_t, op, name):
 def clear_console(message="Done."):
     print("{}\r{}".format(" "*80, message))
 
+def format_size(size):
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024 or unit == "MB":
+            return "{:.0f}{}".format(size, unit) if unit == "B" else "{:.1f}{}".format(size, unit)
+        size /= 1024
+
+def print_progress_event(event):
+    # one line, repainted: 3/10 42% 12.0KB/28.5KB 5.1KB/s ETA 3s upload: lib/foo.py
+    if event.phase == PHASE_DONE:
+        return # finish_progress prints the totals
+    parts = []
+    if event.files_total > 0:
+        parts.append("{}/{}".format(event.files_done, event.files_total))
+    if event.bytes_total > 0:
+        parts.append("{:.0f}%".format(event.bytes_done * 100 / event.bytes_total))
+        parts.append("{}/{}".format(format_size(event.bytes_done), format_size(event.bytes_total)))
+    if event.rate > 0:
+        parts.append("{}/s".format(format_size(event.rate)))
+    if event.eta_s != None:
+        parts.append("ETA {:.0f}s".format(event.eta_s))
+    parts.append("{}: {}".format(event.phase, event.path))
+    print("{}\r {}".format(" "*80, " ".join(parts)), end="\r")
+
+def get_progress():
+    ''' a ProgressTracker rendering as configured with --progress, None for none '''
+    mode = get_config(CONFIG_OPTION_PROGRESS, PROGRESS_LINE)
+    interval = float(get_config(CONFIG_OPTION_PROGRESS_INTERVAL, 0.2))
+    if mode == PROGRESS_NONE:
+        return None
+    if mode == PROGRESS_JSON:
+        # stdout carries the events only, everything else (errors, dropped files, --profile) goes to stderr
+        events = sys.stdout
+        sys.stdout = sys.stderr
+        return ProgressTracker(lambda event: click.echo(json.dumps(event.to_dict()), file=events), interval)
+    return ProgressTracker(print_progress_event, interval)
+
+def finish_progress(progress, message="Done."):
+    # json lines end with the done event, the console line with message and the totals
+    if progress == None:
+        clear_console(message)
+        return
+    event = progress.finish()
+    if get_config(CONFIG_OPTION_PROGRESS, PROGRESS_LINE) == PROGRESS_JSON:
+        return
+    if event.bytes_done > 0:
+        message = "{} {} in {:.1f}s, {}/s".format(message, format_size(event.bytes_done), event.elapsed_s, format_size(event.rate))
+    clear_console(message)
+
 def windows_full_port_name(port_name):
     # Helper function to generate proper Windows COM port paths.  Apparently
     # Windows requires COM ports above 9 to have a special path, where ports below
@@ -87,16 +168,109 @@ def print_config():
         for o in conf[s].keys():
             click.echo("{}: {}".format(o, conf[s][o]))
 
+def get_compile_profiles():
+    # [profile:NAME] sections, in file order
+    try:
+        from filesync import CompileProfile
+    except ImportError:
+        from mpypack.filesync import CompileProfile
+    profiles = []
+    for section in conf.sections():
+        if not section.startswith(PROFILE_SECTION_PREFIX):
+            continue
+        patterns = [p.strip() for p in conf[section].get("pattern", "").split(",") if p.strip()]
+        options = shlex.split(conf[section].get("options", ""))
+        profiles.append(CompileProfile(section[len(PROFILE_SECTION_PREFIX):], patterns, options))
+    return profiles
+
 def get_file_explorer():
     # ensure required options
     if get_config(CONFIG_OPTION_PORT) == None:
         raise click.BadParameter("Missing option '-p' / '--port'")
     if get_config(CONFIG_OPTION_BAUD) == None:
         raise click.BadParameter("Missing option '-b' / '--baud'")
+    try:
+        from fileexplorer import FileExplorer
+    except ImportError:
+        from mpypack.fileexplorer import FileExplorer
+    import platform
     port = get_config(CONFIG_OPTION_PORT)
     if platform.system() == "Windows":
         port = windows_full_port_name(port)
-    return FileExplorer(port, get_config(CONFIG_OPTION_BAUD))
+    fast_baud = get_config(CONFIG_OPTION_FAST_BAUD)
+    if fast_baud != None:
+        fast_baud = int(fast_baud)
+    repl_uart = get_config(CONFIG_OPTION_REPL_UART)
+    if repl_uart != None:
+        repl_uart = int(repl_uart)
+    window_bytes = get_config(CONFIG_OPTION_WINDOW_BYTES)
+    if window_bytes != None:
+        window_bytes = int(window_bytes)
+    return FileExplorer(port, get_config(CONFIG_OPTION_BAUD), fast_baudrate=fast_baud, repl_uart=repl_uart,
+        pipeline_window=int(get_config(CONFIG_OPTION_WINDOW)), pipeline_bytes=window_bytes,
+        use_agent=get_config(CONFIG_OPTION_AGENT).lower() == "true"
+    )
+
+def get_selection_options(reachable, entry, data):
+    # import graph selection, keyword arguments for FileSync
+    update_config(CONFIG_OPTION_REACHABLE, reachable, False)
+    update_config(CONFIG_OPTION_ENTRY, entry, "main.py,boot.py")
+    update_config(CONFIG_OPTION_DATA, data)
+    if get_config(CONFIG_OPTION_REACHABLE).lower() != "true":
+        return {}
+    c_entry = [e.strip() for e in get_config(CONFIG_OPTION_ENTRY).split(",") if e.strip()]
+    c_data = get_config(CONFIG_OPTION_DATA)
+    c_data = [] if c_data == None else [re.compile(c_data)]
+    return { "entry_points": c_entry, "data_pattern": c_data }
+
+def print_dropped(fs):
+    if len(fs.dropped_files) > 0:
+        click.echo("Dropped {} unreachable files:".format(len(fs.dropped_files)))
+        for f in sorted(str(f) for f in fs.dropped_files):
+            click.echo("  {}".format(f))
+
+def parse_build_targets(value:str):
+    # "arch=folder,arch=folder" to build_matrix targets, an empty arch compiles without -march
+    targets = []
+    for item in value.split(","):
+        item = item.strip()
+        if item == "":
+            continue
+        if not "=" in item:
+            raise click.BadParameter("Build target is not ARCH=FOLDER: {}".format(item))
+        arch, folder = item.split("=", 1)
+        targets.append((arch.strip() or None, folder.strip()))
+    return targets
+
+def get_minify_options(minify, minify_lines):
+    # keyword arguments for FileSync sync / build
+    update_config(CONFIG_OPTION_MINIFY, minify, False)
+    update_config(CONFIG_OPTION_MINIFY_LINES, minify_lines, False)
+    return {
+        "minify": get_config(CONFIG_OPTION_MINIFY).lower() == "true",
+        "keep_lines": get_config(CONFIG_OPTION_MINIFY_LINES).lower() == "true",
+    }
+
+def minify_options(func):
+    func = click.option("--minify-lines", "minify_lines", default=None, type=click.BOOL, envvar=ENV_PREFIX.format("MINIFYLINES"),
+        help="Keep line numbers when minifying, for readable tracebacks. (default False)"
+    )(func)
+    func = click.option("--minify", "minify", default=None, type=click.BOOL, envvar=ENV_PREFIX.format("MINIFY"),
+        help="Strip docstrings, comments, annotations and indentation from .py files that are not compiled. (default False)"
+    )(func)
+    return func
+
+def selection_options(func):
+    func = click.option("--data", "data", default=None, type=click.STRING, envvar=ENV_PREFIX.format("DATA"),
+        help="With --reachable, RegExp of data files to keep. (default None)"
+    )(func)
+    func = click.option("--entry", "entry", default=None, type=click.STRING, envvar=ENV_PREFIX.format("ENTRY"),
+        help="With --reachable, comma separated entry points. (default main.py,boot.py)"
+    )(func)
+    func = click.option("--reachable", "reachable", default=None, type=click.BOOL, envvar=ENV_PREFIX.format("REACHABLE"),
+        help="Only modules imported from the entry points, and data files. (default False)"
+    )(func)
+    return func
 
 # cli function -------->
 @click.group()
@@ -109,15 +283,58 @@ def get_file_explorer():
 @click.option( "-b", "--baud", "baud", default=None, type=click.INT, envvar=ENV_PREFIX.format("BAUD"),
     help="Baud rate for the serial connection (default 115200).",
 )
+@click.option( "-f", "--fast-baud", "fast_baud", default=None, type=click.INT, envvar=ENV_PREFIX.format("FASTBAUD"),
+    help="Try to switch to this baud rate after connecting, fall back to '--baud' if the board can't keep up.",
+)
+@click.option( "--repl-uart", "repl_uart", default=None, type=click.INT, envvar=ENV_PREFIX.format("REPLUART"),
+    help="machine.UART id of the REPL for '--fast-baud'. (default 0, no switch on ports with a USB REPL like rp2 and stm32)",
+)
+@click.option( "-w", "--window", "window", default=None, type=click.INT, envvar=ENV_PREFIX.format("WINDOW"),
+    help="Max commands sent ahead while the board is still busy, 1 to disable pipelining. (default 4)",
+)
+@click.option( "--window-bytes", "window_bytes", default=None, type=click.INT, envvar=ENV_PREFIX.format("WINDOWBYTES"),
+    help="Max bytes queued behind the running command, must fit into the board's stdin buffer. (default 256, 4096 on ports with a USB REPL)",
+)
+@click.option( "--agent", "agent", default=None, type=click.BOOL, envvar=ENV_PREFIX.format("AGENT"),
+    help="Install a small agent on the board and use its binary protocol for file operations, fall back to the REPL if it can't be installed. (default False)",
+)
+@click.option("--profile", "profile", is_flag=True, default=False,
+    help="Print a JSON summary of round trips, bytes on the wire and time per operation when done.",
+)
+@click.option("--trace", "trace", default=None, type=click.STRING,
+    help="Write a Chrome trace timeline (chrome://tracing, Perfetto) of the run to this file.",
+)
+@click.option("--progress", "progress", default=None, type=click.Choice([PROGRESS_LINE, PROGRESS_JSON, PROGRESS_NONE]), envvar=ENV_PREFIX.format("PROGRESS"),
+    help="Progress of transfers: a console line, JSON lines on stdout (bytes, throughput, ETA) or none. (default line)",
+)
+@click.option("--progress-interval", "progress_interval", default=None, type=click.FLOAT, envvar=ENV_PREFIX.format("PROGRESSINTERVAL"),
+    help="Min seconds between two progress updates. (default 0.2)",
+)
 @click.version_option()
-def cli(config, port, baud):
+@click.pass_context
+def cli(ctx, config, port, baud, fast_baud, repl_uart, window, window_bytes, agent, profile, trace, progress, progress_interval):
     global conf
+    if profile or trace != None:
+        tracer.enable()
+        def report():
+            if trace != None:
+                tracer.write_chrome_trace(trace)
+            if profile:
+                click.echo(json.dumps(tracer.summary(), indent=2))
+        ctx.call_on_close(report)
     # read config file
     if exists(config):
         conf.read(config)
     # set default config
     update_config(CONFIG_OPTION_PORT, port)
     update_config(CONFIG_OPTION_BAUD, baud, 115200)
+    update_config(CONFIG_OPTION_FAST_BAUD, fast_baud)
+    update_config(CONFIG_OPTION_REPL_UART, repl_uart)
+    update_config(CONFIG_OPTION_WINDOW, window, 4)
+    update_config(CONFIG_OPTION_WINDOW_BYTES, window_bytes)
+    update_config(CONFIG_OPTION_AGENT, agent, False)
+    update_config(CONFIG_OPTION_PROGRESS, progress, PROGRESS_LINE)
+    update_config(CONFIG_OPTION_PROGRESS_INTERVAL, progress_interval, 0.2)
 
 @cli.command()
 def repl():
@@ -153,10 +370,28 @@ def repl():
 @click.option("-m", "--mpycross", "mpycross", default=None, type=click.STRING, envvar=ENV_PREFIX.format("MPYCORSS"),
     help="mpy-cross exec path. Required to compile .py file. Script will search current workspace folder and mpy_cross module`s folder. If there is no mpy-cross executable, you should set it manually."
 )
-def sync(local, remote, include, exclude, hidden, compile, arch, mpycross):
+@click.option("--walk", "walk", is_flag=True, default=False,
+    help="Walk the board instead of trusting its manifest, finds files changed by hand."
+)
+@click.option("--dry-run", "dry_run", is_flag=True, default=False,
+    help="Only print the operations a sync would do and an estimate of its time, the board is not changed."
+)
+@click.option("--probe", "probe", is_flag=True, default=False,
+    help="With --dry-run, measure the link before planning and record the result in .mpypack_link.json."
+)
+@click.option("--json", "as_json", is_flag=True, default=False,
+    help="With --dry-run, print the plan as json."
+)
+@selection_options
+@minify_options
+def sync(local, remote, include, exclude, hidden, compile, arch, mpycross, walk, dry_run, probe, as_json, reachable, entry, data, minify, minify_lines):
     '''
     Sync local file to mpy board.
     '''
+    try:
+        from filesync import FileSync, PATTERN_INCLUDE, PATTERN_EXCLUDE
+    except ImportError:
+        from mpypack.filesync import FileSync, PATTERN_INCLUDE, PATTERN_EXCLUDE
     # set default config
     update_config(CONFIG_OPTION_LOCAL, local, ".")
     update_config(CONFIG_OPTION_REMOTE, remote, "/")
@@ -177,13 +412,41 @@ def sync(local, remote, include, exclude, hidden, compile, arch, mpycross):
     c_exclude = get_config(CONFIG_OPTION_EXCLUDE)
     c_exclude = PATTERN_EXCLUDE if c_exclude == None else [re.compile(c_exclude)]
     c_mpycross = get_config(CONFIG_OPTION_MPYCORSS)
+    c_selection = get_selection_options(reachable, entry, data)
+    c_minify = get_minify_options(minify, minify_lines)
     # exec
     if c_mpycross != None:
         set_mpy_cross_executable(c_mpycross)
     file_explorer = get_file_explorer()
-    fs = FileSync(file_explorer, local_path=c_local, remote_path=c_remote, include_pattern=c_include, exclude_pattern=c_exclude)
-    fs.sync_dir_remote_with_local(compile=c_compile, arch=c_arch, ignore_hidden=(not c_hidden), progress_callback=print_progress)
-    clear_console()
+    fs = FileSync(file_explorer, local_path=c_local, remote_path=c_remote, include_pattern=c_include, exclude_pattern=c_exclude, compile_profiles=get_compile_profiles(), **c_selection)
+    if dry_run:
+        try:
+            from plan import LinkModel, load_link_model, save_link_model, probe_link
+        except ImportError:
+            from mpypack.plan import LinkModel, load_link_model, save_link_model, probe_link
+        c_port = get_config(CONFIG_OPTION_PORT)
+        c_baud = int(get_config(CONFIG_OPTION_BAUD))
+        with file_explorer:
+            # link model: fresh probe, then a recorded probe, then the baudrate
+            agent = file_explorer.agent_active
+            if probe:
+                link = probe_link(file_explorer)
+                save_link_model(link, c_port, c_baud, agent)
+            else:
+                link = load_link_model(c_port, c_baud, agent)
+                if link == None:
+                    link = LinkModel.from_baudrate(c_baud)
+            plan = fs.plan_sync(link, compile=c_compile, arch=c_arch, ignore_hidden=(not c_hidden), walk_remote=walk, **c_minify)
+        if as_json:
+            click.echo(json.dumps(plan.to_dict(), indent=2))
+        else:
+            click.echo(plan.report())
+            print_dropped(fs)
+        return
+    progress = get_progress()
+    fs.sync_dir_remote_with_local(compile=c_compile, arch=c_arch, ignore_hidden=(not c_hidden), progress_callback=progress, walk_remote=walk, **c_minify)
+    finish_progress(progress)
+    print_dropped(fs)
 
 @cli.command()
 @click.option("-r", "--remote", "remote", default=None, type=click.STRING, envvar=ENV_PREFIX.format("REMOTE"),
@@ -213,15 +476,60 @@ def sync(local, remote, include, exclude, hidden, compile, arch, mpycross):
 @click.option("-m", "--mpycross", "mpycross", default=None, type=click.STRING, envvar=ENV_PREFIX.format("MPYCORSS"),
     help="mpy-cross exec path. Required to compile .py file. Script will search current workspace folder and mpy_cross module`s folder. If there is no mpy-cross executable, you should set it manually."
 )
-def build(remote, source, output, include, exclude, hidden, compile, arch, mpycross):
+@click.option("--clean", "clean", is_flag=True, default=False,
+    help="Remove the output folder and rebuild everything, instead of only the changed files."
+)
+@click.option("--copy", "copy", default=None, type=click.Choice(COPY_STRATEGIES), envvar=ENV_PREFIX.format("COPY"),
+    help="How not compiled files are copied; auto tries reflink and copy_file_range first, link makes hard links. (default auto)"
+)
+@click.option("-j", "--jobs", "jobs", default=None, type=click.INT, envvar=ENV_PREFIX.format("JOBS"),
+    help="Number of files copied in parallel. (default 1)"
+)
+@click.option("-t", "--target", "target", multiple=True, type=click.STRING, envvar=ENV_PREFIX.format("TARGETS"),
+    help="ARCH=FOLDER, build for several archs in one pass, replaces --arch and --output. Can be repeated. (default None)"
+)
+@click.option("--freeze", "freeze", default=None, type=click.STRING, envvar=ENV_PREFIX.format("FREEZE"),
+    help="Write the modules to this MicroPython manifest.py for freezing, the output folder keeps the data files. (default None)"
+)
+@click.option("--image", "image", default=None, type=click.STRING, envvar=ENV_PREFIX.format("IMAGE"),
+    help="Also pack the output folder into this filesystem image, for flashing to the vfs partition. (default None)"
+)
+@click.option("--image-fs", "image_fs", default=None, type=click.Choice(IMAGE_FORMATS), envvar=ENV_PREFIX.format("IMAGEFS"),
+    help="Filesystem of the image, littlefs needs the littlefs-python package. (default littlefs)"
+)
+@click.option("--block-size", "block_size", default=None, type=click.INT, envvar=ENV_PREFIX.format("BLOCKSIZE"),
+    help="Image block size in bytes. (default 4096 for littlefs, 512 for fat)"
+)
+@click.option("--block-count", "block_count", default=None, type=click.INT, envvar=ENV_PREFIX.format("BLOCKCOUNT"),
+    help="Image block count, partition size / block size. Required with --image."
+)
+@selection_options
+@minify_options
+def build(remote, source, output, include, exclude, hidden, compile, arch, mpycross, clean, copy, jobs, target, freeze, image, image_fs, block_size, block_count, reachable, entry, data, minify, minify_lines):
     '''
     Pack up source folder.
     Copy (and maybe compile) source file to another folder.
     '''
+    try:
+        from filesync import FileSync, PATTERN_INCLUDE, PATTERN_EXCLUDE
+    except ImportError:
+        from mpypack.filesync import FileSync, PATTERN_INCLUDE, PATTERN_EXCLUDE
+    try:
+        from fsimage import ImageError
+    except ImportError:
+        from mpypack.fsimage import ImageError
     # set default config
     update_config(CONFIG_OPTION_REMOTE, remote, "/")
     update_config(CONFIG_OPTION_SOURCE, source, ".")
     update_config(CONFIG_OPTION_OUTPUT, output, ".build")
+    update_config(CONFIG_OPTION_COPY, copy, "auto")
+    update_config(CONFIG_OPTION_JOBS, jobs, 1)
+    update_config(CONFIG_OPTION_TARGETS, ",".join(target) if len(target) > 0 else None)
+    update_config(CONFIG_OPTION_FREEZE, freeze)
+    update_config(CONFIG_OPTION_IMAGE, image)
+    update_config(CONFIG_OPTION_IMAGE_FS, image_fs, "littlefs")
+    update_config(CONFIG_OPTION_BLOCK_SIZE, block_size)
+    update_config(CONFIG_OPTION_BLOCK_COUNT, block_count)
     update_config(CONFIG_OPTION_INCLUDE, include)
     update_config(CONFIG_OPTION_EXCLUDE, exclude)
     update_config(CONFIG_OPTION_HIDDEN, hidden, False)
@@ -232,6 +540,21 @@ def build(remote, source, output, include, exclude, hidden, compile, arch, mpycr
     c_remote = get_config(CONFIG_OPTION_REMOTE)
     c_source = get_config(CONFIG_OPTION_SOURCE)
     c_output = get_config(CONFIG_OPTION_OUTPUT)
+    c_copy = get_config(CONFIG_OPTION_COPY)
+    c_jobs = int(get_config(CONFIG_OPTION_JOBS))
+    c_targets = get_config(CONFIG_OPTION_TARGETS)
+    c_targets = [] if c_targets == None else parse_build_targets(c_targets)
+    c_freeze = get_config(CONFIG_OPTION_FREEZE)
+    c_image = get_config(CONFIG_OPTION_IMAGE)
+    c_image_fs = get_config(CONFIG_OPTION_IMAGE_FS)
+    c_block_size = get_config(CONFIG_OPTION_BLOCK_SIZE)
+    c_block_size = None if c_block_size == None else int(c_block_size)
+    c_block_count = get_config(CONFIG_OPTION_BLOCK_COUNT)
+    c_block_count = None if c_block_count == None else int(c_block_count)
+    if c_image != None and c_block_count == None:
+        raise click.BadParameter("Missing option '--block-count'")
+    if len(c_targets) > 1 and (c_freeze != None or c_image != None):
+        raise click.BadParameter("'--freeze' and '--image' need a single build target")
     c_compile = get_config(CONFIG_OPTION_COMPILE).lower() == "true"
     c_arch = get_config(CONFIG_OPTION_ARCH)
     c_hidden = get_config(CONFIG_OPTION_HIDDEN).lower() == "true"
@@ -240,12 +563,167 @@ def build(remote, source, output, include, exclude, hidden, compile, arch, mpycr
     c_exclude = get_config(CONFIG_OPTION_EXCLUDE)
     c_exclude = PATTERN_EXCLUDE if c_exclude == None else [re.compile(c_exclude)]
     c_mpycross = get_config(CONFIG_OPTION_MPYCORSS)
+    c_selection = get_selection_options(reachable, entry, data)
+    c_minify = get_minify_options(minify, minify_lines)
     # exec
     if c_mpycross != None:
         set_mpy_cross_executable(c_mpycross)
-    fs = FileSync(None, local_path=c_source, remote_path=c_remote, include_pattern=c_include, exclude_pattern=c_exclude)
-    fs.build(compile=c_compile, arch=c_arch, ignore_hidden=(not c_hidden), target_folder=c_output, progress_callback=print_progress)
-    clear_console()
+    fs = FileSync(None, local_path=c_source, remote_path=c_remote, include_pattern=c_include, exclude_pattern=c_exclude, compile_profiles=get_compile_profiles(), **c_selection)
+    if len(c_targets) == 0:
+        c_targets = [(c_arch, c_output)]
+    progress = get_progress()
+    try:
+        fs.build_matrix(c_targets, compile=c_compile, ignore_hidden=(not c_hidden), progress_callback=progress, clean=clean, copy_strategy=c_copy, jobs=c_jobs, freeze_manifest=c_freeze,
+            image=c_image, image_format=c_image_fs, block_size=c_block_size, block_count=c_block_count, **c_minify)
+    except ImageError as e:
+        raise click.ClickException(str(e))
+    finish_progress(progress)
+    print_dropped(fs)
+
+@cli.command()
+@click.option("-o", "--output", "output", default=None, type=click.STRING, envvar=ENV_PREFIX.format("OUTPUT"),
+    help="Build output folder to deploy. (default .build)"
+)
+@click.option("-r", "--remote", "remote", default=None, type=click.STRING, envvar=ENV_PREFIX.format("REMOTE"),
+    help="Remote path to sync, same as build. (default /)"
+)
+@click.option("--walk", "walk", is_flag=True, default=False,
+    help="Walk the board instead of trusting its manifest, finds files changed by hand."
+)
+def deploy(output, remote, walk):
+    '''
+    Sync a build output folder to mpy board.
+    Files are compared by the manifest written by build, nothing is compiled.
+    '''
+    try:
+        from filesync import FileSync
+    except ImportError:
+        from mpypack.filesync import FileSync
+    # set default config
+    update_config(CONFIG_OPTION_OUTPUT, output, ".build")
+    update_config(CONFIG_OPTION_REMOTE, remote, "/")
+    # get config
+    c_output = get_config(CONFIG_OPTION_OUTPUT)
+    c_remote = get_config(CONFIG_OPTION_REMOTE)
+    # exec
+    file_explorer = get_file_explorer()
+    fs = FileSync(file_explorer, local_path=c_output, remote_path=c_remote)
+    progress = get_progress()
+    fs.deploy(progress_callback=progress, walk_remote=walk)
+    finish_progress(progress)
+
+@cli.command()
+@click.option("-r", "--remote", "remote", default=None, type=click.STRING, envvar=ENV_PREFIX.format("PULLREMOTE"),
+    help="Remote path to pull. (default /)"
+)
+@click.option("-l", "--local", "local", default=None, type=click.STRING, envvar=ENV_PREFIX.format("PULLLOCAL"),
+    help="Local path to mirror the remote path into, required with --delete. (default .)"
+)
+@click.option("-i", "--include", "include", default=None, type=click.STRING, envvar=ENV_PREFIX.format("INCLUDE"),
+    help="Include path RegExp(test on remote path)."
+)
+@click.option("-e", "--exclude", "exclude", default=None, type=click.STRING, envvar=ENV_PREFIX.format("EXCLUDE"),
+    help="Exclude path RegExp(test on remote path)."
+)
+@click.option("-h", "--hidden", "hidden", default=None, type=click.BOOL, envvar=ENV_PREFIX.format("HIDDEN"),
+    help="Pull hidden file and folder(name start with '.'). (default False)"
+)
+@click.option("--delete", "delete", is_flag=True, default=False,
+    help="Delete local files that are not on the board."
+)
+def pull(remote, local, include, exclude, hidden, delete):
+    '''
+    Mirror a folder of the board to a local folder.
+    Files that are identical locally (same size and sha256 on the board) are skipped.
+    '''
+    try:
+        from filesync import FileSync, PATTERN_INCLUDE, PATTERN_EXCLUDE
+    except ImportError:
+        from mpypack.filesync import FileSync, PATTERN_INCLUDE, PATTERN_EXCLUDE
+    update_config(CONFIG_OPTION_PULL_REMOTE, remote, "/")
+    update_config(CONFIG_OPTION_PULL_LOCAL, local)
+    update_config(CONFIG_OPTION_INCLUDE, include)
+    update_config(CONFIG_OPTION_EXCLUDE, exclude)
+    update_config(CONFIG_OPTION_HIDDEN, hidden, False)
+    # get config
+    c_remote = get_config(CONFIG_OPTION_PULL_REMOTE)
+    c_local = get_config(CONFIG_OPTION_PULL_LOCAL)
+    c_include = get_config(CONFIG_OPTION_INCLUDE)
+    c_include = PATTERN_INCLUDE if c_include == None else [re.compile(c_include)]
+    c_exclude = get_config(CONFIG_OPTION_EXCLUDE)
+    c_exclude = PATTERN_EXCLUDE if c_exclude == None else [re.compile(c_exclude)]
+    c_hidden = get_config(CONFIG_OPTION_HIDDEN).lower() == "true"
+    if c_local == None:
+        if delete:
+            raise click.BadParameter("Missing option '-l' / '--local', --delete needs an explicit local path")
+        c_local = "."
+    if delete and normcase(abspath(c_local)) == normcase(abspath(get_config(CONFIG_OPTION_LOCAL, "."))):
+        raise click.BadParameter("'{}' is the sync source folder, --delete would remove sources that are not on the board".format(c_local))
+    # exec
+    file_explorer = get_file_explorer()
+    fs = FileSync(file_explorer, local_path=c_local, remote_path=c_remote, include_pattern=c_include, exclude_pattern=c_exclude)
+    progress = get_progress()
+    fs.sync_local_with_remote(ignore_hidden=(not c_hidden), delete_exist_file=delete, progress_callback=progress)
+    finish_progress(progress)
+
+@cli.command()
+@click.argument("local_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--no-follow", "no_follow", is_flag=True, default=False,
+    help="Only start the script, don't wait for its output."
+)
+@click.option("-c", "--compile", "compile", is_flag=True, default=False,
+    help="Compile the script with mpy-cross and import it from RAM, __name__ is not '__main__' then."
+)
+@click.option("-a", "--arch", "arch", default=None, type=click.STRING, envvar=ENV_PREFIX.format("ARCH"),
+    help="Set architecture for native emitter, with --compile."
+)
+@click.option("-m", "--mpycross", "mpycross", default=None, type=click.STRING, envvar=ENV_PREFIX.format("MPYCORSS"),
+    help="mpy-cross executable path."
+)
+@minify_options
+def run(local_file, no_follow, compile, arch, mpycross, minify, minify_lines):
+    '''
+    Run a local script on the board from RAM.
+    Output is printed as it arrives, Ctrl-C interrupts the script. Nothing is written to the board.
+    '''
+    try:
+        from fileexplorer import run_mpy_source
+    except ImportError:
+        from mpypack.fileexplorer import run_mpy_source
+    update_config(CONFIG_OPTION_ARCH, arch)
+    update_config(CONFIG_OPTION_MPYCORSS, mpycross)
+    c_arch = get_config(CONFIG_OPTION_ARCH)
+    c_mpycross = get_config(CONFIG_OPTION_MPYCORSS)
+    c_minify = get_minify_options(minify, minify_lines)
+    # prepare the source
+    if compile:
+        try:
+            from filesync import get_compiled_file_content
+        except ImportError:
+            from mpypack.filesync import get_compiled_file_content
+        if c_mpycross != None:
+            set_mpy_cross_executable(c_mpycross)
+        source = run_mpy_source(get_compiled_file_content(local_file, arch=c_arch)).encode("utf-8")
+    elif c_minify["minify"]:
+        try:
+            from minify import minify_file
+        except ImportError:
+            from mpypack.minify import minify_file
+        source = minify_file(local_file, c_minify["keep_lines"])
+    else:
+        with open(local_file, "rb") as f:
+            source = f.read()
+    # exec
+    stdout = click.get_binary_stream("stdout")
+    def data_consumer(data):
+        stdout.write(data)
+        stdout.flush()
+    file_explorer = get_file_explorer()
+    with file_explorer:
+        error = file_explorer.run(source, data_consumer, follow=(not no_follow))
+    if len(error) > 0:
+        click.echo(error.decode("utf-8", "replace"), err=True, nl=False)
+        sys.exit(1)
 
 @cli.command()
 @click.argument("remote_file", type=click.STRING)
@@ -257,17 +735,203 @@ def get(remote_file, local_file):
     """
     # Get the file contents.
     file_explorer = get_file_explorer()
+    progress = get_progress()
     with file_explorer:
         file = file_explorer.stat(remote_file)
-        def upload_progress_callback(sub_p, sub_t):
-            print_progress(0, 0, sub_p, sub_t, "download", str(file.abspath))
-        contents = file_explorer.download(file, progress_callback=upload_progress_callback)
+        def download_progress_callback(sub_p, sub_t):
+            if progress != None:
+                progress(0, 1, sub_p, sub_t, "download", str(file.abspath))
+        if progress != None:
+            progress.expect({str(file.abspath): file.size})
+        contents = file_explorer.download(file, progress_callback=download_progress_callback)
     # write to file
     if local_file is None:
         local_file = file.name
     with open(local_file, "wb") as f:
         f.write(contents)
-    clear_console()
+    finish_progress(progress)
+
+@cli.command()
+@click.argument("module_file", type=click.STRING)
+@click.option("-f", "--function", "function", default="bench", type=click.STRING,
+    help="Function in the module to time, called without arguments. (default bench)"
+)
+@click.option("-n", "--repeat", "repeat", default=10, type=click.INT,
+    help="Calls to time after one warm up call. (default 10)"
+)
+@click.option("-v", "--variant", "variant", multiple=True, type=click.STRING,
+    help="NAME=MPY_CROSS_OPTIONS, e.g. \"viper=-X emit=viper\", NAME=py ships the source. Can be repeated. (default py, mpy, mpy -O3, native and the compile profiles)"
+)
+@click.option("-a", "--arch", "arch", default=None, type=click.STRING, envvar=ENV_PREFIX.format("ARCH"),
+    help="Compile arch, required by native and viper. (default None)"
+)
+@click.option("-m", "--mpycross", "mpycross", default=None, type=click.STRING, envvar=ENV_PREFIX.format("MPYCORSS"),
+    help="mpy-cross executable path."
+)
+def bench(module_file, function, repeat, variant, arch, mpycross):
+    '''
+    Time a module compiled several ways on the board.
+    '''
+    try:
+        from bench import run_benchmark, DEFAULT_VARIANTS
+    except ImportError:
+        from mpypack.bench import run_benchmark, DEFAULT_VARIANTS
+    update_config(CONFIG_OPTION_ARCH, arch)
+    update_config(CONFIG_OPTION_MPYCORSS, mpycross)
+    c_arch = get_config(CONFIG_OPTION_ARCH)
+    c_mpycross = get_config(CONFIG_OPTION_MPYCORSS)
+    if c_mpycross != None:
+        set_mpy_cross_executable(c_mpycross)
+    if len(variant) > 0:
+        variants = []
+        for v in variant:
+            name, sep, options = v.partition("=")
+            if (options if sep else name).strip() == "py":
+                variants.append((name, None))
+            else:
+                variants.append((name, shlex.split(options)))
+    else:
+        variants = DEFAULT_VARIANTS + [(p.name, p.options) for p in get_compile_profiles()]
+    file_explorer = get_file_explorer()
+    with file_explorer:
+        def bench_progress_callback(p, t, name):
+            print_progress(p, t, 0, 0, "bench", name)
+        results = run_benchmark(file_explorer, module_file, function, variants, c_arch, repeat, progress_callback=bench_progress_callback)
+    clear_console("{} x {}() on the board:".format(repeat, function))
+    times = [r.total_us for r in results if r.total_us != None]
+    fastest = min(times) if len(times) > 0 else None
+    click.echo("{:<16}{:>10}{:>14}{:>14}{:>10}".format("variant", "bytes", "total us", "us / call", "relative"))
+    for r in results:
+        if r.error != None:
+            click.echo("{:<16}{:>10}  {}".format(r.name, r.size, r.error))
+        else:
+            click.echo("{:<16}{:>10}{:>14}{:>14.1f}{:>9.2f}x".format(r.name, r.size, r.total_us, r.per_call_us, r.total_us / fastest if fastest else 1))
+
+@cli.command()
+@click.option("-l", "--local", "local", default=None, type=click.STRING, envvar=ENV_PREFIX.format("LOCAL"),
+    help="Local project path. (default .)"
+)
+@click.option("-r", "--remote", "remote", default=None, type=click.STRING, envvar=ENV_PREFIX.format("REMOTE"),
+    help="Remote path of the deployed variant. (default /)"
+)
+@click.option("-V", "--variant", "variant", multiple=True, type=click.Choice(PROFILE_VARIANTS),
+    help="py and mpy are staged to a temporary folder first, deployed uses what is on the board. Can be repeated. (default py, mpy)"
+)
+@click.option("--entry", "entry", default=None, type=click.STRING, envvar=ENV_PREFIX.format("ENTRY"),
+    help="Comma separated entry points, not imported. (default main.py,boot.py)"
+)
+@click.option("-a", "--arch", "arch", default=None, type=click.STRING, envvar=ENV_PREFIX.format("ARCH"),
+    help="Compile arch. (default None)"
+)
+@click.option("-m", "--mpycross", "mpycross", default=None, type=click.STRING, envvar=ENV_PREFIX.format("MPYCORSS"),
+    help="mpy-cross executable path."
+)
+@click.option("--keep", "keep", is_flag=True, default=False,
+    help="Keep the staged variants on the board, next runs only sync changes."
+)
+@click.option("--json", "as_json", is_flag=True, default=False,
+    help="Print the results as JSON."
+)
+def profile(local, remote, variant, entry, arch, mpycross, keep, as_json):
+    '''
+    Profile import time and RAM of each module on the board.
+    '''
+    try:
+        from importprofile import profile_imports, profile_report, VARIANT_PY, VARIANT_MPY
+    except ImportError:
+        from mpypack.importprofile import profile_imports, profile_report, VARIANT_PY, VARIANT_MPY
+    update_config(CONFIG_OPTION_LOCAL, local, ".")
+    update_config(CONFIG_OPTION_REMOTE, remote, "/")
+    update_config(CONFIG_OPTION_ENTRY, entry, "main.py,boot.py")
+    update_config(CONFIG_OPTION_ARCH, arch)
+    update_config(CONFIG_OPTION_MPYCORSS, mpycross)
+    c_local = get_config(CONFIG_OPTION_LOCAL)
+    c_remote = get_config(CONFIG_OPTION_REMOTE)
+    c_entry = [e.strip() for e in get_config(CONFIG_OPTION_ENTRY).split(",") if e.strip()]
+    c_arch = get_config(CONFIG_OPTION_ARCH)
+    c_mpycross = get_config(CONFIG_OPTION_MPYCORSS)
+    if c_mpycross != None:
+        set_mpy_cross_executable(c_mpycross)
+    variants = list(variant) if len(variant) > 0 else [VARIANT_PY, VARIANT_MPY]
+    file_explorer = get_file_explorer()
+    with file_explorer:
+        def profile_progress_callback(p, t, variant, module):
+            print_progress(p, t, 0, 0, "import " + variant, module)
+        # stdout only carries the results with --json
+        results = profile_imports(file_explorer, c_local, variants, remote_path=c_remote, arch=c_arch, keep_staged=keep, entry_points=c_entry,
+            progress_callback=None if as_json else profile_progress_callback, sync_progress_callback=None if as_json else print_progress)
+    if as_json:
+        click.echo(json.dumps([r.to_dict() for r in results], indent=2))
+    else:
+        clear_console("")
+        click.echo(profile_report(results))
+
+@cli.command()
+@click.option("-s", "--scenario", "scenario", multiple=True, type=click.Choice(SIMBENCH_SCENARIOS),
+    help="small: many small files, big: few big files, deep: deep tree. Can be repeated. (default all)"
+)
+@click.option("--sim-baud", "sim_baud", default=None, type=click.INT,
+    help="Throttle the simulated wire to this baud rate. (default unthrottled)"
+)
+@click.option("--latency", "latency", default=0.0, type=click.FLOAT,
+    help="Seconds the simulated board spends on every command. (default 0)"
+)
+@click.option("--micropython", "micropython", default=None, type=click.STRING,
+    help="Run the commands in this MicroPython unix port executable instead of the built in stand-in."
+)
+@click.option("-o", "--output", "output", default=None, type=click.STRING,
+    help="Write the JSON report to this file."
+)
+@click.option("--startup", "startup", is_flag=True, default=False,
+    help="Time the cli startup (--help of a few commands) instead of the transfer scenarios."
+)
+@click.option("--json", "as_json", is_flag=True, default=False,
+    help="Print the JSON report."
+)
+def simbench(scenario, sim_baud, latency, micropython, output, startup, as_json):
+    '''
+    Benchmark file transfer against a simulated board (posix only).
+    '''
+    try:
+        from simbench import run_simbench, simbench_report, measure_startup, SCENARIOS
+    except ImportError:
+        from mpypack.simbench import run_simbench, simbench_report, measure_startup, SCENARIOS
+    scenarios = list(scenario) if len(scenario) > 0 else list(SCENARIOS)
+    c_window = int(get_config(CONFIG_OPTION_WINDOW))
+    c_window_bytes = get_config(CONFIG_OPTION_WINDOW_BYTES)
+    if c_window_bytes != None:
+        c_window_bytes = int(c_window_bytes)
+    c_agent = get_config(CONFIG_OPTION_AGENT).lower() == "true"
+    def simbench_progress_callback(p, t, scenario, operation):
+        print_progress(p, t, 0, 0, operation, scenario)
+    results = []
+    startup_results = []
+    if startup:
+        startup_results = measure_startup()
+    else:
+        # stdout only carries the report with --json
+        results = run_simbench(scenarios, sim_baud, latency, micropython, c_window, c_window_bytes, c_agent,
+            progress_callback=None if as_json else simbench_progress_callback)
+    report = simbench_report(results, {
+        "baudrate": sim_baud, "latency": latency, "micropython": micropython,
+        "window": c_window, "window_bytes": c_window_bytes, "agent": c_agent,
+    }, startup_results)
+    if not as_json:
+        clear_console("")
+    if output != None:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+    if startup:
+        click.echo("{:<24}{:>10}{:>10}".format("command", "min s", "median s"))
+        for r in startup_results:
+            click.echo("{:<24}{:>10.3f}{:>10.3f}".format(r["command"], r["min_s"], r["median_s"]))
+        return
+    click.echo("{:<10}{:<10}{:>8}{:>12}{:>12}{:>10}".format("scenario", "operation", "trips", "to board", "from board", "seconds"))
+    for r in results:
+        click.echo("{:<10}{:<10}{:>8}{:>12}{:>12}{:>10.3f}".format(r.scenario, r.operation, r.round_trips, r.bytes_to_board, r.bytes_from_board, r.seconds))
 
 def main():
     cli()
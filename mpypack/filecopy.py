@@ -0,0 +1,73 @@
+import os, shutil
+from typing import Iterable, Iterator, Tuple
+
+COPY_AUTO = "auto"       # reflink, then copy_file_range, then copy
+COPY_REFLINK = "reflink" # share blocks with the source (btrfs, xfs), fail if unsupported
+COPY_LINK = "link"       # hard link, output and source are the same file afterwards
+COPY_STREAM = "copy"     # shutil.copyfile, uses sendfile/fcopyfile where possible
+COPY_STRATEGIES = [COPY_AUTO, COPY_REFLINK, COPY_LINK, COPY_STREAM]
+
+FICLONE = 0x40049409 # linux/fs.h _IOW(0x94, 9, int)
+
+def _reflink(src, dst):
+    import fcntl # not on windows
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+def _copy_file_range(src, dst):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = 0
+        while copied < size:
+            n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+            if n == 0:
+                break
+            copied += n
+
+def _link(src, dst):
+    os.link(src, dst)
+
+def copy_file(src, dst, strategy=COPY_AUTO) -> str:
+    ''' copy without reading the file into memory, returns the strategy that was used '''
+    if os.path.lexists(dst):
+        if strategy == COPY_LINK and os.path.exists(dst) and os.path.samefile(src, dst):
+            return COPY_LINK
+        # never write through dst, a link build left it as a hard link to the source
+        os.remove(dst)
+    if strategy == COPY_REFLINK:
+        _reflink(src, dst)
+        return COPY_REFLINK
+    if strategy == COPY_LINK:
+        _link(src, dst)
+        return COPY_LINK
+    if strategy == COPY_AUTO:
+        try:
+            _reflink(src, dst)
+            return COPY_REFLINK
+        except (ImportError, OSError):
+            pass
+        if hasattr(os, "copy_file_range"):
+            try:
+                _copy_file_range(src, dst)
+                return "copy_file_range"
+            except OSError:
+                pass
+    shutil.copyfile(src, dst)
+    return COPY_STREAM
+
+def copy_files(jobs:Iterable[Tuple[str, str, object]], strategy=COPY_AUTO, workers=1) -> Iterator[object]:
+    '''
+    copy (src, dst, tag) jobs, with more than one worker in parallel.
+    yield the tag of each finished job.
+    '''
+    if workers <= 1:
+        for src, dst, tag in jobs:
+            copy_file(src, dst, strategy)
+            yield tag
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(executor.submit(copy_file, src, dst, strategy), tag) for src, dst, tag in jobs]
+        for future, tag in futures:
+            future.result()
+            yield tag
@@ -1,15 +1,21 @@
 try:
-    from pyboard import Pyboard, PyboardError
+    from pyboard import Pyboard, PyboardError, PIPELINE_BYTES_UART, PIPELINE_BYTES_USB, USB_REPL_PLATFORMS
+    from agent import RemoteAgent, AgentError, AGENT_CHUNK_SIZE, HASH_ALL
+    from tracing import tracer
+    from scheduler import OperationScheduler, PRIORITY_CONTROL, PRIORITY_BULK
 except ImportError:
-    from mpypack.pyboard import Pyboard, PyboardError
-import re, ast, binascii
+    from mpypack.pyboard import Pyboard, PyboardError, PIPELINE_BYTES_UART, PIPELINE_BYTES_USB, USB_REPL_PLATFORMS
+    from mpypack.agent import RemoteAgent, AgentError, AGENT_CHUNK_SIZE, HASH_ALL
+    from mpypack.tracing import tracer
+    from mpypack.scheduler import OperationScheduler, PRIORITY_CONTROL, PRIORITY_BULK
+import re, ast, binascii, hashlib
 from pathlib import PurePath, PurePosixPath
 from os import path as syspath
 from io import BytesIO
 from enum import IntEnum
 from time import sleep
-from typing import Callable, Iterator, List, Union
-from threading import RLock
+from typing import BinaryIO, Callable, Iterator, List, Union
+from itertools import count
 
 class FileEntityType(IntEnum):
     DIRECTORY = 0
@@ -70,6 +76,68 @@ def convert_to_pathstr(path:PathObject):
     if isinstance(path, FileEntity):
         return str(path.abspath)
     else: return str(path)
+PARTIAL_FILE_SUFFIX = ".mpypack_part"
+def partial_path(path:PathObject) -> PurePosixPath:
+    # hidden sibling used while a file is uploaded
+    posixpath = convert_to_posixpath(path)
+    return posixpath.parent.joinpath("." + posixpath.name + PARTIAL_FILE_SUFFIX)
+def resolve_remote_path(current_path:PurePosixPath, path:PathObject) -> PurePosixPath:
+    path = convert_to_posixpath(path)
+    parts = list(current_path.joinpath(path).parts)
+    #flat path
+    p = 1 # parts[0] must be "/"
+    while p < len(parts):
+        name = parts[p]
+        if name == "..":
+            p -= 1
+            if p >= 1:
+                del parts[p]
+                del parts[p]
+            else:
+                p = 1
+                del parts[p]
+        else:
+            p += 1
+    return PurePosixPath(*parts)
+
+# parse the repr text returned by the remote
+def parse_stat_result(res:bytes, current_path:PurePosixPath, path:PathObject) -> FileEntity:
+    entity:tuple = ast.literal_eval(res.decode("utf-8"))
+    ftype, _, _, _, _, _, fsize = entity[:7]
+    ftype = FileEntityType.DIRECTORY if ftype == 0x4000 else FileEntityType.FILE
+    return FileEntity(current_path, path, ftype, fsize)
+def parse_ilistdir_result(res:bytes, posixpath:PurePosixPath) -> List[FileEntity]:
+    files:List[FileEntity] = []
+    entities = ast.literal_eval(res.decode("utf-8"))
+    for entity in entities:
+        fname, ftype = entity[:2]
+        ftype = FileEntityType.DIRECTORY if ftype == 0x4000 else FileEntityType.FILE
+        fsize = entity[3] if len(entity)>=4 else FILE_SIZE_UNKNOWN
+        files.append(FileEntity(posixpath, fname, ftype, fsize))
+    files.sort(key=lambda f: (f.type, f.name))
+    return files
+def order_walk_result(entities:List[FileEntity], root:FileEntity, topdown=True) -> List[FileEntity]:
+    # arrange a flat listing of a tree the same way FileExplorer.walk does
+    children = {}
+    for f in entities:
+        if f == root:
+            continue
+        parent = f.directory.parent if f.type == FileEntityType.DIRECTORY else f.directory
+        children.setdefault(parent, []).append(f)
+    lst = []
+    def visit(dir:FileEntity):
+        files = sorted(children.get(dir.abspath, []), key=lambda f: (f.type, f.name, str(f.directory)))
+        if topdown:
+            lst.append(dir)
+            lst.extend(f for f in files if f.type != FileEntityType.DIRECTORY)
+        for f in files:
+            if f.type == FileEntityType.DIRECTORY:
+                visit(f)
+        if not topdown:
+            lst.append(dir)
+            lst.extend(f for f in files if f.type != FileEntityType.DIRECTORY)
+    visit(root)
+    return lst
 
 class FileExplorerError(IOError):
     pass
@@ -87,45 +155,195 @@ def _was_remote_exception(exception):
     stre = str(exception)
     return any(err in stre for err in ("ENOENT", "ENODEV", "EINVAL", "OSError:"))
 
+# run once after entering raw repl
+REMOTE_INIT_COMMANDS = [
+    "try:\n    import uos\nexcept ImportError:\n    import os as uos\nimport sys",
+    "try:\n    import ubinascii\nexcept ImportError:\n    import binascii as ubinascii",
+]
+REMOTE_HASH_FUNCTION = """\
+try:
+    import uhashlib
+except ImportError:
+    import hashlib as uhashlib
+def _mpypack_hash(p, n):
+    h = uhashlib.sha256()
+    with open(p, 'rb') as f:
+        while n > 0:
+            c = f.read(min(n, 512))
+            if not c:
+                break
+            h.update(c)
+            n -= len(c)
+    print(ubinascii.hexlify(h.digest()).decode())
+"""
+REMOTE_HASH_COMMAND = REMOTE_HASH_FUNCTION + """\
+_mpypack_hash('{path}', {length})
+del _mpypack_hash
+"""
+# the whole tree in one round trip, a (path, type, size) line per entry
+REMOTE_WALK_COMMAND = """\
+def _mpypack_walk(p):
+    for e in uos.ilistdir(p):
+        c = p.rstrip('/') + '/' + e[0]
+        if e[1] == 0x4000:
+            print(repr((c, 0, -1)) + ',')
+            _mpypack_walk(c)
+        else:
+            print(repr((c, 1, e[3] if len(e) > 3 else -1)) + ',')
+_mpypack_walk('{path}')
+del _mpypack_walk
+"""
+# import a .mpy from RAM through a read only user VFS holding just that file, nothing is written
+REMOTE_RUN_MPY_COMMAND = """\
+try:
+    import uio
+except ImportError:
+    import io as uio
+class _MpypackFile(uio.IOBase):
+    def __init__(self):
+        self.off = 0
+    def ioctl(self, request, arg):
+        return 0
+    def readinto(self, buf):
+        n = len(_mpypack_mpy) - self.off
+        n = n if n < len(buf) else len(buf)
+        buf[:n] = _mpypack_mpy[self.off:self.off + n]
+        self.off += n
+        return n
+class _MpypackFS:
+    def mount(self, readonly, mkfs):
+        pass
+    def umount(self):
+        pass
+    def chdir(self, path):
+        pass
+    def stat(self, path):
+        if path.lstrip('/') == '{module}.mpy':
+            return (0x8000, 0, 0, 0, 0, 0, len(_mpypack_mpy), 0, 0, 0)
+        raise OSError(2)
+    def open(self, path, mode):
+        return _MpypackFile()
+_mpypack_mpy = memoryview({mpy!r})
+uos.mount(_MpypackFS(), '/_mpypack_ram')
+sys.path.insert(0, '/_mpypack_ram')
+try:
+    import {module}
+finally:
+    sys.path.remove('/_mpypack_ram')
+    uos.umount('/_mpypack_ram')
+    sys.modules.pop('{module}', None)
+    del _MpypackFile, _MpypackFS, _mpypack_mpy
+"""
+RUN_MPY_MODULE = "_mpypack_run"
+def run_mpy_source(mpy:bytes) -> str:
+    ''' a command running a compiled module, __name__ is RUN_MPY_MODULE instead of __main__ '''
+    return REMOTE_RUN_MPY_COMMAND.format(module=RUN_MPY_MODULE, mpy=bytes(mpy))
+# rename over an existing file, FAT refuses that
+REMOTE_REPLACE_COMMAND = """\
+try:
+    uos.remove('{dst}')
+except OSError:
+    pass
+uos.rename('{src}', '{dst}')
+"""
+
 class FileExplorerStatus(IntEnum):
     UNKNOWN = 0
     READY = 1
     BUSY = 2
 
 class FileExplorer:
-    ''' Thread safe micropython remote file explorer class '''
+    '''
+    Thread safe micropython remote file explorer class.
+    Short operations preempt transfers between two chunks, see OperationScheduler.
+    '''
     @property
     def CHUNK_SIZE(self): return 512
-    def __init__(self, port, baudrate=115200):
+    def __init__(self, port, baudrate=115200, fast_baudrate=None, repl_uart=None, pipeline_window=4, pipeline_bytes=None, use_agent=False, upload_retries=3, retry_backoff=0.5):
         self.__device = Pyboard(port, baudrate)
+        self.upload_retries = upload_retries
+        self.retry_backoff = retry_backoff
+        self.__fast_baudrate = fast_baudrate
+        self.__repl_uart = repl_uart
+        self.pipeline_window = pipeline_window
+        # None: sized from the repl of the board on init
+        self.__auto_pipeline_bytes = pipeline_bytes == None
+        self.pipeline_bytes = PIPELINE_BYTES_UART if pipeline_bytes == None else pipeline_bytes
+        self.use_agent = use_agent
+        self.__agent:RemoteAgent = None
         self.__current_path = PurePosixPath("/")
         self.__status = FileExplorerStatus.UNKNOWN
         self.sysname = ""
-        self.__device_lock = RLock()
+        self.__device_lock = OperationScheduler()
+        self.__handles = count() # names of remote file objects, unique so preempting operations keep them
 
     def __del__(self):
         self.close()
 
-    def __protect(fn):
-        def func(self, *args, **kwargs):
-            if not isinstance(self, FileExplorer):
-                return fn(self, *args, **kwargs)
-            else:
-                self.__device_lock.acquire()
-                try:
+    def __protect_with(priority):
+        def decorator(fn):
+            def func(self, *args, **kwargs):
+                if not isinstance(self, FileExplorer):
                     return fn(self, *args, **kwargs)
-                finally:
-                    self.__device_lock.release()
-        return func
+                else:
+                    self.__device_lock.acquire(priority)
+                    try:
+                        with tracer.span(fn.__name__.strip("_"), "fileexplorer"):
+                            return fn(self, *args, **kwargs)
+                    finally:
+                        self.__device_lock.release()
+            return func
+        return decorator
+    __protect = __protect_with(PRIORITY_CONTROL)
+    __protect_bulk = __protect_with(PRIORITY_BULK)
 
-    def _require_device(self):
-        self.__device_lock.acquire()
+    def _require_device(self, priority=PRIORITY_BULK):
+        self.__device_lock.acquire(priority)
     
     def _release_device(self):
         self.__device_lock.release()
 
+    def yield_device(self) -> bool:
+        '''
+        Called between two steps of a long operation holding the device, lets waiting
+        short operations run first. True if anything ran meanwhile.
+        '''
+        if self.__device_lock.yield_point():
+            tracer.count("device.preemptions")
+            return True
+        return False
+
+    def __yield_agent(self, agent:RemoteAgent) -> RemoteAgent:
+        # between two agent chunks, the operations run meanwhile may have stopped the agent
+        if not self.yield_device():
+            return agent
+        agent = self.__agent_session()
+        if agent == None:
+            raise FileExplorerError("Agent stopped during transfer")
+        return agent
+
+    def __exec_preemptible(self, commands:Iterator, setup=None) -> Iterator[bytes]:
+        # exec_pipelined for a caller holding the device, the pipeline is drained and the device
+        # lent whenever a short operation waits; setup runs again after that, before the rest
+        commands = iter(commands)
+        done = False
+        def until_preempted():
+            nonlocal done
+            for command in commands:
+                yield command
+                if self.__device_lock.should_yield():
+                    return
+            done = True
+        while not done:
+            self.__repl_session()
+            if setup != None:
+                self.__device.exec(setup)
+            yield from self.__device.exec_pipelined(until_preempted(), window=self.pipeline_window, window_bytes=self.pipeline_bytes)
+            if not done:
+                self.yield_device()
+
     def __enter__(self):
-        self.__device_lock.acquire()
+        self.__device_lock.acquire(PRIORITY_BULK)
         self.init()
         return self
     
@@ -136,11 +354,9 @@ class FileExplorer:
     @property
     def status(self):
         if self.__status == FileExplorerStatus.READY:
-            if self.__device_lock.acquire(blocking=False):
-                self.__device_lock.release()
-                return FileExplorerStatus.READY
-            else:
+            if self.__device_lock.busy():
                 return FileExplorerStatus.BUSY
+            return FileExplorerStatus.READY
         return self.__status
 
     @property
@@ -157,14 +373,62 @@ class FileExplorer:
         except PyboardError:
             sleep(0.5)
             self.__device.enter_raw_repl() # try again
-        self.__device.exec("try:\n    import uos\nexcept ImportError:\n    import os as uos\nimport sys")
-        self.__device.exec("try:\n    import ubinascii\nexcept ImportError:\n    import binascii as ubinascii")
+        if self.__fast_baudrate != None:
+            self.__device.negotiate_baudrate(self.__fast_baudrate, self.__repl_uart)
+        for command in REMOTE_INIT_COMMANDS:
+            self.__device.exec(command)
         self.__current_path = PurePosixPath("/", self.__device.eval("uos.getcwd()").decode("utf8"))
         self.sysname = self.__device.eval("uos.uname()[0]").decode("utf-8")
+        if self.__auto_pipeline_bytes:
+            self.pipeline_bytes = PIPELINE_BYTES_USB if self.sysname in USB_REPL_PLATFORMS else PIPELINE_BYTES_UART
         self.__status = FileExplorerStatus.READY
+        if self.use_agent:
+            self.__setup_agent()
+
+    def __setup_agent(self):
+        # install the agent if needed, it is started by the first file operation
+        agent = RemoteAgent(self.__device)
+        try:
+            if not agent.is_installed():
+                self.upload(agent.remote_path, agent.source)
+            self.__agent = agent
+        except (PyboardError, FileExplorerError):
+            self.__agent = None
+
+    def __agent_session(self) -> Union[RemoteAgent, None]:
+        # the running agent, None means use the REPL
+        if self.__agent == None:
+            return None
+        if not self.__agent.running:
+            try:
+                self.__agent.start()
+            except PyboardError:
+                self.__agent = None # fall back to the REPL for this session
+                return None
+        return self.__agent
+
+    def __repl_session(self):
+        # the agent owns the raw REPL while it runs
+        if self.__agent != None and self.__agent.running:
+            self.__agent.stop()
+
+    @property
+    def agent_active(self):
+        return self.__agent != None
+
+    @property
+    def baudrate(self):
+        if self.__device.serial == None:
+            return self.__device.baudrate
+        return self.__device.serial.baudrate
 
     @__protect
     def close(self):
+        try: self.__repl_session()
+        except: pass
+        self.__agent = None
+        try: self.__device.restore_baudrate()
+        except: pass
         try: self.__device.exit_raw_repl()
         except: pass
         try: self.__device.close()
@@ -173,28 +437,19 @@ class FileExplorer:
     
     # utils function
     def abspath(self, path:PathObject) -> PurePosixPath:
-        path = convert_to_posixpath(path)
-        parts = list(self.__current_path.joinpath(path).parts)
-        #flat path
-        p = 1 # parts[0] must be "/"
-        while p < len(parts):
-            name = parts[p]
-            if name == "..":
-                p -= 1
-                if p >= 1:
-                    del parts[p]
-                    del parts[p]
-                else:
-                    p = 1
-                    del parts[p]
-            else:
-                p += 1
-        return PurePosixPath(*parts)
+        return resolve_remote_path(self.__current_path, path)
 
     # file explorer function
     @__protect
     def stat(self, path:PathObject) -> FileEntity:
         posixpath = self.abspath(path)
+        agent = self.__agent_session()
+        if agent != None:
+            try:
+                ftype, fsize = agent.stat(posixpath)
+            except AgentError:
+                raise FileExplorerError("No such file or directory: {}".format(posixpath))
+            return FileEntity(self.__current_path, path, FileEntityType(ftype), fsize)
         try:
             res = self.__device.eval("uos.stat('{}')".format(posixpath))
         except Exception as e:
@@ -202,10 +457,7 @@ class FileExplorer:
                 raise FileExplorerError("No such file or directory: {}".format(posixpath))
             else:
                 raise PyboardError(e)
-        entity:tuple = ast.literal_eval(res.decode("utf-8"))
-        ftype, _, _, _, _, _, fsize = entity[:7]
-        ftype = FileEntityType.DIRECTORY if ftype == 0x4000 else FileEntityType.FILE
-        return FileEntity(self.__current_path, path, ftype, fsize)
+        return parse_stat_result(res, self.__current_path, path)
 
     @__protect
     def exist(self, path:PathObject) -> Union[FileEntity, bool]:
@@ -230,7 +482,15 @@ class FileExplorer:
     @__protect
     def ls(self, path:PathObject="") -> List[FileEntity]:
         posixpath = self.abspath(path)
-        files:List[FileEntity] = []
+        agent = self.__agent_session()
+        if agent != None:
+            try:
+                entities = agent.ls(posixpath)
+            except AgentError:
+                raise FileExplorerError("No such directory: {}".format(posixpath))
+            files = [FileEntity(posixpath, fname, FileEntityType(ftype), fsize) for fname, ftype, fsize in entities]
+            files.sort(key=lambda f: (f.type, f.name))
+            return files
         try:
             res = self.__device.eval("list(uos.ilistdir('{}'))".format(posixpath))
         except Exception as e:
@@ -238,18 +498,19 @@ class FileExplorer:
                 raise FileExplorerError("No such directory: {}".format(posixpath))
             else:
                 raise PyboardError(e)
-        entities = ast.literal_eval(res.decode("utf-8"))
-        for entity in entities:
-            fname, ftype = entity[:2]
-            ftype = FileEntityType.DIRECTORY if ftype == 0x4000 else FileEntityType.FILE
-            fsize = entity[3] if len(entity)>=4 else FILE_SIZE_UNKNOWN
-            files.append(FileEntity(posixpath, fname, ftype, fsize))
-        files.sort(key=lambda f: (f.type, f.name))
-        return files
+        return parse_ilistdir_result(res, posixpath)
     
     @__protect
     def rm(self, path:PathObject):
         posixpath = self.abspath(path)
+        agent = self.__agent_session()
+        if agent != None:
+            self.stat(path)
+            try:
+                agent.rm(posixpath)
+            except AgentError:
+                raise FileExplorerError("Directory not empty: {}".format(posixpath))
+            return
         file = self.stat(path)
         try:
             if file.type == FileEntityType.DIRECTORY:
@@ -262,7 +523,7 @@ class FileExplorer:
             else:
                 raise e
     
-    @__protect
+    @__protect_bulk
     def rmtree(self, path:PathObject):
         file = self.exist(path)
         if not file:
@@ -271,13 +532,20 @@ class FileExplorer:
             files = self.ls(file)
             for sub_file in files:
                 self.rmtree(sub_file)
+                self.yield_device()
         self.rm(file)
 
     @__protect
     def mkdir(self, path:PathObject) -> FileEntity:
         posixpath = self.abspath(path)
+        agent = self.__agent_session()
         try:
-            self.__device.eval("uos.mkdir('{}')".format(posixpath))
+            if agent != None:
+                agent.mkdir(posixpath)
+            else:
+                self.__device.eval("uos.mkdir('{}')".format(posixpath))
+        except AgentError:
+            raise FileExplorerError("Directory may be invalid or exists: {}".format(posixpath))
         except PyboardError as e:
             if _was_remote_exception(e):
                 raise FileExplorerError("Directory may be invalid or exists: {}".format(posixpath))
@@ -301,57 +569,84 @@ class FileExplorer:
             last = self.mkdir(dir)
         return last
 
-    @__protect
+    @__protect_bulk
     def walk(self, path:PathObject, topdown=True) -> List[FileEntity]:
         posixpath = self.abspath(path)
         dir = self.exist(posixpath)
-        lst = []
         if dir == False or dir.type != FileEntityType.DIRECTORY:
             raise FileExplorerError("Target is not directory: {}".format(posixpath))
-        if dir == False:
-            return lst
-        files = self.ls(dir)
-        if topdown:
-            lst.append(dir)
-            for file in files:
-                if file.type != FileEntityType.DIRECTORY:
-                    lst.append(file)
-        for file in files:
-            if file.type == FileEntityType.DIRECTORY:
-                lst.extend(self.walk(file, topdown))
-        if not topdown:
-            lst.append(dir)
-            for file in files:
-                if file.type != FileEntityType.DIRECTORY:
-                    lst.append(file)
-        return lst
+        # the whole tree in one round trip
+        agent = self.__agent_session()
+        if agent != None:
+            tree = agent.walk(posixpath)
+        else:
+            try:
+                res = self.__device.exec(REMOTE_WALK_COMMAND.format(path=posixpath))
+            except PyboardError as e:
+                if _was_remote_exception(e):
+                    raise FileExplorerError("Walk failed: {}".format(posixpath))
+                else:
+                    raise e
+            tree = ast.literal_eval("[" + res.decode("utf-8") + "]")
+        entities = [FileEntity(fpath, "", FileEntityType(ftype), fsize) if ftype == FileEntityType.DIRECTORY
+            else FileEntity(PurePosixPath(fpath).parent, PurePosixPath(fpath).name, FileEntityType(ftype), fsize)
+            for fpath, ftype, fsize in tree]
+        return order_walk_result(entities, dir, topdown)
 
-    @__protect
+    @__protect_bulk
     def download(self, path:PathObject, progress_callback:ProgressCallback=None) -> bytes:
+        dst = BytesIO()
+        self.download_to(path, dst, progress_callback)
+        return dst.getvalue()
+
+    @__protect_bulk
+    def download_to(self, path:PathObject, dst:BinaryIO, progress_callback:ProgressCallback=None) -> int:
+        ''' write a remote file into the binary stream dst chunk by chunk, the bytes written '''
         posixpath = self.abspath(path)
         file = self.exist(path)
         if file == False or file.type == FileEntityType.DIRECTORY:
             raise FileExplorerError("Target is directory: {}".format(posixpath))
+        written = 0
+        agent = self.__agent_session()
+        if agent != None:
+            try:
+                while written < file.size:
+                    written += dst.write(agent.read(posixpath, written, AGENT_CHUNK_SIZE))
+                    if progress_callback != None:
+                        progress_callback(written, file.size)
+                    agent = self.__yield_agent(agent)
+            except AgentError:
+                raise FileExplorerError("Read file failed: {}".format(posixpath))
+            assert written == file.size
+            return written
         try:
-            dst = BytesIO()
-            self.__device.exec("f = open('{}', 'rb')".format(posixpath))
-            while dst.tell() < file.size:
-                chunck = self.__device.exec("c = ubinascii.b2a_base64(f.read({}))\r\nsys.stdout.write(c)\r\n".format(self.CHUNK_SIZE))
+            f = self.__new_handle()
+            self.__device.exec("{} = open('{}', 'rb')".format(f, posixpath))
+            read_command = "c = ubinascii.b2a_base64({}.read({}))\r\nsys.stdout.write(c)\r\n".format(f, self.CHUNK_SIZE)
+            commands = (read_command for _ in range(0, file.size, self.CHUNK_SIZE))
+            for chunck in self.__exec_preemptible(commands):
                 chunck = binascii.a2b_base64(chunck)
-                dst.write(chunck)
+                written += dst.write(chunck)
                 if progress_callback != None:
-                    progress_callback(dst.tell(), file.size)
-            self.__device.exec("f.close()")
-            assert dst.tell() == file.size
-            return dst.getvalue()
+                    progress_callback(written, file.size)
+            self.__repl_session()
+            self.__device.exec("{0}.close()\r\ndel {0}".format(f))
+            assert written == file.size
+            return written
         except PyboardError as e:
             if _was_remote_exception(e):
                 raise FileExplorerError("Read file failed: {}".format(posixpath))
             else:
                 raise e
 
-    @__protect
-    def upload(self, path:PathObject, data:Iterator, progress_callback:ProgressCallback=None):
+    @__protect_bulk
+    def upload(self, path:PathObject, data:Iterator, progress_callback:ProgressCallback=None, atomic=True):
+        '''
+        Write data to a remote file.
+        With atomic, data goes to a hidden partial file that replaces the target when complete.
+        A partial file left by an interrupted upload is resumed if its content is a prefix of data,
+        broken connections are retried with backoff from the last offset confirmed by the board.
+        '''
         posixpath = self.abspath(path)
         file = self.exist(path)
         if file and file.type == FileEntityType.DIRECTORY:
@@ -359,31 +654,204 @@ class FileExplorer:
         filedir = PurePosixPath(*posixpath.parts[:-1])
         filename = posixpath.parts[-1]
         self.mkdirs(filedir)
-        try:
-            size = len(data)
-            self.__device.exec("f = open('{}', 'wb')".format(posixpath))
-            for p in range(0, size, self.CHUNK_SIZE):
+        size = len(data)
+        target = partial_path(posixpath) if atomic else posixpath
+        offset = self.__confirmed_offset(target, data) if atomic else 0
+        attempt = 0
+        while True:
+            try:
+                self.__write_file(target, data, offset, progress_callback)
+                break
+            except FileExplorerError:
+                raise
+            except PyboardError as e:
+                if _was_remote_exception(e):
+                    raise FileExplorerError("Write file failed: {}".format(posixpath))
+                if not atomic or attempt >= self.upload_retries:
+                    raise e
+                sleep(self.retry_backoff * (2 ** attempt))
+                self.__reconnect()
+                confirmed = self.__confirmed_offset(target, data)
+                attempt = 0 if confirmed > offset else attempt + 1
+                offset = confirmed
+        if atomic:
+            self.__replace_file(target, posixpath)
+        return FileEntity(filedir, filename, FileEntityType.FILE, size)
+
+    @__protect_bulk
+    def append(self, path:PathObject, data:Iterator, progress_callback:ProgressCallback=None):
+        '''
+        Append data to a remote file, the file is created if it does not exist.
+        Not atomic and not retried, an interrupted append may leave part of data behind.
+        '''
+        posixpath = self.abspath(path)
+        file = self.exist(path)
+        if file and file.type == FileEntityType.DIRECTORY:
+            raise FileExplorerError("Target is directory: {}".format(posixpath))
+        self.__write_file(posixpath, data, 0, progress_callback, append=True)
+        return FileEntity(posixpath.parent, posixpath.name, FileEntityType.FILE, (file.size if file else 0) + len(data))
+
+    def __write_file(self, posixpath:PurePosixPath, data, offset, progress_callback:ProgressCallback=None, append=False):
+        size = len(data)
+        agent = self.__agent_session()
+        if agent != None:
+            try:
+                p = offset
+                while True:
+                    agent.write(posixpath, data[p:p+AGENT_CHUNK_SIZE], append=(append or p > 0))
+                    p = min(p + AGENT_CHUNK_SIZE, size)
+                    if progress_callback != None:
+                        progress_callback(p, size)
+                    if p >= size:
+                        break
+                    agent = self.__yield_agent(agent)
+            except AgentError:
+                raise FileExplorerError("Write file failed: {}".format(posixpath))
+            return
+        f = self.__new_handle()
+        self.__device.exec("{} = open('{}', '{}')".format(f, posixpath, "ab" if append or offset > 0 else "wb"))
+        # each command is larger than PIPELINE_BYTES_UART, uart repls run them one by one
+        def write_commands():
+            for p in range(offset, size, self.CHUNK_SIZE):
                 chunck = binascii.b2a_base64(data[p:p+self.CHUNK_SIZE]).decode("utf-8").replace("\r","").replace("\n","")
-                self.__device.exec("f.write(ubinascii.a2b_base64('{}'))".format(chunck))
-                if progress_callback != None:
-                    p += self.CHUNK_SIZE
-                    p = p if p < size else size
-                    progress_callback(p, size)
-            self.__device.exec("f.close()")
-            return FileEntity(filedir, filename, FileEntityType.FILE, size)
+                yield "{}.write(ubinascii.a2b_base64('{}'))".format(f, chunck)
+        p = offset
+        for _ in self.__exec_preemptible(write_commands()):
+            if progress_callback != None:
+                p += self.CHUNK_SIZE
+                p = p if p < size else size
+                progress_callback(p, size)
+        self.__repl_session()
+        self.__device.exec("{0}.close()\r\ndel {0}".format(f))
+
+    def __new_handle(self) -> str:
+        return "_mpypack_f{}".format(next(self.__handles))
+
+    def __confirmed_offset(self, posixpath:PurePosixPath, data) -> int:
+        # length of the partial file if it holds a prefix of data, else 0
+        partial = self.exist(posixpath)
+        if not partial or partial.type == FileEntityType.DIRECTORY:
+            return 0
+        if partial.size <= 0 or partial.size > len(data):
+            return 0
+        try:
+            remote_hash = self.hash(posixpath)
+        except FileExplorerError:
+            return 0
+        if remote_hash != hashlib.sha256(data[:partial.size]).hexdigest():
+            return 0
+        return partial.size
+
+    def __replace_file(self, src:PurePosixPath, dst:PurePosixPath):
+        agent = self.__agent_session()
+        try:
+            if agent != None:
+                agent.rename(src, dst)
+            else:
+                self.__device.exec(REMOTE_REPLACE_COMMAND.format(src=src, dst=dst))
         except PyboardError as e:
-            if _was_remote_exception(e):
-                raise FileExplorerError("Write file failed: {}".format(posixpath))
+            if isinstance(e, AgentError) or _was_remote_exception(e):
+                raise FileExplorerError("Replace file failed: {}".format(dst))
             else:
                 raise e
-    
+
+    def __reconnect(self):
+        # reopen the port and the raw REPL after a broken transfer
+        try: self.__device.close()
+        except: pass
+        self.__agent = None
+        self.__status = FileExplorerStatus.UNKNOWN
+        self.init()
+
+    @__protect
+    def hash(self, path:PathObject, length=None) -> str:
+        ''' sha256 hex digest of a remote file, or of its first length bytes '''
+        posixpath = self.abspath(path)
+        agent = self.__agent_session()
+        try:
+            if agent != None:
+                return agent.hash(posixpath, HASH_ALL if length == None else length).hex()
+            command = REMOTE_HASH_COMMAND.format(path=posixpath, length=HASH_ALL if length == None else length)
+            return self.__device.exec(command).decode("utf-8").strip()
+        except PyboardError as e:
+            if isinstance(e, AgentError) or _was_remote_exception(e):
+                raise FileExplorerError("Hash file failed: {}".format(posixpath))
+            else:
+                raise e
+
+    @__protect_bulk
+    def hashes(self, paths:List[PathObject]) -> List[str]:
+        ''' sha256 hex digests of many remote files, pipelined on the raw REPL '''
+        posixpaths = [self.abspath(p) for p in paths]
+        agent = self.__agent_session()
+        try:
+            if agent != None:
+                digests = []
+                for p in posixpaths:
+                    digests.append(agent.hash(p, HASH_ALL).hex())
+                    agent = self.__yield_agent(agent)
+                return digests
+            if len(posixpaths) == 0:
+                return []
+            # defined again after a preemption, hash() deletes it
+            commands = ("_mpypack_hash('{}', {})".format(p, HASH_ALL) for p in posixpaths)
+            digests = [res.decode("utf-8").strip() for res in self.__exec_preemptible(commands, setup=REMOTE_HASH_FUNCTION)]
+            self.__device.exec("del _mpypack_hash")
+            return digests
+        except PyboardError as e:
+            if isinstance(e, AgentError) or _was_remote_exception(e):
+                raise FileExplorerError("Hash file failed: {}".format(", ".join(str(p) for p in posixpaths)))
+            else:
+                raise e
+
+    @__protect_bulk
+    def run(self, source, data_consumer:Callable[[bytes],None], follow=True, timeout=None) -> bytes:
+        '''
+        Execute source from RAM, the board's filesystem is not touched. The output is given to
+        data_consumer as it arrives, the error output (a traceback) is returned.
+        Without follow the script is left running and the connection closed.
+        Ctrl-C is passed on to the script, a second one stops following and closes the connection.
+        '''
+        self.__repl_session()
+        self.__device.exec_raw_no_follow(source)
+        if not follow:
+            self.__drop_connection()
+            return b""
+        try:
+            try:
+                return self.__device.follow_stream(data_consumer, timeout)
+            except KeyboardInterrupt:
+                self.__device.serial.write(b"\x03")
+                return self.__device.follow_stream(data_consumer, timeout)
+        except KeyboardInterrupt:
+            self.__drop_connection()
+            raise
+
+    def __drop_connection(self):
+        # the board is still busy, leave it alone and connect again on the next init
+        try: self.__device.close()
+        except: pass
+        self.__agent = None
+        self.__status = FileExplorerStatus.UNKNOWN
+
     # extra function
     @__protect
     def exec(self, command, data_consumer=None):
+        self.__repl_session()
         return self.__device.exec(command, data_consumer)
 
+    def exec_pipelined(self, commands:Iterator) -> Iterator[bytes]:
+        # generator, so hold the lock until it is exhausted or closed
+        self.__device_lock.acquire(PRIORITY_BULK)
+        try:
+            self.__repl_session()
+            yield from self.__device.exec_pipelined(commands, window=self.pipeline_window, window_bytes=self.pipeline_bytes)
+        finally:
+            self.__device_lock.release()
+
     @__protect
     def repl(self):
+        self.__repl_session()
         need_init = False
         if self.__status != FileExplorerStatus.UNKNOWN:
             need_init = True
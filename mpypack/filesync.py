@@ -1,15 +1,35 @@
 try:
     import mpycross
-    from fileexplorer import FileExplorer, FileEntity, FileEntityType, PathObject, convert_to_pathstr, FILE_SIZE_UNKNOWN, FileExplorerStatus, ProgressCallback
+    from agent import AGENT_REMOTE_PATH
+    from filecopy import copy_files, COPY_AUTO
+    from manifest import Manifest, ManifestError, LEGACY_RECORD_FILE
+    from importgraph import ImportGraph, DEFAULT_SEARCH_PATHS
+    from minify import minify_file
+    from freeze import freeze_entries, freeze_opt, render_freeze_manifest
+    from fsimage import build_image, IMAGE_FAT
+    from tracing import traced
+    from progress import expect_progress
+    from plan import SyncPlan, LinkModel, upload_cost, OP_MKDIR, OP_UPLOAD, OP_DELETE, OP_COMPILE, OP_MANIFEST, REPL_COMMAND_BYTES, DELETE_ROUND_TRIPS, MKDIR_ROUND_TRIPS
+    from fileexplorer import FileExplorer, FileEntity, FileEntityType, PathObject, convert_to_pathstr, FILE_SIZE_UNKNOWN, FileExplorerStatus, ProgressCallback, PARTIAL_FILE_SUFFIX
 except ImportError:
     from mpypack import mpycross
-    from mpypack.fileexplorer import FileExplorer, FileEntity, FileEntityType, PathObject, convert_to_pathstr, FILE_SIZE_UNKNOWN, FileExplorerStatus, ProgressCallback
+    from mpypack.agent import AGENT_REMOTE_PATH
+    from mpypack.filecopy import copy_files, COPY_AUTO
+    from mpypack.manifest import Manifest, ManifestError, LEGACY_RECORD_FILE
+    from mpypack.importgraph import ImportGraph, DEFAULT_SEARCH_PATHS
+    from mpypack.minify import minify_file
+    from mpypack.freeze import freeze_entries, freeze_opt, render_freeze_manifest
+    from mpypack.fsimage import build_image, IMAGE_FAT
+    from mpypack.tracing import traced
+    from mpypack.progress import expect_progress
+    from mpypack.plan import SyncPlan, LinkModel, upload_cost, OP_MKDIR, OP_UPLOAD, OP_DELETE, OP_COMPILE, OP_MANIFEST, REPL_COMMAND_BYTES, DELETE_ROUND_TRIPS, MKDIR_ROUND_TRIPS
+    from mpypack.fileexplorer import FileExplorer, FileEntity, FileEntityType, PathObject, convert_to_pathstr, FILE_SIZE_UNKNOWN, FileExplorerStatus, ProgressCallback, PARTIAL_FILE_SUFFIX
 from pathlib import PurePath, PurePosixPath
-from os import walk, remove, PathLike, path as syspath, makedirs
+from os import walk, remove, rmdir, listdir, replace, PathLike, path as syspath, makedirs
 from tempfile import gettempdir
-from typing import Callable, Union
+from typing import Callable, Iterable, Iterator, List, Tuple, Union
 from shutil import rmtree
-import re, json, hashlib, uuid, tempfile, traceback
+import re, hashlib, uuid, tempfile, traceback, time
 
 PATTERN_PY = re.compile(r'\.py$', re.IGNORECASE)
 PATTERN_COMPILE_IGNORED = [
@@ -26,27 +46,88 @@ PATTERN_EXCLUDE = [
     re.compile(r'README.md$', re.IGNORECASE),
 ]
 SyncProgressCallback = Union[None, Callable[[int, int, int, int, str, str],None]]
+BuildTarget = Tuple[Union[str, None], PathLike] # (arch, output folder)
+HASH_BLOCK_SIZE = 1024 * 1024
 
-def get_compiled_file_content(source:PathLike, arch=None):
-    tmppath = PurePath(tempfile.gettempdir()).joinpath(str(uuid.uuid4())+".mpy")
+@traced("compile", "mpycross")
+def compile_file(source:PathLike, target:PathLike, arch=None, options:List[str]=[]):
+    args = ["-o", target]
     if arch != None:
-        mpycross.run("-o", tmppath, "-march="+str(arch), source).wait()
-    else:
-        mpycross.run("-o", tmppath, source).wait()
+        args.append("-march="+str(arch))
+    if mpycross.run(*args, *options, source).wait() != 0:
+        raise Exception("mpy-cross compile failed: {}".format(source))
+
+def get_compiled_file_content(source:PathLike, arch=None, options:List[str]=[]):
+    tmppath = PurePath(tempfile.gettempdir()).joinpath(str(uuid.uuid4())+".mpy")
+    compile_file(source, tmppath, arch, options)
     with open(tmppath, "rb") as f:
         data = f.read()
     remove(tmppath)
     return data
 
+def compile_files(jobs:Iterable[Tuple[str, str, Union[str, None], List[str], object]], workers=1) -> Iterator[object]:
+    '''
+    run (source, target, arch, options, tag) mpy-cross jobs, with more than one worker in parallel.
+    yield the tag of each finished job.
+    '''
+    if workers <= 1:
+        for source, target, arch, options, tag in jobs:
+            compile_file(source, target, arch, options)
+            yield tag
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(executor.submit(compile_file, source, target, arch, options), tag) for source, target, arch, options, tag in jobs]
+        for future, tag in futures:
+            future.result()
+            yield tag
+
+class CompileProfile():
+    '''
+    Extra mpy-cross options (e.g. ["-X", "emit=native", "-O2"]) for the files matching one of the
+    glob patterns, relative to the source root and matched from the right like PurePath.match.
+    '''
+    def __init__(self, name:str, patterns:List[str], options:List[str]):
+        self.name = name
+        self.patterns = patterns
+        self.options = options
+
+    def matches(self, relpath:str) -> bool:
+        return any(PurePosixPath(relpath).match(p) for p in self.patterns)
+
+class _BuildOutput():
+    # state of one build_matrix target
+    def __init__(self, arch, folder:PathLike):
+        self.arch = arch
+        self.folder = syspath.abspath(folder)
+        self.name = arch if arch != None else syspath.basename(self.folder)
+        self.record_target = None
+        self.manifest = Manifest()     # of the previous build
+        self.new_manifest = Manifest()
+        self.built = []                # (key, target, hash)
+        self.expected_files = set()
+        self.expected_dirs = set([syspath.normcase(self.folder)])
+
 class FileSync():
-    def __init__(self, file_explorer, local_path=".", remote_path="/", remote_record_file=".mpypack_sha256.json", compile_ignore_pattern=PATTERN_COMPILE_IGNORED, include_pattern=PATTERN_INCLUDE, exclude_pattern=PATTERN_EXCLUDE):
+    def __init__(self, file_explorer, local_path=".", remote_path="/", remote_record_file=".mpypack_manifest", compile_ignore_pattern=PATTERN_COMPILE_IGNORED, include_pattern=PATTERN_INCLUDE, exclude_pattern=PATTERN_EXCLUDE, entry_points=None, data_pattern=[], search_paths=DEFAULT_SEARCH_PATHS, compile_profiles:List[CompileProfile]=[]):
+        '''
+        With entry_points (e.g. ["main.py", "boot.py"]) only modules they import (transitively) and
+        files matching data_pattern are synced or built, the rest is listed in dropped_files.
+        The first of compile_profiles matching a compiled file adds its mpy-cross options.
+        '''
         self.__fe:FileExplorer = file_explorer
         self.__local = PurePath(syspath.abspath(local_path))
         self.__remote = PurePosixPath(remote_path)
         self.__record_file_path = self.__remote.joinpath(remote_record_file)
+        self.__legacy_record_file_path = self.__remote.joinpath(LEGACY_RECORD_FILE)
         self.__pattern_compile_ignored = compile_ignore_pattern
         self.__pattern_include = include_pattern
         self.__pattern_exclude = exclude_pattern
+        self.__entry_points = entry_points
+        self.__pattern_data = data_pattern
+        self.__search_paths = search_paths
+        self.__compile_profiles = compile_profiles
+        self.dropped_files:List[FileEntity] = []
     
     def should_compile(self, path:PathObject):
         if isinstance(path, FileEntity):
@@ -58,6 +139,22 @@ class FileSync():
                 return False
         return len(PATTERN_PY.findall(pathstr)) > 0
 
+    def compile_options(self, path:PathObject) -> List[str]:
+        relpath = str(PurePosixPath(convert_to_pathstr(path)).relative_to(self.__remote))
+        for profile in self.__compile_profiles:
+            if profile.matches(relpath):
+                return profile.options
+        return []
+
+    def should_minify(self, path:PathObject, compile=False):
+        # .py files that are shipped as source
+        if isinstance(path, FileEntity):
+            if path.type == FileEntityType.DIRECTORY:
+                return False
+        if compile and self.should_compile(path):
+            return False
+        return len(PATTERN_PY.findall(convert_to_pathstr(path))) > 0
+
     def should_include(self, path:PathObject, ignore_hidden=True):
         pathstr = convert_to_pathstr(path)
         for ptn in self.__pattern_include:
@@ -79,6 +176,7 @@ class FileSync():
         pth = PurePath(path).relative_to(self.__local)
         return self.__remote.joinpath(pth)
 
+    @traced("walk_local", "filesync")
     def __walk_local_like_remote(self, ignore_hidden=True):
         lst = []
         for cur_dir, _, files in walk(self.__local):
@@ -95,38 +193,130 @@ class FileSync():
         for f in lst.copy():
             if not self.should_include(f, ignore_hidden):
                 lst.remove(f)
+        if self.__entry_points != None:
+            lst = self.__select_reachable(lst)
         return lst
 
+    def __select_reachable(self, lst:List[FileEntity]) -> List[FileEntity]:
+        graph = ImportGraph(self.__local, self.__search_paths)
+        keep = set(graph.closure(self.__entry_points))
+        if len(keep) == 0:
+            raise FileNotFoundError("No entry point found in {}: {}".format(self.__local, ", ".join(self.__entry_points)))
+        for f in lst:
+            if f.type == FileEntityType.FILE:
+                pathstr = convert_to_pathstr(f)
+                if any(len(ptn.findall(pathstr)) > 0 for ptn in self.__pattern_data):
+                    keep.add(str(f.abspath.relative_to(self.__remote)))
+        # and the folders on the way
+        for rel in list(keep):
+            keep.update(str(p) for p in PurePosixPath(rel).parents)
+        selected = []
+        self.dropped_files = []
+        for f in lst:
+            if str(f.abspath.relative_to(self.__remote)) in keep:
+                selected.append(f)
+            elif f.type == FileEntityType.FILE:
+                self.dropped_files.append(f)
+        return selected
+
+    @traced("walk_remote", "filesync")
     def __walk_remote(self,  ignore_hidden=True):
         lst = []
         for f in self.__fe.walk(self.__remote):
+            if f.type == FileEntityType.FILE and f.name.endswith(PARTIAL_FILE_SUFFIX):
+                continue # an interrupted upload, kept to be resumed
             if self.should_include(f, ignore_hidden):
                 lst.append(f)
         return lst
     
-    def __hash_local_file(self, path:PathObject, compile=False):
+    def __hash_local_file(self, path:PathObject, compile=False, arch=None, minify=False, keep_lines=False):
+        return self.__hash_variant(self.__hash_local_content(path), path, compile, arch, minify, keep_lines)
+
+    @traced("hash", "filesync")
+    def __hash_local_content(self, path:PathObject):
         pth = self.get_local_path(path)
         hash = hashlib.sha256()
         with open(pth, "rb") as f:
-            hash.update(f.read())
-            if compile and self.should_compile(path):
-                hash.update(b'compile')
-            return hash.hexdigest()
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                hash.update(block)
+        return hash
+
+    def __hash_variant(self, hash, path:PathObject, compile=False, arch=None, minify=False, keep_lines=False):
+        # the hash of the content plus how it is turned into the output, hash is updated
+        if compile and self.should_compile(path):
+            hash.update(b'compile')
+            if arch != None:
+                hash.update(str(arch).encode("utf-8"))
+            for option in self.compile_options(path):
+                hash.update(b' ' + option.encode("utf-8"))
+        elif minify and self.should_minify(path, compile):
+            hash.update(b'minify-lines' if keep_lines else b'minify')
+        return hash.hexdigest()
+
+    def __target_of(self, path:FileEntity, compile=False) -> FileEntity:
+        # the file a local file becomes on the board, .py may turn into .mpy
+        if compile and self.should_compile(path):
+            return FileEntity(path.directory, PATTERN_PY.sub(".mpy", path.name), path.type, path.size)
+        return path
 
-    def __upload_file(self, local_file:PathLike, remote_file:PathObject=None, compile=False, arch=None, progress_callback:ProgressCallback=None):
+    @traced("upload_file", "filesync")
+    def __upload_file(self, local_file:PathLike, remote_file:PathObject=None, compile=False, arch=None, minify=False, keep_lines=False, progress_callback:ProgressCallback=None) -> FileEntity:
         lol = convert_to_pathstr(local_file)
         if remote_file == None:
             remote_file = self.get_remote_path(local_file)
         rmt = convert_to_pathstr(remote_file)
         if compile and self.should_compile(lol) and self.should_compile(rmt):
-            data = get_compiled_file_content(lol, arch=arch)
+            data = get_compiled_file_content(lol, arch=arch, options=self.compile_options(rmt))
             rmt = PATTERN_PY.sub(".mpy", rmt)
+        elif minify and self.should_minify(rmt, compile):
+            data = minify_file(lol, keep_lines)
         else:
             with open(lol, "rb") as f:
                 data = f.read()
-        self.__fe.upload(rmt, data, progress_callback=progress_callback)
+        return self.__fe.upload(rmt, data, progress_callback=progress_callback)
 
-    def sync_dir_remote_with_local(self, compile=False, arch=None, ignore_hidden=True, upload_only_modified=True, delete_exist_file=True, progress_callback:SyncProgressCallback=None):
+    def __sync_changes(self, compile, arch, ignore_hidden, upload_only_modified, walk_remote, minify, keep_lines):
+        ''' what a sync has to do, shared by sync_dir_remote_with_local and plan_sync, only reads the board '''
+        manifest = self.__read_remote_record()
+        remote_exists = manifest.is_directory(self.__remote) or bool(self.__fe.exist(self.__remote))
+        # get file list
+        local_files = set(self.__walk_local_like_remote(ignore_hidden))
+        local_files_compiled = set()
+        for f in local_files:
+            local_files_compiled.update([self.__target_of(f, compile)])
+        if not remote_exists:
+            remote_files = set()
+        elif walk_remote or not manifest.complete:
+            remote_files = set(self.__walk_remote())
+        else:
+            remote_files = set(f for f in manifest.files() if self.should_include(f, ignore_hidden))
+        # get files need delete
+        exist_should_delete_files = remote_files - local_files_compiled # file to delete
+        for f in self.__record_files():
+            exist_should_delete_files.discard(f)
+        # get must upload file
+        need_upload_files = set()
+        hashes = {}
+        for local_file in local_files:
+            key = convert_to_pathstr(self.__target_of(local_file, compile))
+            if local_file.type == FileEntityType.DIRECTORY:
+                if not manifest.is_directory(key):
+                    need_upload_files.add(local_file)
+                continue
+            hash = self.__hash_local_file(local_file, compile, arch, minify, keep_lines)
+            hashes[key] = hash
+            if not manifest.matches(key, hash) or (not upload_only_modified):
+                need_upload_files.add(local_file) # replaced atomically, no need to delete first
+        return manifest, remote_exists, local_files_compiled, exist_should_delete_files, need_upload_files, hashes
+
+    @traced("sync", "filesync")
+    def sync_dir_remote_with_local(self, compile=False, arch=None, ignore_hidden=True, upload_only_modified=True, delete_exist_file=True, progress_callback:SyncProgressCallback=None, walk_remote=False, minify=False, keep_lines=False):
+        '''
+        Sync the local folder to the board.
+        The manifest on the board lists what the last sync left there, so the board is only walked
+        when there is no manifest yet (or walk_remote is set, to catch files changed by hand).
+        With minify, .py files shipped as source are minified (see minify), keep_lines keeps line numbers.
+        '''
         self.__fe._require_device()
         need_close = False
         if self.__fe.status == FileExplorerStatus.UNKNOWN:
@@ -134,118 +324,464 @@ class FileSync():
         try:
             if need_close:
                 self.__fe.init()
-            file_record = {}
-            new_file_record = {}
-            try:
-                j = self.__fe.download(self.__record_file_path).decode("utf-8")
-                file_record = json.loads(j)
-            except: pass
+            manifest, remote_exists, local_files_compiled, exist_should_delete_files, need_upload_files, hashes = \
+                self.__sync_changes(compile, arch, ignore_hidden, upload_only_modified, walk_remote, minify, keep_lines)
             # ensure target folder exist on remote
-            if not self.__fe.exist(self.__remote):
+            if not remote_exists:
                 self.__fe.mkdirs(self.__remote)
-            # get file list
-            local_files = set(self.__walk_local_like_remote(ignore_hidden))
-            local_files_compiled = set()
-            for f in local_files:
-                if compile and self.should_compile(f):
-                    new_name = PATTERN_PY.sub(".mpy", f.name)
-                    local_files_compiled.update([FileEntity(f.directory, new_name, f.type, f.size)])
-                else:
-                    local_files_compiled.update([f])
-            remote_files = set(self.__walk_remote())
-            # get files need delete
-            exist_should_delete_files = remote_files - local_files_compiled # file to delete
-            try:
-                f = self.__fe.stat(self.__record_file_path)
-                exist_should_delete_files.discard(f)
-            except: pass
-            # get must upload file
-            need_upload_files = set()
-            dir_count = 0
-            for local_file in local_files:
-                if local_file.type == FileEntityType.DIRECTORY:
-                    need_upload_files.add(local_file)
-                    dir_count += 1
-                    continue
-                hash = self.__hash_local_file(local_file, compile)
-                key = convert_to_pathstr(local_file)
-                new_file_record[key] = hash
-                if not (key in file_record and file_record[key] == hash) or (not upload_only_modified):
-                    exist_should_delete_files.add(local_file) # delete first, and upload
-                    need_upload_files.add(local_file)
+            dir_count = len([f for f in need_upload_files if f.type == FileEntityType.DIRECTORY])
             # start upload
             total = len(need_upload_files) - dir_count
             if delete_exist_file:
                 total += len(exist_should_delete_files)
             finished = 0
+            expect_progress(progress_callback, dict((str(f.abspath.relative_to(self.__remote)), syspath.getsize(self.get_local_path(f)))
+                for f in need_upload_files if f.type != FileEntityType.DIRECTORY))
             if delete_exist_file:
                 for f in exist_should_delete_files:
                     if progress_callback != None:
                         progress_callback(finished, total, 0, 0, "delete", str(f.abspath.relative_to(self.__remote)))
                     self.__fe.rmtree(f)
+                    manifest.remove_tree(f)
                     finished += 1
-            for f in need_upload_files:
+                    self.__fe.yield_device()
+            for f in sorted(need_upload_files, key=lambda f: str(f.abspath)):
+                self.__fe.yield_device() # let short operations of other threads in between files
+                key = convert_to_pathstr(self.__target_of(f, compile))
                 def upload_progress_callback(sub_p, sub_t):
                     if progress_callback != None:
                         progress_callback(finished, total, sub_p, sub_t, "upload", str(f.abspath.relative_to(self.__remote)))
                 if f.type == FileEntityType.DIRECTORY:
                     self.__fe.mkdirs(f)
+                    manifest.set(key, FileEntityType.DIRECTORY)
                     continue # dir not count
                 else:
                     try:
-                        self.__upload_file(self.get_local_path(f), f, compile, arch, progress_callback=upload_progress_callback)
+                        uploaded = self.__upload_file(self.get_local_path(f), f, compile, arch, minify, keep_lines, progress_callback=upload_progress_callback)
+                        manifest.set(key, FileEntityType.FILE, uploaded.size, hashes[key])
                     except:
-                        key = key = convert_to_pathstr(f)
-                        del new_file_record[key]
+                        manifest.remove(key)
                         print("================")
                         traceback.print_exc()
                         print('========> Upload Error:', key)
                 finished += 1
+            # forget everything that is not synced from local anymore
+            synced_keys = set(convert_to_pathstr(f) for f in local_files_compiled)
+            for key in list(manifest.entries):
+                if key not in synced_keys:
+                    manifest.remove(key)
             # write record
-            self.__fe.upload(self.__record_file_path, json.dumps(new_file_record).encode("utf-8"))
+            self.__write_remote_record(manifest)
         finally:
             if need_close:
                 self.__fe.close()
             self.__fe._release_device()
-    
-    def build(self, compile=False, arch=None, ignore_hidden=True, target_folder:PathLike=".build", progress_callback:SyncProgressCallback=None):
+
+    @traced("plan", "filesync")
+    def plan_sync(self, link:LinkModel, compile=False, arch=None, ignore_hidden=True, upload_only_modified=True, delete_exist_file=True, walk_remote=False, minify=False, keep_lines=False) -> SyncPlan:
+        '''
+        What sync_dir_remote_with_local would do with the same arguments, without changing the board.
+        Files to compile are compiled locally to learn their size, the transfer time is estimated with link.
+        '''
+        self.__fe._require_device()
+        need_close = False
+        if self.__fe.status == FileExplorerStatus.UNKNOWN:
+            need_close = True
+        try:
+            if need_close:
+                self.__fe.init()
+            manifest, remote_exists, local_files_compiled, exist_should_delete_files, need_upload_files, hashes = \
+                self.__sync_changes(compile, arch, ignore_hidden, upload_only_modified, walk_remote, minify, keep_lines)
+            agent = self.__fe.agent_active
+            plan = SyncPlan(link)
+            if not remote_exists:
+                plan.add(OP_MKDIR, str(self.__remote), 0, MKDIR_ROUND_TRIPS, MKDIR_ROUND_TRIPS * REPL_COMMAND_BYTES)
+            if delete_exist_file:
+                for f in sorted(exist_should_delete_files, key=lambda f: str(f.abspath)):
+                    plan.add(OP_DELETE, str(f.abspath), 0, DELETE_ROUND_TRIPS, DELETE_ROUND_TRIPS * REPL_COMMAND_BYTES)
+            for f in sorted(need_upload_files, key=lambda f: str(f.abspath)):
+                key = convert_to_pathstr(self.__target_of(f, compile))
+                if f.type == FileEntityType.DIRECTORY:
+                    plan.add(OP_MKDIR, key, 0, MKDIR_ROUND_TRIPS, MKDIR_ROUND_TRIPS * REPL_COMMAND_BYTES)
+                    continue
+                local = self.get_local_path(f)
+                if compile and self.should_compile(f):
+                    start = time.perf_counter()
+                    size = len(get_compiled_file_content(local, arch=arch, options=self.compile_options(f)))
+                    plan.add(OP_COMPILE, key, size, seconds=time.perf_counter() - start)
+                elif minify and self.should_minify(f, compile):
+                    size = len(minify_file(local, keep_lines))
+                else:
+                    size = syspath.getsize(local)
+                trips, wire = upload_cost(size, agent, self.__fe.pipeline_window, self.__fe.pipeline_bytes)
+                plan.add(OP_UPLOAD, key, size, trips, wire)
+            if len(plan.operations) > 0:
+                # the manifest changes are appended, about 30 bytes per entry
+                size = 30 * len(plan.operations)
+                trips, wire = upload_cost(size, agent, self.__fe.pipeline_window, self.__fe.pipeline_bytes)
+                plan.add(OP_MANIFEST, str(self.__record_file_path), size, trips, wire)
+            return plan
+        finally:
+            if need_close:
+                self.__fe.close()
+            self.__fe._release_device()
+
+    @traced("deploy", "filesync")
+    def deploy(self, upload_only_modified=True, delete_exist_file=True, progress_callback:SyncProgressCallback=None, walk_remote=False):
+        '''
+        Sync a build output folder (the local path) to the board.
+        The manifest written by build is the source of truth, it is compared with the manifest
+        on the board directly, nothing is hashed or compiled and the board is only walked when
+        it has no manifest yet.
+        '''
+        local_record = self.get_local_path(self.__record_file_path)
+        with open(local_record, "rb") as f:
+            build_manifest = Manifest.loads(f.read())
+        for key, (type, _, _) in build_manifest.entries.items():
+            localpath = self.get_local_path(key)
+            if not (syspath.isdir(localpath) if type == FileEntityType.DIRECTORY else syspath.isfile(localpath)):
+                raise FileNotFoundError("Build output missing for {}: {}".format(key, localpath))
+        self.__fe._require_device()
+        need_close = False
+        if self.__fe.status == FileExplorerStatus.UNKNOWN:
+            need_close = True
+        try:
+            if need_close:
+                self.__fe.init()
+            manifest = self.__read_remote_record()
+            if not manifest.is_directory(self.__remote) and not self.__fe.exist(self.__remote):
+                self.__fe.mkdirs(self.__remote)
+            # get files need delete
+            local_files = set(build_manifest.files())
+            if walk_remote or not manifest.complete:
+                remote_files = set(self.__walk_remote())
+            else:
+                remote_files = set(manifest.files())
+            exist_should_delete_files = remote_files - local_files
+            for f in self.__record_files():
+                exist_should_delete_files.discard(f)
+            # get must upload file
+            need_upload_keys = []
+            for key in sorted(build_manifest.entries):
+                if not manifest.same(key, build_manifest) or (not upload_only_modified):
+                    need_upload_keys.append(key)
+            # start upload
+            total = len([k for k in need_upload_keys if not build_manifest.is_directory(k)])
+            if delete_exist_file:
+                total += len(exist_should_delete_files)
+            finished = 0
+            expect_progress(progress_callback, dict((str(PurePosixPath(key).relative_to(self.__remote)), syspath.getsize(self.get_local_path(key)))
+                for key in need_upload_keys if not build_manifest.is_directory(key)))
+            if delete_exist_file:
+                for f in exist_should_delete_files:
+                    if progress_callback != None:
+                        progress_callback(finished, total, 0, 0, "delete", str(f.abspath.relative_to(self.__remote)))
+                    self.__fe.rmtree(f)
+                    manifest.remove_tree(f)
+                    finished += 1
+                    self.__fe.yield_device()
+            for key in need_upload_keys:
+                self.__fe.yield_device() # let short operations of other threads in between files
+                def upload_progress_callback(sub_p, sub_t):
+                    if progress_callback != None:
+                        progress_callback(finished, total, sub_p, sub_t, "upload", str(PurePosixPath(key).relative_to(self.__remote)))
+                if build_manifest.is_directory(key):
+                    self.__fe.mkdirs(key)
+                    manifest.copy_entry(key, build_manifest)
+                    continue # dir not count
+                try:
+                    with open(self.get_local_path(key), "rb") as fp:
+                        data = fp.read()
+                    self.__fe.upload(key, data, progress_callback=upload_progress_callback)
+                    manifest.copy_entry(key, build_manifest)
+                except:
+                    manifest.remove(key)
+                    print("================")
+                    traceback.print_exc()
+                    print('========> Upload Error:', key)
+                finished += 1
+            for key in list(manifest.entries):
+                if key not in build_manifest.entries:
+                    manifest.remove(key)
+            # write record
+            self.__write_remote_record(manifest)
+        finally:
+            if need_close:
+                self.__fe.close()
+            self.__fe._release_device()
+
+    @traced("pull", "filesync")
+    def sync_local_with_remote(self, ignore_hidden=True, download_only_modified=True, delete_exist_file=False, progress_callback:SyncProgressCallback=None):
+        '''
+        Mirror the remote path into the local path, the reverse of sync_dir_remote_with_local.
+        The board is walked in one round trip, local files of the same size are compared with hashes
+        computed on the board and skipped when identical. Downloads stream into a partial file that
+        replaces the local file when complete. Local files missing on the board are only deleted
+        with delete_exist_file.
+        '''
+        self.__fe._require_device()
+        need_close = False
+        if self.__fe.status == FileExplorerStatus.UNKNOWN:
+            need_close = True
+        try:
+            if need_close:
+                self.__fe.init()
+            record_files = self.__record_files()
+            remote_files = [f for f in self.__walk_remote(ignore_hidden) if f not in record_files]
+            makedirs(self.__local, exist_ok=True)
+            # get must download file
+            need_download_files = []
+            same_size_files = []
+            for f in remote_files:
+                localpath = self.get_local_path(f)
+                if f.type == FileEntityType.DIRECTORY:
+                    makedirs(localpath, exist_ok=True)
+                elif download_only_modified and syspath.isfile(localpath) and syspath.getsize(localpath) == f.size:
+                    same_size_files.append(f)
+                else:
+                    need_download_files.append(f)
+            for f, hash in zip(same_size_files, self.__fe.hashes(same_size_files)):
+                if hash != self.__hash_local_file(f):
+                    need_download_files.append(f)
+            # get files need delete, deepest first
+            exist_should_delete_files = []
+            if delete_exist_file:
+                remote_paths = set(f.abspath for f in remote_files)
+                for f in self.__walk_local_like_remote(ignore_hidden):
+                    if f.abspath not in remote_paths and f.abspath != self.__remote:
+                        exist_should_delete_files.append(f)
+                exist_should_delete_files.sort(key=lambda f: len(f.abspath.parts), reverse=True)
+            # start download
+            total = len(need_download_files) + len(exist_should_delete_files)
+            finished = 0
+            expect_progress(progress_callback, dict((str(f.abspath.relative_to(self.__remote)), f.size) for f in need_download_files))
+            for f in exist_should_delete_files:
+                if progress_callback != None:
+                    progress_callback(finished, total, 0, 0, "delete", str(f.abspath.relative_to(self.__remote)))
+                localpath = self.get_local_path(f)
+                if f.type == FileEntityType.DIRECTORY:
+                    rmtree(localpath, ignore_errors=True)
+                elif syspath.exists(localpath):
+                    remove(localpath)
+                finished += 1
+            for f in sorted(need_download_files, key=lambda f: str(f.abspath)):
+                self.__fe.yield_device() # let short operations of other threads in between files
+                def download_progress_callback(sub_p, sub_t):
+                    if progress_callback != None:
+                        progress_callback(finished, total, sub_p, sub_t, "download", str(f.abspath.relative_to(self.__remote)))
+                localpath = self.get_local_path(f)
+                partpath = localpath.parent.joinpath("." + localpath.name + PARTIAL_FILE_SUFFIX)
+                try:
+                    with open(partpath, "wb") as out:
+                        self.__fe.download_to(f, out, progress_callback=download_progress_callback)
+                    replace(partpath, localpath)
+                except:
+                    if syspath.exists(partpath):
+                        remove(partpath)
+                    print("================")
+                    traceback.print_exc()
+                    print('========> Download Error:', str(f.abspath))
+                finished += 1
+        finally:
+            if need_close:
+                self.__fe.close()
+            self.__fe._release_device()
+
+    def __record_files(self) -> List[FileEntity]:
+        # files on the board that belong to mpypack itself
+        return [
+            FileEntity(self.__record_file_path, "", FileEntityType.FILE),
+            FileEntity(self.__legacy_record_file_path, "", FileEntityType.FILE),
+            FileEntity(AGENT_REMOTE_PATH, "", FileEntityType.FILE),
+        ]
+
+    @traced("read_manifest", "filesync")
+    def __read_remote_record(self) -> Manifest:
+        for path in [self.__record_file_path, self.__legacy_record_file_path]:
+            try:
+                data = self.__fe.download(path)
+            except:
+                continue
+            try:
+                return Manifest.loads(data)
+            except ManifestError:
+                break
+        return Manifest()
+
+    @traced("write_manifest", "filesync")
+    def __write_remote_record(self, manifest:Manifest):
+        if manifest.appendable:
+            changes = manifest.dump_changes()
+            if len(changes) > 0:
+                self.__fe.append(self.__record_file_path, changes)
+            return
+        legacy = manifest.legacy
+        self.__fe.upload(self.__record_file_path, manifest.dumps())
+        if legacy:
+            self.__fe.rmtree(self.__legacy_record_file_path)
+
+    def build(self, compile=False, arch=None, ignore_hidden=True, target_folder:PathLike=".build", progress_callback:SyncProgressCallback=None, clean=False, copy_strategy=COPY_AUTO, jobs=1, minify=False, keep_lines=False, freeze_manifest:PathLike=None,
+            image:PathLike=None, image_format=IMAGE_FAT, block_size=None, block_count=None):
+        '''
+        Copy (and maybe compile or minify) the source folder to target_folder.
+        Incremental unless clean is set: the manifest left by the previous build is used to skip
+        sources that did not change, outputs without a source are deleted.
+        Files that are not compiled are copied with copy_strategy (see filecopy), by jobs threads,
+        mpy-cross runs with jobs threads too.
+        With freeze_manifest, the files that would be compiled are written to that MicroPython
+        manifest.py instead of target_folder, which keeps the data files only. These are also
+        listed in <manifest name>_data.txt.
+        With image, target_folder (manifest included, so later syncs stay incremental) is also
+        packed into a FAT or LittleFS partition image of block_count blocks, laid out as the
+        board would see it from its filesystem root.
+        '''
+        self.build_matrix([(arch, target_folder)], compile=compile, ignore_hidden=ignore_hidden, progress_callback=progress_callback, clean=clean, copy_strategy=copy_strategy, jobs=jobs,
+            minify=minify, keep_lines=keep_lines, freeze_manifest=freeze_manifest, image=image, image_format=image_format, block_size=block_size, block_count=block_count)
+
+    @traced("build", "filesync")
+    def build_matrix(self, targets:List[BuildTarget], compile=False, ignore_hidden=True, progress_callback:SyncProgressCallback=None, clean=False, copy_strategy=COPY_AUTO, jobs=1, minify=False, keep_lines=False, freeze_manifest:PathLike=None,
+            image:PathLike=None, image_format=IMAGE_FAT, block_size=None, block_count=None):
+        '''
+        build for several (arch, target_folder) targets in one pass: the source is walked, hashed
+        and minified once, the copies of all targets share one pool and the mpy-cross jobs of all
+        targets run together, by at least one thread per target.
+        freeze_manifest and image need a single target.
+        '''
+        if len(targets) == 0:
+            raise ValueError("No build target")
+        if len(targets) > 1 and (freeze_manifest != None or image != None):
+            raise ValueError("Freeze manifest and image need a single build target")
+        outputs = [_BuildOutput(arch, target_folder) for arch, target_folder in targets]
+        if len(set(syspath.normcase(o.folder) for o in outputs)) != len(outputs):
+            raise ValueError("Build targets share an output folder")
         local_files = set(self.__walk_local_like_remote(ignore_hidden))
-        target_folder = syspath.abspath(target_folder)
-        if syspath.exists(target_folder):
-            rmtree(target_folder)
-        makedirs(target_folder)
-        new_file_record = {}
+        frozen = {}
+        if freeze_manifest != None:
+            for f in local_files:
+                if self.should_compile(f):
+                    frozen[str(f.abspath.relative_to(self.__remote))] = freeze_opt(self.compile_options(f))
+            local_files = set(f for f in local_files if str(f.abspath.relative_to(self.__remote)) not in frozen)
+            # folders that still hold something
+            kept = set([self.__remote])
+            for f in local_files:
+                if f.type == FileEntityType.FILE:
+                    kept.update(f.abspath.parents)
+            local_files = set(f for f in local_files if f.type == FileEntityType.FILE or f.abspath in kept)
+        for out in outputs:
+            if clean and syspath.exists(out.folder):
+                rmtree(out.folder)
+            if not syspath.exists(out.folder):
+                makedirs(out.folder)
+            out.record_target = syspath.join(out.folder, PurePath(self.get_local_path(self.__record_file_path)).relative_to(self.__local))
+            try:
+                with open(out.record_target, "rb") as f:
+                    out.manifest = Manifest.loads(f.read())
+            except (OSError, ManifestError): pass
+            out.expected_files.add(syspath.normcase(out.record_target))
+        compile_jobs = []
+        copy_jobs = []
         for f in local_files:
             # base info
             localpath = self.get_local_path(f)
-            target = syspath.join(target_folder, PurePath(localpath).relative_to(self.__local))
-            folder = syspath.dirname(target)
+            relpath = PurePath(localpath).relative_to(self.__local)
+            key = convert_to_pathstr(self.__target_of(f, compile))
             if f.type == FileEntityType.DIRECTORY:
+                for out in outputs:
+                    target = syspath.join(out.folder, relpath)
+                    out.expected_dirs.add(syspath.normcase(target))
+                    out.new_manifest.set(key, FileEntityType.DIRECTORY)
+                    if not syspath.exists(target):
+                        makedirs(target)
+                continue
+            name = str(f.abspath.relative_to(self.__remote))
+            compiled = compile and self.should_compile(f)
+            minified = None
+            # calc hash, the content once for all targets
+            content_hash = self.__hash_local_content(f)
+            for out in outputs:
+                target = syspath.join(out.folder, relpath)
+                folder = syspath.dirname(target)
+                hash = self.__hash_variant(content_hash.copy(), f, compile, out.arch, minify, keep_lines)
+                if compiled:
+                    target = PATTERN_PY.sub(".mpy", target)
+                out.expected_files.add(syspath.normcase(target))
+                out.built.append((key, target, hash))
+                if out.manifest.matches(key, hash) and syspath.exists(target):
+                    continue # up to date
+                # build
                 if not syspath.exists(folder):
                     makedirs(folder)
-                continue
+                tag = name if len(outputs) == 1 else "{} ({})".format(name, out.name)
+                if compiled:
+                    compile_jobs.append((str(localpath), target, out.arch, self.compile_options(f), tag))
+                elif minify and self.should_minify(f, compile):
+                    if progress_callback != None:
+                        progress_callback(0, 0, 0, 0, "build", tag)
+                    if minified == None:
+                        minified = minify_file(localpath, keep_lines)
+                    if syspath.lexists(target):
+                        remove(target) # may be a hard link to the source, see copy_file
+                    with open(target, "wb") as fp:
+                        fp.write(minified)
+                else:
+                    copy_jobs.append((str(localpath), target, tag))
+        for tag in compile_files(compile_jobs, max(jobs, len(outputs))):
             if progress_callback != None:
-                progress_callback(0, 0, 0, 0, "build", str(f.abspath.relative_to(self.__remote)))
-            # calc hash
-            hash = self.__hash_local_file(f, compile)
-            key = convert_to_pathstr(f)
-            new_file_record[key] = hash
-            # build
+                progress_callback(0, 0, 0, 0, "build", tag)
+        for tag in copy_files(copy_jobs, copy_strategy, jobs):
+            if progress_callback != None:
+                progress_callback(0, 0, 0, 0, "build", tag)
+        for out in outputs:
+            for key, target, hash in out.built:
+                out.new_manifest.set(key, FileEntityType.FILE, syspath.getsize(target), hash)
+            # delete outputs whose source is gone
+            for cur_dir, dirs, files in walk(out.folder, topdown=False):
+                for name in files:
+                    target = syspath.join(cur_dir, name)
+                    if syspath.normcase(target) not in out.expected_files:
+                        if progress_callback != None:
+                            progress_callback(0, 0, 0, 0, "delete", syspath.relpath(target, out.folder))
+                        remove(target)
+                if syspath.normcase(cur_dir) not in out.expected_dirs and len(listdir(cur_dir)) == 0:
+                    rmdir(cur_dir)
+            # write manifest
+            folder = syspath.dirname(out.record_target)
             if not syspath.exists(folder):
                 makedirs(folder)
-            if compile and self.should_compile(f):
-                data = get_compiled_file_content(localpath, arch=arch)
-                target = PATTERN_PY.sub(".mpy", target)
-            else:
-                with open(localpath, 'rb') as f:
-                    data = f.read()
-            with open(target, 'wb') as f:
-                f.write(data)
-        # write hash record
-        localpath = self.get_local_path(self.__record_file_path)
-        target = syspath.join(target_folder, PurePath(localpath).relative_to(self.__local))
-        folder = syspath.dirname(target)
+            with open(out.record_target, "wb") as f:
+                f.write(out.new_manifest.dumps())
+        if freeze_manifest != None:
+            self.__write_freeze_manifest(freeze_manifest, frozen, outputs[0].new_manifest)
+        if image != None:
+            if progress_callback != None:
+                progress_callback(0, 0, 0, 0, "image", str(image))
+            self.__write_image(image, outputs[0].folder, outputs[0].record_target, outputs[0].new_manifest, image_format, block_size, block_count)
+
+    @traced("write_image", "filesync")
+    def __write_image(self, path:PathLike, target_folder:PathLike, record_target:PathLike, manifest:Manifest, format, block_size, block_count):
+        entries = [(str(p), None) for p in reversed(self.__remote.parents)]
+        entries.append((str(self.__remote), None))
+        for key in sorted(manifest.entries, key=lambda k: PurePosixPath(k).parts):
+            if key == str(self.__remote):
+                continue
+            local = syspath.join(target_folder, *PurePosixPath(key).relative_to(self.__remote).parts)
+            entries.append((key, None if manifest.is_directory(key) else local))
+        entries.append((str(self.__record_file_path), record_target))
+        data = build_image(entries, format, block_size, block_count)
+        path = syspath.abspath(path)
+        folder = syspath.dirname(path)
+        if not syspath.exists(folder):
+            makedirs(folder)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def __write_freeze_manifest(self, path:PathLike, frozen:dict, data_manifest:Manifest):
+        path = syspath.abspath(path)
+        folder = syspath.dirname(path)
         if not syspath.exists(folder):
             makedirs(folder)
-        with open(target, "wb") as f:
-            f.write(json.dumps(new_file_record).encode("utf-8"))
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(render_freeze_manifest(self.__local, freeze_entries(self.__local, frozen, self.__search_paths)))
+        data_files = sorted(k for k, (type, _, _) in data_manifest.entries.items() if type == FileEntityType.FILE)
+        with open(syspath.splitext(path)[0] + "_data.txt", "w", encoding="utf-8") as f:
+            f.write("".join(k + "\n" for k in data_files))
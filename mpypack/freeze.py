@@ -0,0 +1,74 @@
+try:
+    from importgraph import DEFAULT_SEARCH_PATHS
+except ImportError:
+    from mpypack.importgraph import DEFAULT_SEARCH_PATHS
+import re
+from os import walk, PathLike, path as syspath
+from pathlib import PurePath, PurePosixPath
+from typing import Dict, List, Tuple, Union
+
+PATTERN_OPT = re.compile(r'^-O(\d)$')
+
+# kind ("module" or "package"), path relative to base, base relative to the source root, opt
+FreezeEntry = Tuple[str, str, str, Union[int, None]]
+
+def freeze_opt(options:List[str]) -> Union[int, None]:
+    # the -O level of mpy-cross options, the only one manifest.py can express
+    for option in options:
+        m = PATTERN_OPT.match(option)
+        if m:
+            return int(m.group(1))
+    return None
+
+def _split_base(source:str, relpath:str, search_paths:List[str]) -> Tuple[str, str]:
+    path = PurePosixPath(relpath)
+    for sp in sorted(search_paths, key=len, reverse=True):
+        if not sp:
+            continue
+        if syspath.isfile(syspath.join(source, *PurePosixPath(sp).parts, "__init__.py")):
+            continue # a package, not a search path
+        try:
+            return sp, str(path.relative_to(sp))
+        except ValueError:
+            pass
+    return "", relpath
+
+def freeze_entries(source:PathLike, frozen:Dict[str, Union[int, None]], search_paths:List[str]=DEFAULT_SEARCH_PATHS) -> List[FreezeEntry]:
+    '''
+    manifest.py entries for the frozen .py files (relative posix path -> opt) of source,
+    whole packages become package() when every .py file in them is frozen with the same opt.
+    '''
+    source = syspath.abspath(source)
+    groups:Dict[Tuple[str, str], List[str]] = {}
+    for relpath in sorted(frozen):
+        base, path = _split_base(source, relpath, search_paths)
+        parts = PurePosixPath(path).parts
+        top = parts[0] if len(parts) > 1 else ""
+        groups.setdefault((base, top), []).append(relpath)
+    entries = []
+    for (base, top), relpaths in sorted(groups.items()):
+        if top:
+            package_dir = syspath.join(source, *PurePosixPath(base).parts, top)
+            package_files = set()
+            for cur_dir, _, files in walk(package_dir):
+                for name in files:
+                    if name.endswith(".py"):
+                        package_files.add(PurePath(syspath.join(cur_dir, name)).relative_to(source).as_posix())
+            opts = set(frozen[p] for p in relpaths)
+            if package_files == set(relpaths) and len(opts) == 1:
+                entries.append(("package", top, base, opts.pop()))
+                continue
+        for relpath in relpaths:
+            entries.append(("module", _split_base(source, relpath, search_paths)[1], base, frozen[relpath]))
+    return entries
+
+def render_freeze_manifest(source:PathLike, entries:List[FreezeEntry]) -> str:
+    source = syspath.abspath(source)
+    lines = ["# MicroPython freeze manifest generated by mpypack build, rebuild to update."]
+    for kind, path, base, opt in entries:
+        base_path = syspath.join(source, *PurePosixPath(base).parts) if base else source
+        args = "{!r}, base_path={!r}".format(path, base_path)
+        if opt != None:
+            args += ", opt={}".format(opt)
+        lines.append("{}({})".format(kind, args))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,316 @@
+import struct
+from pathlib import PurePosixPath
+from typing import Dict, List, Tuple, Union
+
+IMAGE_FAT = "fat"
+IMAGE_LITTLEFS = "littlefs"
+IMAGE_FORMATS = [IMAGE_FAT, IMAGE_LITTLEFS]
+DEFAULT_BLOCK_SIZE = {IMAGE_FAT: 512, IMAGE_LITTLEFS: 4096}
+
+# (path in the image, local file or None for a directory), parents before children
+ImageEntry = Tuple[str, Union[str, None]]
+
+class ImageError(ValueError):
+    pass
+
+def _read(local:str) -> bytes:
+    with open(local, "rb") as f:
+        return f.read()
+
+# FAT ------------------------------------------------------------------------------------
+# FAT12/16 as FatFs (MicroPython's vfs_fat) formats it: one FAT, 512 root entries,
+# long file names, fixed timestamps so images are reproducible.
+
+FAT_ROOT_ENTRIES = 512
+FAT_DATE = (20 << 9) | (1 << 5) | 1 # 2000-01-01
+FAT_ATTR_DIRECTORY = 0x10
+FAT_ATTR_ARCHIVE = 0x20
+FAT_ATTR_VOLUME = 0x08
+FAT_ATTR_LFN = 0x0F
+FAT_SHORT_CHARS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!#$%&'()-@^_`{}~")
+
+def _fat_layout(block_size:int, block_count:int):
+    # smallest cluster that keeps the cluster count in FAT16 range
+    root_sectors = (FAT_ROOT_ENTRIES * 32 + block_size - 1) // block_size
+    spc = 1
+    while spc <= 128:
+        fat_sectors = 1
+        while True:
+            clusters = (block_count - 1 - fat_sectors - root_sectors) // spc
+            bits = 12 if clusters < 4085 else 16
+            need = ((clusters + 2) * bits // 8 + block_size) // block_size
+            if need <= fat_sectors:
+                break
+            fat_sectors = need
+        if clusters < 1:
+            raise ImageError("Image too small: {} blocks of {}".format(block_count, block_size))
+        if clusters < 65525:
+            return spc, fat_sectors, root_sectors, clusters, bits
+        spc *= 2
+    raise ImageError("Image too large for FAT16")
+
+def _fat_short_name(name:str, used:set) -> Tuple[bytes, int, bool]:
+    # 11 byte 8.3 name, NT case flags, whether a long name entry is needed
+    base, dot, ext = name.rpartition(".")
+    if not dot:
+        base, ext = name, ""
+    def fits(s, n):
+        return 0 < len(s) <= n and all(c in FAT_SHORT_CHARS for c in s.upper()) and (s.islower() or s.isupper() or not any(c.isalpha() for c in s))
+    if fits(base, 8) and (ext == "" or fits(ext, 3)) and name.count(".") <= 1:
+        short = (base.upper().ljust(8) + ext.upper().ljust(3)).encode("ascii")
+        if short not in used:
+            used.add(short)
+            flags = (0x08 if base.islower() else 0) | (0x10 if ext.islower() else 0)
+            return short, flags, False
+    clean = lambda s: "".join(c if c in FAT_SHORT_CHARS else "_" for c in s.upper().replace(" ", "").replace(".", ""))
+    base_s = clean(base if dot else name) or "_"
+    ext_s = clean(ext)[:3] if dot else ""
+    for n in range(1, 1000000):
+        tail = "~" + str(n)
+        short = (base_s[:8 - len(tail)] + tail).ljust(8) + ext_s.ljust(3)
+        short = short.encode("ascii")
+        if short not in used:
+            used.add(short)
+            return short, 0, True
+    raise ImageError("Too many similar names: {}".format(name))
+
+def _fat_checksum(short:bytes) -> int:
+    s = 0
+    for c in short:
+        s = (((s & 1) << 7) + (s >> 1) + c) & 0xFF
+    return s
+
+def _fat_lfn_entries(name:str, short:bytes) -> List[bytes]:
+    chars = list(name.encode("utf-16-le"))
+    units = [chars[i] | (chars[i + 1] << 8) for i in range(0, len(chars), 2)]
+    if len(units) % 13 != 0:
+        units.append(0)
+    while len(units) % 13 != 0:
+        units.append(0xFFFF)
+    checksum = _fat_checksum(short)
+    entries = []
+    count = len(units) // 13
+    for seq in range(count, 0, -1):
+        part = units[(seq - 1) * 13:seq * 13]
+        entries.append(struct.pack("<B5HBBB6HH2H", seq | (0x40 if seq == count else 0), *part[:5], FAT_ATTR_LFN, 0, checksum, *part[5:11], 0, *part[11:13]))
+    return entries
+
+def _fat_entry(short:bytes, attr:int, flags:int, cluster:int, size:int) -> bytes:
+    return struct.pack("<11sBBBHHHHHHHI", short, attr, flags, 0, 0, FAT_DATE, FAT_DATE, 0, 0, FAT_DATE, cluster, size)
+
+def build_fat_image(entries:List[ImageEntry], block_size=512, block_count=2048, label="MPYPACK") -> bytes:
+    spc, fat_sectors, root_sectors, clusters, bits = _fat_layout(block_size, block_count)
+    cluster_size = spc * block_size
+    data_start = (1 + fat_sectors + root_sectors) * block_size
+    image = bytearray(block_size * block_count)
+    fat = [0] * (clusters + 2)
+    fat[0] = 0xFF8 if bits == 12 else 0xFFF8
+    fat[1] = 0xFFF if bits == 12 else 0xFFFF
+    eoc = 0xFFF if bits == 12 else 0xFFFF
+    # directory tree
+    children:Dict[str, List[Tuple[str, Union[str, None]]]] = {"/": []}
+    for path, local in entries:
+        p = PurePosixPath("/").joinpath(path)
+        if str(p) == "/":
+            continue
+        if str(p.parent) not in children:
+            raise ImageError("Parent directory missing: {}".format(p))
+        children[str(p.parent)].append((p.name, local))
+        if local == None:
+            children[str(p)] = []
+    next_cluster = [2]
+    def allocate(size) -> int:
+        count = max(1, (size + cluster_size - 1) // cluster_size)
+        first = next_cluster[0]
+        if first + count > clusters + 2:
+            raise ImageError("Image full: {} blocks of {}".format(block_count, block_size))
+        for c in range(first, first + count - 1):
+            fat[c] = c + 1
+        fat[first + count - 1] = eoc
+        next_cluster[0] += count
+        return first
+    def cluster_offset(cluster):
+        return data_start + (cluster - 2) * cluster_size
+    def write_dir(dirpath, cluster, parent_cluster):
+        records = []
+        if cluster != 0:
+            records.append(_fat_entry(b".          ", FAT_ATTR_DIRECTORY, 0, cluster, 0))
+            records.append(_fat_entry(b"..         ", FAT_ATTR_DIRECTORY, 0, parent_cluster, 0))
+        else:
+            records.append(_fat_entry(label.upper()[:11].ljust(11).encode("ascii"), FAT_ATTR_VOLUME, 0, 0, 0))
+        used = set()
+        subdirs = []
+        for name, local in children[dirpath]:
+            short, flags, lfn = _fat_short_name(name, used)
+            if lfn:
+                records.extend(_fat_lfn_entries(name, short))
+            childpath = str(PurePosixPath(dirpath).joinpath(name))
+            if local == None:
+                size = (2 + sum(1 + (len(n.encode("utf-16-le")) // 2 + 12) // 13 for n, _ in children[childpath])) * 32
+                child_cluster = allocate(size)
+                records.append(_fat_entry(short, FAT_ATTR_DIRECTORY, flags, child_cluster, 0))
+                subdirs.append((childpath, child_cluster))
+            else:
+                data = _read(local)
+                child_cluster = allocate(len(data)) if len(data) > 0 else 0
+                if len(data) > 0:
+                    offset = cluster_offset(child_cluster)
+                    image[offset:offset + len(data)] = data
+                records.append(_fat_entry(short, FAT_ATTR_ARCHIVE, flags, child_cluster, len(data)))
+        raw = b"".join(records)
+        if cluster == 0:
+            if len(raw) > FAT_ROOT_ENTRIES * 32:
+                raise ImageError("Too many files in the root directory")
+            offset = (1 + fat_sectors) * block_size
+        else:
+            offset = cluster_offset(cluster)
+        image[offset:offset + len(raw)] = raw
+        for childpath, child_cluster in subdirs:
+            write_dir(childpath, child_cluster, cluster)
+    write_dir("/", 0, 0)
+    # boot sector
+    total16 = block_count if block_count < 0x10000 else 0
+    total32 = 0 if block_count < 0x10000 else block_count
+    struct.pack_into("<3s8sHBHBHHBHHHII", image, 0, b"\xEB\x3C\x90", b"MPYPACK ", block_size, spc, 1, 1,
+        FAT_ROOT_ENTRIES, total16, 0xF8, fat_sectors, 63, 255, 0, total32)
+    struct.pack_into("<BBBI11s8s", image, 36, 0x80, 0, 0x29, 0x4D505950, label.upper()[:11].ljust(11).encode("ascii"),
+        b"FAT12   " if bits == 12 else b"FAT16   ")
+    image[510:512] = b"\x55\xAA"
+    # fat
+    offset = block_size
+    if bits == 16:
+        struct.pack_into("<{}H".format(len(fat)), image, offset, *fat)
+    else:
+        for n, v in enumerate(fat):
+            o = offset + n * 3 // 2
+            if n & 1:
+                image[o] = (image[o] & 0x0F) | ((v & 0x0F) << 4)
+                image[o + 1] = v >> 4
+            else:
+                image[o] = v & 0xFF
+                image[o + 1] = (image[o + 1] & 0xF0) | (v >> 8)
+    return bytes(image)
+
+def read_fat_image(image:bytes) -> Dict[str, Union[bytes, None]]:
+    ''' path -> content (None for directories), to check an image on the host '''
+    block_size, spc, reserved, nfats, root_entries, total16, _, fat_sectors = struct.unpack_from("<HBHBHHBH", image, 11)
+    total = total16 or struct.unpack_from("<I", image, 32)[0]
+    if image[510:512] != b"\x55\xAA":
+        raise ImageError("Not a FAT image")
+    root_sectors = (root_entries * 32 + block_size - 1) // block_size
+    fat_start = reserved * block_size
+    root_start = fat_start + nfats * fat_sectors * block_size
+    data_start = root_start + root_sectors * block_size
+    clusters = (total - reserved - nfats * fat_sectors - root_sectors) // spc
+    bits = 12 if clusters < 4085 else 16
+    cluster_size = spc * block_size
+    def next_of(c):
+        if bits == 16:
+            return struct.unpack_from("<H", image, fat_start + c * 2)[0]
+        v = struct.unpack_from("<H", image, fat_start + c * 3 // 2)[0]
+        return v >> 4 if c & 1 else v & 0xFFF
+    def chain(c, size=None):
+        data = bytearray()
+        while 2 <= c < (0xFF8 if bits == 12 else 0xFFF8):
+            offset = data_start + (c - 2) * cluster_size
+            data += image[offset:offset + cluster_size]
+            c = next_of(c)
+        return bytes(data if size == None else data[:size])
+    result = {"/": None}
+    def read_dir(raw, dirpath):
+        lfn = {}
+        for p in range(0, len(raw), 32):
+            entry = raw[p:p + 32]
+            if entry[0] == 0:
+                break
+            if entry[0] == 0xE5:
+                lfn = {}
+                continue
+            attr = entry[11]
+            if attr == FAT_ATTR_LFN:
+                seq = entry[0] & 0x3F
+                units = struct.unpack_from("<5H", entry, 1) + struct.unpack_from("<6H", entry, 14) + struct.unpack_from("<2H", entry, 28)
+                lfn[seq] = (units, entry[13])
+                continue
+            short = entry[:11]
+            if attr & FAT_ATTR_VOLUME or short[:1] == b".":
+                lfn = {}
+                continue
+            name = None
+            if len(lfn) > 0 and all(checksum == _fat_checksum(short) for _, checksum in lfn.values()):
+                units = [u for seq in sorted(lfn) for u in lfn[seq][0]]
+                units = units[:units.index(0)] if 0 in units else units
+                name = struct.pack("<{}H".format(len(units)), *units).decode("utf-16-le")
+            if name == None:
+                base = short[:8].decode("ascii").rstrip()
+                ext = short[8:].decode("ascii").rstrip()
+                base = base.lower() if entry[12] & 0x08 else base
+                ext = ext.lower() if entry[12] & 0x10 else ext
+                name = base + ("." + ext if ext else "")
+            lfn = {}
+            cluster, size = struct.unpack_from("<HI", entry, 26)
+            path = str(PurePosixPath(dirpath).joinpath(name))
+            if attr & FAT_ATTR_DIRECTORY:
+                result[path] = None
+                read_dir(chain(cluster), path)
+            else:
+                result[path] = chain(cluster, size) if size > 0 else b""
+    read_dir(image[root_start:root_start + root_entries * 32], "/")
+    return result
+
+# LittleFS -------------------------------------------------------------------------------
+# through the optional littlefs-python package, configured like MicroPython's vfs_lfs2.
+
+def _littlefs(block_size, block_count, mount=True):
+    try:
+        from littlefs import LittleFS
+    except ImportError:
+        raise ImageError("LittleFS images need the littlefs-python package: pip install littlefs-python")
+    return LittleFS(block_size=block_size, block_count=block_count, read_size=32, prog_size=32,
+        lookahead_size=32, block_cycles=100, mount=mount)
+
+def build_littlefs_image(entries:List[ImageEntry], block_size=4096, block_count=512) -> bytes:
+    fs = _littlefs(block_size, block_count)
+    try:
+        for path, local in entries:
+            path = str(PurePosixPath("/").joinpath(path))
+            if local == None:
+                if path != "/":
+                    fs.mkdir(path)
+            else:
+                with fs.open(path, "wb") as f:
+                    f.write(_read(local))
+    except Exception as e:
+        if "LFS_ERR_NOSPC" in str(e) or "No space" in str(e):
+            raise ImageError("Image full: {} blocks of {}".format(block_count, block_size))
+        raise
+    fs.unmount()
+    return bytes(fs.context.buffer)
+
+def read_littlefs_image(image:bytes, block_size=4096) -> Dict[str, Union[bytes, None]]:
+    fs = _littlefs(block_size, len(image) // block_size, mount=False)
+    fs.context.buffer = bytearray(image)
+    fs.mount()
+    result = {}
+    for top, dirs, files in fs.walk("/"):
+        result[top] = None
+        for name in files:
+            path = str(PurePosixPath(top).joinpath(name))
+            with fs.open(path, "rb") as f:
+                result[path] = f.read()
+    return result
+
+def build_image(entries:List[ImageEntry], format=IMAGE_FAT, block_size=None, block_count=None) -> bytes:
+    if format not in IMAGE_FORMATS:
+        raise ImageError("Unknown image format: {}".format(format))
+    block_size = DEFAULT_BLOCK_SIZE[format] if block_size == None else block_size
+    if block_count == None:
+        raise ImageError("The image block count (partition size / block size) is required")
+    if format == IMAGE_FAT:
+        return build_fat_image(entries, block_size, block_count)
+    return build_littlefs_image(entries, block_size, block_count)
+
+def read_image(image:bytes, format=IMAGE_FAT, block_size=None) -> Dict[str, Union[bytes, None]]:
+    if format == IMAGE_FAT:
+        return read_fat_image(image)
+    return read_littlefs_image(image, DEFAULT_BLOCK_SIZE[format] if block_size == None else block_size)
@@ -0,0 +1,136 @@
+import ast
+from os import path as syspath
+from pathlib import PurePosixPath
+from typing import Dict, Iterable, List, Union
+
+DEFAULT_ENTRY_POINTS = ["main.py", "boot.py"]
+DEFAULT_SEARCH_PATHS = ["", "lib"] # sys.path of the board, relative to the source root
+MODULE_SUFFIXES = [".py", ".mpy"]
+
+def _imported_names(tree:ast.AST, package:str) -> List[str]:
+    # absolute module names a module may import, function level and try/except imports included
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level > 0:
+                parts = package.split(".") if package else []
+                if node.level - 1 > len(parts):
+                    continue
+                base = ".".join(parts[:len(parts) - (node.level - 1)])
+                module = ".".join(p for p in [base, node.module or ""] if p)
+            else:
+                module = node.module or ""
+            if module:
+                names.append(module)
+            # "from pkg import name" may import the submodule pkg.name
+            names.extend(".".join(p for p in [module, alias.name] if p) for alias in node.names if alias.name != "*")
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "__import__":
+            if len(node.args) > 0 and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+                names.append(node.args[0].value)
+    return names
+
+class ImportGraph():
+    '''
+    Static import graph of a source folder, as the board would resolve it.
+    Files are posix paths relative to the source root.
+    '''
+    def __init__(self, root, search_paths:Iterable[str]=DEFAULT_SEARCH_PATHS):
+        self.root = syspath.abspath(root)
+        self.search_paths = [str(PurePosixPath(p)) if p else "" for p in search_paths]
+        self.edges:Dict[str, List[str]] = {}
+        self.unresolved:Dict[str, List[str]] = {} # builtin or missing modules, by importing file
+
+    def __local(self, relpath:str) -> str:
+        return syspath.join(self.root, *PurePosixPath(relpath).parts)
+
+    def module_name(self, relpath:str) -> str:
+        path = PurePosixPath(relpath)
+        for sp in sorted(self.search_paths, key=len, reverse=True):
+            try:
+                rel = path.relative_to(sp) if sp else path
+            except ValueError:
+                continue
+            parts = list(rel.parts[:-1])
+            if rel.stem != "__init__":
+                parts.append(rel.stem)
+            return ".".join(parts)
+        return path.stem
+
+    def resolve(self, module:str) -> Union[List[str], None]:
+        ''' files loaded by importing module (package __init__ files first), None if not in the tree '''
+        parts = module.split(".")
+        for sp in self.search_paths:
+            files = []
+            base = PurePosixPath(sp) if sp else PurePosixPath()
+            found = True
+            for i, name in enumerate(parts):
+                base = base.joinpath(name)
+                last = i == len(parts) - 1
+                init = [str(base.joinpath("__init__" + s)) for s in MODULE_SUFFIXES]
+                init = [f for f in init if syspath.isfile(self.__local(f))]
+                if syspath.isdir(self.__local(str(base))):
+                    files.extend(init[:1]) # namespace packages have none
+                    if last:
+                        break
+                    continue
+                if last:
+                    modules = [str(base) + s for s in MODULE_SUFFIXES if syspath.isfile(self.__local(str(base) + s))]
+                    if len(modules) > 0:
+                        files.append(modules[0])
+                        break
+                found = False
+                break
+            if found and len(files) > 0:
+                return files
+        return None
+
+    def imports_of(self, relpath:str) -> List[str]:
+        if relpath in self.edges:
+            return self.edges[relpath]
+        deps = []
+        unresolved = []
+        if relpath.endswith(".py"):
+            try:
+                with open(self.__local(relpath), "rb") as f:
+                    tree = ast.parse(f.read(), relpath)
+            except (SyntaxError, ValueError):
+                tree = None # shipped as is, the board will report it
+            if tree != None:
+                module = self.module_name(relpath)
+                package = module if PurePosixPath(relpath).stem == "__init__" else module.rpartition(".")[0]
+                for name in _imported_names(tree, package):
+                    files = self.resolve(name)
+                    if files == None:
+                        unresolved.append(name)
+                        continue
+                    for f in files:
+                        if f != relpath and f not in deps:
+                            deps.append(f)
+        self.edges[relpath] = deps
+        self.unresolved[relpath] = unresolved
+        return deps
+
+    def closure(self, entry_points:Iterable[str]=DEFAULT_ENTRY_POINTS) -> List[str]:
+        ''' files reachable from the entry points that exist, dependencies before their importers '''
+        order = []
+        visited = set()
+        def visit(relpath):
+            # iterative post order, deep import chains would hit the recursion limit
+            stack = [(relpath, iter(self.imports_of(relpath)))]
+            visited.add(relpath)
+            while len(stack) > 0:
+                current, deps = stack[-1]
+                dep = next(deps, None)
+                if dep == None:
+                    stack.pop()
+                    order.append(current)
+                elif dep not in visited:
+                    visited.add(dep)
+                    stack.append((dep, iter(self.imports_of(dep))))
+        for entry in entry_points:
+            entry = str(PurePosixPath(entry.replace("\\", "/")))
+            if entry not in visited and syspath.isfile(self.__local(entry)):
+                visit(entry)
+        return order
@@ -0,0 +1,162 @@
+try:
+    from pyboard import error_message
+    from fileexplorer import FileExplorer
+    from filesync import FileSync, SyncProgressCallback
+    from importgraph import ImportGraph, DEFAULT_ENTRY_POINTS, DEFAULT_SEARCH_PATHS
+except ImportError:
+    from mpypack.pyboard import error_message
+    from mpypack.fileexplorer import FileExplorer
+    from mpypack.filesync import FileSync, SyncProgressCallback
+    from mpypack.importgraph import ImportGraph, DEFAULT_ENTRY_POINTS, DEFAULT_SEARCH_PATHS
+from os import walk, PathLike, path as syspath
+from pathlib import PurePath, PurePosixPath
+from typing import Callable, Dict, List, Tuple, Union
+
+PROFILE_REMOTE_DIR = "/_mpypack_profile" # not hidden, FileSync would skip it
+VARIANT_PY = "py"           # sources staged under PROFILE_REMOTE_DIR
+VARIANT_MPY = "mpy"         # compiled and staged under PROFILE_REMOTE_DIR
+VARIANT_DEPLOYED = "deployed" # whatever is deployed at the remote path
+VARIANTS = [VARIANT_PY, VARIANT_MPY, VARIANT_DEPLOYED]
+
+PROFILE_SETUP_COMMAND = """
+import sys, gc
+for _p in {paths!r}:
+    sys.path.insert(0, _p)
+for _n in {modules!r}:
+    sys.modules.pop(_n, None)
+gc.collect()
+"""
+PROFILE_IMPORT_COMMAND = """
+import gc, utime
+gc.collect()
+_m0 = gc.mem_free()
+_t0 = utime.ticks_us()
+__import__({module!r})
+_t1 = utime.ticks_us()
+_m1 = gc.mem_free()
+gc.collect()
+print(utime.ticks_diff(_t1, _t0), _m0 - _m1, _m0 - gc.mem_free())
+"""
+PROFILE_CLEANUP_COMMAND = """
+import sys, gc
+for _p in {paths!r}:
+    if _p in sys.path:
+        sys.path.remove(_p)
+for _n in {modules!r}:
+    sys.modules.pop(_n, None)
+gc.collect()
+"""
+ProfileProgressCallback = Union[None, Callable[[int, int, str, str],None]]
+
+class ModuleProfile():
+    ''' import of one module on the board, its dependencies were imported before it '''
+    def __init__(self, module:str, file:str, variant:str):
+        self.module = module
+        self.file = file
+        self.variant = variant
+        self.time_us = None
+        self.alloc = None    # bytes allocated while importing
+        self.retained = None # bytes still used after a gc.collect()
+        self.error = None
+
+    def to_dict(self) -> dict:
+        return {
+            "module": self.module, "file": self.file, "variant": self.variant,
+            "time_us": self.time_us, "alloc": self.alloc, "retained": self.retained, "error": self.error,
+        }
+
+def project_modules(source:PathLike, entry_points:List[str]=DEFAULT_ENTRY_POINTS, search_paths:List[str]=DEFAULT_SEARCH_PATHS) -> List[Tuple[str, str]]:
+    '''
+    (module name, file) of every importable .py module under source, dependencies first.
+    Entry points are left out, importing main.py would start the application.
+    '''
+    graph = ImportGraph(source, search_paths)
+    source = syspath.abspath(source)
+    entries = set(str(PurePosixPath(e.replace("\\", "/"))) for e in entry_points)
+    files = []
+    for cur_dir, _, names in walk(source):
+        for name in sorted(names):
+            relpath = PurePath(syspath.join(cur_dir, name)).relative_to(source).as_posix()
+            if name.endswith(".py") and relpath not in entries:
+                files.append(relpath)
+    modules = []
+    for relpath in graph.closure(sorted(files)):
+        if relpath in entries:
+            continue
+        name = graph.module_name(relpath)
+        resolved = graph.resolve(name) if name else None
+        if resolved != None and resolved[-1] == relpath:
+            modules.append((name, relpath))
+    return modules
+
+def profile_imports(fe:FileExplorer, source:PathLike, variants:List[str]=[VARIANT_PY, VARIANT_MPY], remote_path="/", arch=None, keep_staged=False,
+        entry_points:List[str]=DEFAULT_ENTRY_POINTS, search_paths:List[str]=DEFAULT_SEARCH_PATHS,
+        progress_callback:ProfileProgressCallback=None, sync_progress_callback:SyncProgressCallback=None) -> List[ModuleProfile]:
+    '''
+    Import the modules of the source folder on the board in dependency order, once per variant,
+    recording ticks_us and gc.mem_free deltas. py and mpy variants are synced to a staging folder
+    first (incrementally, kept with keep_staged), deployed profiles what is already at remote_path.
+    '''
+    modules = project_modules(source, entry_points, search_paths)
+    names = [name for name, _ in modules]
+    results = []
+    try:
+        for variant in variants:
+            if variant == VARIANT_DEPLOYED:
+                root = PurePosixPath(remote_path)
+            else:
+                root = PurePosixPath(PROFILE_REMOTE_DIR).joinpath(variant)
+                fs = FileSync(fe, local_path=source, remote_path=str(root))
+                fs.sync_dir_remote_with_local(compile=(variant == VARIANT_MPY), arch=arch, progress_callback=sync_progress_callback)
+            paths = [str(root.joinpath(p)) if p else str(root) for p in reversed(search_paths)]
+            fe.exec(PROFILE_SETUP_COMMAND.format(paths=paths, modules=names))
+            try:
+                for index, (name, relpath) in enumerate(modules):
+                    if progress_callback != None:
+                        progress_callback(index, len(modules), variant, name)
+                    result = ModuleProfile(name, relpath, variant)
+                    results.append(result)
+                    try:
+                        out = fe.exec(PROFILE_IMPORT_COMMAND.format(module=name))
+                        time_us, alloc, retained = out.decode("utf-8").strip().splitlines()[-1].split()
+                        result.time_us = int(time_us)
+                        result.alloc = int(alloc)
+                        result.retained = int(retained)
+                    except Exception as e:
+                        result.error = error_message(e)
+            finally:
+                fe.exec(PROFILE_CLEANUP_COMMAND.format(paths=paths, modules=names))
+    finally:
+        if not keep_staged:
+            fe.rmtree(PROFILE_REMOTE_DIR)
+    return results
+
+def profile_report(results:List[ModuleProfile]) -> str:
+    ''' one row per module, variants side by side, slowest first '''
+    variants = []
+    rows:Dict[str, Dict[str, ModuleProfile]] = {}
+    for r in results:
+        if r.variant not in variants:
+            variants.append(r.variant)
+        rows.setdefault(r.module, {})[r.variant] = r
+    def slowest(module):
+        return max([r.time_us for r in rows[module].values() if r.time_us != None] + [-1])
+    lines = ["{:<32}".format("module") + "".join("{:>12}{:>12}".format(v + " us", v + " ram") for v in variants)]
+    for module in sorted(rows, key=slowest, reverse=True):
+        line = "{:<32}".format(module)
+        for v in variants:
+            r = rows[module].get(v)
+            if r == None or r.error != None:
+                line += "{:>12}{:>12}".format("error", "-")
+            else:
+                line += "{:>12}{:>12}".format(r.time_us, r.retained)
+        lines.append(line)
+    for r in results:
+        if r.error != None:
+            lines.append("{} ({}): {}".format(r.module, r.variant, r.error))
+    totals = []
+    for v in variants:
+        done = [r for r in results if r.variant == v and r.time_us != None]
+        totals.append("{}: {} us, {} bytes".format(v, sum(r.time_us for r in done), sum(r.retained for r in done)))
+    lines.append("total " + ", ".join(totals))
+    return "\n".join(lines)
@@ -0,0 +1,221 @@
+try:
+    from fileexplorer import FileEntity, FileEntityType, FILE_SIZE_UNKNOWN
+except ImportError:
+    from mpypack.fileexplorer import FileEntity, FileEntityType, FILE_SIZE_UNKNOWN
+import json
+from typing import Dict, List, Tuple
+
+# Binary record of the files mpypack put on a board (or in a build folder).
+# Header: b"MPYM" <version:u8> <digest size:u8>
+# Record: <op:u8> <shared prefix:varint> <suffix length:varint> <suffix:utf8>
+#         SET continues with <type:u8> <size + 1:varint> and <digest> for files.
+# Paths share their prefix with the path of the record before them, updates are
+# appended as SET / DELETE records and the whole file is rewritten once stale
+# records outweigh live ones. Legacy .mpypack_sha256.json records are still read.
+MANIFEST_MAGIC = b"MPYM"
+MANIFEST_VERSION = 1
+DEFAULT_DIGEST_SIZE = 8 # bytes of sha256 kept per file
+LEGACY_RECORD_FILE = ".mpypack_sha256.json"
+
+RECORD_SET = 0
+RECORD_DELETE = 1
+
+ManifestEntry = Tuple[FileEntityType, int, bytes] # type, size, digest
+
+class ManifestError(ValueError):
+    pass
+
+def _pack_varint(n:int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+def _unpack_varint(data:bytes, p:int) -> Tuple[int, int]:
+    n = 0
+    shift = 0
+    while True:
+        b = data[p] # IndexError on a torn record
+        p += 1
+        n |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return n, p
+        shift += 7
+
+def _shared_prefix(a:bytes, b:bytes) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+class Manifest():
+    def __init__(self, digest_size=DEFAULT_DIGEST_SIZE):
+        self.digest_size = digest_size
+        self.entries:Dict[str, ManifestEntry] = {}
+        self.legacy = False # read from a json record, no directories or sizes
+        self.loaded = False # read from an existing binary manifest
+        self.__records = 0 # records stored in the file so far
+        self.__last = b"" # path of the last stored record
+        self.__torn = False # the file ends with a partial record
+        self.__changes:List[Tuple[int, str]] = []
+
+    @staticmethod
+    def loads(data:bytes) -> "Manifest":
+        if data[:len(MANIFEST_MAGIC)] != MANIFEST_MAGIC:
+            return Manifest.__loads_legacy(data)
+        if len(data) < 6 or data[4] != MANIFEST_VERSION:
+            raise ManifestError("Unsupported manifest version")
+        manifest = Manifest(data[5])
+        manifest.loaded = True
+        p = 6
+        last = b""
+        while p < len(data):
+            try:
+                op = data[p]
+                shared, q = _unpack_varint(data, p + 1)
+                length, q = _unpack_varint(data, q)
+                if q + length > len(data):
+                    raise IndexError()
+                path = last[:shared] + data[q:q+length]
+                q += length
+                if op == RECORD_SET:
+                    type = FileEntityType(data[q])
+                    size, q = _unpack_varint(data, q + 1)
+                    digest = b""
+                    if type == FileEntityType.FILE:
+                        digest = data[q:q+manifest.digest_size]
+                        if len(digest) != manifest.digest_size:
+                            raise IndexError()
+                        q += manifest.digest_size
+                    manifest.entries[path.decode("utf-8")] = (type, size - 1, digest)
+                elif op == RECORD_DELETE:
+                    manifest.entries.pop(path.decode("utf-8"), None)
+                else:
+                    raise ManifestError("Unknown manifest record: {}".format(op))
+            except IndexError:
+                # an append was cut off, keep what was complete and rewrite next time
+                manifest.__torn = True
+                break
+            manifest.__records += 1
+            last = path
+            p = q
+        manifest.__last = last
+        return manifest
+
+    @staticmethod
+    def __loads_legacy(data:bytes) -> "Manifest":
+        try:
+            record = json.loads(data.decode("utf-8"))
+        except ValueError:
+            raise ManifestError("Not a manifest")
+        manifest = Manifest()
+        manifest.legacy = True
+        for path, hexdigest in record.items():
+            manifest.entries[path] = (FileEntityType.FILE, FILE_SIZE_UNKNOWN, bytes.fromhex(hexdigest)[:manifest.digest_size])
+        return manifest
+
+    @property
+    def complete(self) -> bool:
+        ''' lists every directory and file it covers, so it can stand in for a walk '''
+        return self.loaded and not self.legacy
+
+    @property
+    def appendable(self) -> bool:
+        ''' changes can be appended to the stored file instead of rewriting it '''
+        return self.loaded and not self.__torn and self.__records + len(self.__changes) <= 2 * len(self.entries) + 16
+
+    def get(self, path) -> ManifestEntry:
+        return self.entries.get(str(path))
+
+    def is_directory(self, path) -> bool:
+        entry = self.get(path)
+        return entry != None and entry[0] == FileEntityType.DIRECTORY
+
+    def matches(self, path, hexdigest:str) -> bool:
+        entry = self.get(path)
+        if entry == None or entry[0] != FileEntityType.FILE:
+            return False
+        return len(entry[2]) > 0 and bytes.fromhex(hexdigest)[:len(entry[2])] == entry[2]
+
+    def same(self, path, other:"Manifest") -> bool:
+        ''' same type and digest for path in both manifests, digests compared on the shorter length '''
+        a = self.get(path)
+        b = other.get(path)
+        if a == None or b == None or a[0] != b[0]:
+            return False
+        if a[0] == FileEntityType.DIRECTORY:
+            return True
+        n = min(len(a[2]), len(b[2]))
+        return n > 0 and a[2][:n] == b[2][:n]
+
+    def set(self, path, type:FileEntityType, size=FILE_SIZE_UNKNOWN, hexdigest:str=None):
+        path = str(path)
+        digest = b""
+        if type == FileEntityType.FILE:
+            digest = bytes.fromhex(hexdigest)[:self.digest_size]
+            digest = digest + bytes(self.digest_size - len(digest))
+        self.entries[path] = (type, size if type == FileEntityType.FILE else 0, digest)
+        self.__changes.append((RECORD_SET, path))
+
+    def copy_entry(self, path, other:"Manifest"):
+        type, size, digest = other.get(path)
+        self.set(path, type, size, digest.hex() if type == FileEntityType.FILE else None)
+
+    def remove(self, path):
+        path = str(path)
+        if path in self.entries:
+            del self.entries[path]
+            self.__changes.append((RECORD_DELETE, path))
+
+    def remove_tree(self, path):
+        path = str(path)
+        prefix = path.rstrip("/") + "/"
+        for p in [p for p in self.entries if p == path or p.startswith(prefix)]:
+            self.remove(p)
+
+    def files(self) -> List[FileEntity]:
+        return [FileEntity(p, "", type, size) for p, (type, size, _) in self.entries.items()]
+
+    def __record(self, op, path:str, last:bytes) -> Tuple[bytes, bytes]:
+        b = path.encode("utf-8")
+        shared = _shared_prefix(last, b)
+        out = bytes([op]) + _pack_varint(shared) + _pack_varint(len(b) - shared) + b[shared:]
+        if op == RECORD_SET:
+            type, size, digest = self.entries[path]
+            out += bytes([type]) + _pack_varint(max(size, FILE_SIZE_UNKNOWN) + 1) + digest
+        return out, b
+
+    def dumps(self) -> bytes:
+        ''' the whole manifest, compacted '''
+        out = [MANIFEST_MAGIC, bytes([MANIFEST_VERSION, self.digest_size])]
+        last = b""
+        for path in sorted(self.entries):
+            record, last = self.__record(RECORD_SET, path, last)
+            out.append(record)
+        self.__records = len(self.entries)
+        self.__last = last
+        self.__changes = []
+        self.__torn = False
+        self.loaded = True
+        self.legacy = False
+        return b"".join(out)
+
+    def dump_changes(self) -> bytes:
+        ''' records to append to the stored file since it was loaded or dumped '''
+        out = []
+        last = self.__last
+        for op, path in self.__changes:
+            if op == RECORD_SET and path not in self.entries:
+                continue # removed again later
+            record, last = self.__record(op, path, last)
+            out.append(record)
+        self.__records += len(out)
+        self.__last = last
+        self.__changes = []
+        return b"".join(out)
@@ -0,0 +1,201 @@
+import ast, io, hashlib, keyword, tokenize
+from os import path as syspath, replace
+from typing import List, Tuple
+import uuid
+try:
+    from tracing import traced
+    from cachedir import user_cache_dir, make_cache_dir, owned_by_user
+except ImportError:
+    from mpypack.tracing import traced
+    from mpypack.cachedir import user_cache_dir, make_cache_dir, owned_by_user
+
+MINIFY_VERSION = b"2" # bump when the output changes, invalidates the cache
+MINIFY_CACHE_DIR = user_cache_dir("minify")
+_FSTRING_START = getattr(tokenize, "FSTRING_START", None) # python 3.12+
+_FSTRING_END = getattr(tokenize, "FSTRING_END", None)
+
+Position = Tuple[int, int] # row, column (characters)
+Span = Tuple[Position, Position, str] # start, end, replacement
+
+def _char_col(lines:List[str], row:int, col:int) -> int:
+    # ast columns are utf-8 byte offsets, tokenize columns are characters
+    return len(lines[row - 1].encode("utf-8")[:col].decode("utf-8", "ignore"))
+
+def _start(lines, node) -> Position:
+    return (node.lineno, _char_col(lines, node.lineno, node.col_offset))
+
+def _end(lines, node) -> Position:
+    return (node.end_lineno, _char_col(lines, node.end_lineno, node.end_col_offset))
+
+def _is_docstring(node, parent) -> bool:
+    return isinstance(parent, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) \
+        and len(parent.body) > 0 and parent.body[0] is node \
+        and isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+def _removed_spans(tree:ast.AST, lines:List[str]) -> List[Span]:
+    spans = []
+    for parent in ast.walk(tree):
+        # statements that go away entirely, a block left empty gets a pass
+        for field in ("body", "orelse", "finalbody"):
+            body = getattr(parent, field, None)
+            if not isinstance(body, list) or len(body) == 0 or not isinstance(body[0], ast.stmt):
+                continue
+            removed = [s for s in body if _is_docstring(s, parent) or (isinstance(s, ast.AnnAssign) and s.value == None)]
+            for s in removed:
+                empty = len(removed) == len(body) and s is body[0] and not isinstance(parent, ast.Module)
+                spans.append((_start(lines, s), _end(lines, s), "pass" if empty else ""))
+        if isinstance(parent, ast.AnnAssign) and parent.value != None:
+            spans.append((_end(lines, parent.target), _end(lines, parent.annotation), ""))
+        elif isinstance(parent, ast.arg) and parent.annotation != None:
+            name_end = (parent.lineno, _char_col(lines, parent.lineno, parent.col_offset) + len(parent.arg))
+            spans.append((name_end, _end(lines, parent.annotation), ""))
+    spans.sort()
+    return spans
+
+def _need_space(prev:str, prev_type:int, text:str) -> bool:
+    a = prev[-1]
+    b = text[0]
+    if (a.isalnum() or a == "_") and (b.isalnum() or b == "_" or b in "\"'"):
+        return True
+    if prev_type == tokenize.NUMBER and b == ".":
+        return True
+    return b == "." and keyword.iskeyword(prev) # from . import x
+
+def minify_source(source:str, keep_lines=False) -> str:
+    '''
+    Drop docstrings, comments, annotations and whitespace python does not need,
+    with keep_lines every statement stays on its original line (tracebacks still match).
+    source is returned as is if the result does not parse.
+    '''
+    tree = ast.parse(source)
+    lines = source.splitlines(True)
+    spans = _removed_spans(tree, lines)
+    out = []
+    row = 1 # output line, only tracked with keep_lines
+    indent = 0
+    brackets = 0
+    line_start = True
+    prev = None
+    prev_type = None
+    span_index = 0
+    replaced = set()
+    span_brackets = 0
+    in_return_annotation = False
+    fstring = 0
+    fstring_begin = None
+    after_span = False # a ; right after a removed statement goes with it
+    def emit(text, type, start, end, in_brackets=False):
+        nonlocal row, line_start, prev, prev_type
+        if keep_lines and start[0] > row:
+            if line_start:
+                out.append("\n" * (start[0] - row))
+            else:
+                out.append(("\n" if in_brackets else "\\\n") * (start[0] - row))
+            row = start[0]
+        if line_start:
+            out.append(" " * indent)
+            line_start = False
+        elif _need_space(prev, prev_type, text):
+            out.append(" ")
+        out.append(text)
+        row = end[0]
+        prev = text
+        prev_type = type
+    for tok in tokenize.generate_tokens(io.StringIO(source).readline):
+        type, text, start, end = tok.type, tok.string, tok.start, tok.end
+        if fstring > 0:
+            # f-strings (3.12 tokens) are copied as written
+            if type == _FSTRING_START:
+                fstring += 1
+            elif type == _FSTRING_END:
+                fstring -= 1
+                if fstring == 0:
+                    text = "".join(lines[fstring_begin[0] - 1:end[0]])
+                    text = text[fstring_begin[1]:len(text) - len(lines[end[0] - 1]) + end[1]]
+                    emit(text, tokenize.STRING, fstring_begin, end)
+            continue
+        if type in (tokenize.ENCODING, tokenize.ENDMARKER, tokenize.COMMENT, tokenize.NL):
+            continue
+        if type == tokenize.INDENT:
+            indent += 1
+            continue
+        if type == tokenize.DEDENT:
+            indent -= 1
+            continue
+        if type == tokenize.NEWLINE:
+            after_span = False
+            if not line_start:
+                out.append("\n")
+                row += 1
+                line_start = True
+            continue
+        while span_index < len(spans) and start >= spans[span_index][1]:
+            span_index += 1
+        if span_index < len(spans) and spans[span_index][0] <= start:
+            span = spans[span_index]
+            if span[2] and span_index not in replaced:
+                replaced.add(span_index)
+                emit(span[2], tokenize.NAME, span[0], span[0])
+            if type == tokenize.OP and text in "([{":
+                span_brackets += 1
+            elif type == tokenize.OP and text in ")]}":
+                span_brackets -= 1
+            after_span = True
+            continue
+        if after_span and type == tokenize.OP and text == ";":
+            after_span = False
+            continue
+        after_span = False
+        if span_brackets > 0 and type == tokenize.OP and text in ")]}":
+            span_brackets -= 1 # closing a parenthesized annotation
+            continue
+        in_brackets = brackets > 0
+        if type == tokenize.OP and text in "([{":
+            brackets += 1
+        elif type == tokenize.OP and text in ")]}":
+            brackets -= 1
+        if type == tokenize.OP and text == "->":
+            in_return_annotation = True
+            continue
+        if in_return_annotation:
+            if not (type == tokenize.OP and text == ":" and brackets == 0):
+                continue
+            in_return_annotation = False
+        if type == _FSTRING_START:
+            fstring = 1
+            fstring_begin = start
+            continue
+        emit(text, type, start, end, in_brackets)
+    result = "".join(out)
+    try:
+        ast.parse(result)
+    except SyntaxError:
+        return source
+    return result
+
+@traced("minify", "minify")
+def minify(source:bytes, keep_lines=False) -> bytes:
+    ''' minify_source with a disk cache keyed by the source hash, source is returned as is if it does not parse '''
+    key = hashlib.sha256(MINIFY_VERSION + (b"lines" if keep_lines else b"") + b"\0" + source).hexdigest()
+    cache = syspath.join(MINIFY_CACHE_DIR, key + ".py")
+    try:
+        if owned_by_user(cache):
+            with open(cache, "rb") as f:
+                return f.read()
+    except OSError: pass
+    try:
+        result = minify_source(source.decode("utf-8"), keep_lines).encode("utf-8")
+    except (SyntaxError, ValueError, tokenize.TokenError):
+        return source
+    try:
+        make_cache_dir(MINIFY_CACHE_DIR)
+        tmppath = cache + "." + str(uuid.uuid4())
+        with open(tmppath, "wb") as f:
+            f.write(result)
+        replace(tmppath, cache)
+    except OSError: pass
+    return result
+
+def minify_file(path, keep_lines=False) -> bytes:
+    with open(path, "rb") as f:
+        return minify(f.read(), keep_lines)
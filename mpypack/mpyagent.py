@@ -0,0 +1,131 @@
+# mpypack agent 2
+# Runs on the board (MicroPython), started by FileExplorer through the raw REPL.
+# Request:  <op:u8> <length:u32> <payload>
+# Response: <status:u8> <length:u32> <payload>, status 0 is ok, errno or 255 on error.
+# Strings in payloads are <length:u16> <utf8>, integers are little endian.
+def _mpypack_agent():
+    import sys, struct, micropython
+    try:
+        import uos as os
+    except ImportError:
+        import os
+    try:
+        import uhashlib as hashlib
+    except ImportError:
+        try:
+            import hashlib
+        except ImportError:
+            hashlib = None
+    rx = getattr(sys.stdin, "buffer", sys.stdin)
+    tx = getattr(sys.stdout, "buffer", sys.stdout)
+    buf = bytearray(512)
+
+    def rd(n):
+        b = b""
+        while len(b) < n:
+            b += rx.read(n - len(b))
+        return b
+
+    def reply(status, data=b""):
+        tx.write(struct.pack("<BI", status, len(data)))
+        if data:
+            tx.write(data)
+
+    def string(b, o):
+        n = struct.unpack_from("<H", b, o)[0]
+        return str(b[o + 2:o + 2 + n], "utf-8"), o + 2 + n
+
+    def entry(kind, size, name):
+        name = name.encode("utf-8")
+        return struct.pack("<BIH", kind, size, len(name)) + name
+
+    def kind(mode):
+        return 0 if mode & 0x4000 else 1
+
+    def join(p, name):
+        return p + name if p.endswith("/") else p + "/" + name
+
+    def ls(p, out, full):
+        for e in os.ilistdir(p):
+            k = kind(e[1])
+            size = e[3] if len(e) > 3 and k else 0
+            out.append(entry(k, size, join(p, e[0]) if full else e[0]))
+            if full and k == 0:
+                ls(join(p, e[0]), out, full)
+
+    def digest(p, length):
+        h = hashlib.sha256()
+        with open(p, "rb") as f:
+            while length > 0:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                n = min(n, length)
+                h.update(memoryview(buf)[:n])
+                length -= n
+        return h.digest()
+
+    micropython.kbd_intr(-1)
+    try:
+        while True:
+            op, n = struct.unpack("<BI", rd(5))
+            if n > 0x10000:
+                break  # lost sync, give the repl back
+            b = rd(n)
+            try:
+                if op == 0:  # quit
+                    reply(0)
+                    break
+                if op == 15:  # ping
+                    reply(0, b"mpypack agent 2")
+                    continue
+                p, o = string(b, 0)
+                if op == 1:  # stat
+                    s = os.stat(p)
+                    reply(0, struct.pack("<BI", kind(s[0]), s[6] if kind(s[0]) else 0))
+                elif op == 2 or op == 3:  # ls, walk
+                    s = os.stat(p)
+                    out = [entry(0, 0, p)] if op == 3 else []
+                    ls(p, out, op == 3)
+                    reply(0, b"".join(out))
+                elif op == 4:  # read
+                    offset, length = struct.unpack_from("<II", b, o)
+                    with open(p, "rb") as f:
+                        f.seek(offset)
+                        reply(0, f.read(length))
+                elif op == 5:  # write
+                    with open(p, "ab" if b[o] else "wb") as f:
+                        f.write(memoryview(b)[o + 1:])
+                    reply(0)
+                elif op == 6:  # hash
+                    if hashlib == None:
+                        raise NotImplementedError("no hashlib")
+                    reply(0, digest(p, struct.unpack_from("<I", b, o)[0]))
+                elif op == 7:  # mkdir
+                    os.mkdir(p)
+                    reply(0)
+                elif op == 8:  # rm
+                    if kind(os.stat(p)[0]) == 0:
+                        os.rmdir(p)
+                    else:
+                        os.remove(p)
+                    reply(0)
+                elif op == 9:  # rename, replacing the target
+                    dst = string(b, o)[0]
+                    try:
+                        os.remove(dst)
+                    except OSError:
+                        pass
+                    os.rename(p, dst)
+                    reply(0)
+                else:
+                    raise ValueError("unknown op")
+            except OSError as e:
+                code = e.args[0] if len(e.args) > 0 and isinstance(e.args[0], int) else 255
+                reply(code if 0 < code < 255 else 255, repr(e).encode("utf-8"))
+            except Exception as e:
+                reply(255, repr(e).encode("utf-8"))
+    finally:
+        micropython.kbd_intr(3)
+_mpypack_agent()
+del _mpypack_agent
@@ -1,16 +1,23 @@
 import os
 import stat
-import subprocess
-from glob import glob
 from os.path import join, abspath, exists
 from sys import path as import_path
+import sys
+try:
+    from cachedir import user_cache_dir, make_cache_dir, owned_by_user
+except ImportError:
+    from mpypack.cachedir import user_cache_dir, make_cache_dir, owned_by_user
 
 mpy_cross_exe = None
+# discovery globs cwd and every sys.path entry, the result is kept per environment
+_resolved = False
+CACHE_DIR_NAME = "mpycross" # under the user cache folder
 
 
 def set_mpy_cross_executable(exe_file: str):
-    global mpy_cross_exe
+    global mpy_cross_exe, _resolved
     mpy_cross_exe = exe_file
+    _resolved = True
     if mpy_cross_exe == None or (not exists(mpy_cross_exe)):
         return
     try:
@@ -19,36 +26,83 @@ def set_mpy_cross_executable(exe_file: str):
     except OSError:
         pass
 
+def get_mpy_cross_executable():
+    # resolved on first use
+    if not _resolved:
+        _init()
+    return mpy_cross_exe
+
 def run(*args, **kwargs):
-    if mpy_cross_exe == None:
+    import subprocess
+    exe = get_mpy_cross_executable()
+    if exe == None:
         raise Exception("Could not find executable mpy_cross.")
     try:
-        return subprocess.Popen([mpy_cross_exe] + list(args), **kwargs)
+        return subprocess.Popen([exe] + list(args), **kwargs)
     except:
         raise Exception("mpy-cross compile failed!")
 
 # find exec file
 def _find_under_dir(dir: os.PathLike):
+    from glob import glob
     mpy_cross_list = glob(join(dir, 'mpy-cross*'))
     if len(mpy_cross_list) > 0:
         return abspath(mpy_cross_list[0])
     else:
         return None
 
-def _find_mpy_cross_executable():
+def _search_dirs():
     # find under some folder
     find_in_dir = [
         abspath("."),
     ]
     for pth in import_path:
         find_in_dir.append(abspath(join(pth, "mpy_cross")))
-    for dir in find_in_dir:
+    return find_in_dir
+
+def _find_mpy_cross_executable(dirs):
+    # (index in dirs, exe file) of the first hit
+    for index, dir in enumerate(dirs):
         exe_file = _find_under_dir(dir)
         if exe_file != None:
-            return exe_file
-    return None
+            return index, exe_file
+    return len(dirs), None
 
-def _init():
-    set_mpy_cross_executable(_find_mpy_cross_executable())
+def _cache_file(dirs):
+    import hashlib
+    key = hashlib.sha256("\0".join([sys.executable] + dirs).encode("utf-8")).hexdigest()
+    return join(user_cache_dir(CACHE_DIR_NAME), key[:32] + ".txt")
+
+def _read_cache(cache):
+    # the named file gets executed, only trust what this user wrote
+    if not owned_by_user(cache):
+        raise OSError("untrusted cache entry")
+    with open(cache, "r", encoding="utf-8") as f:
+        index, exe_file = f.read().strip().split("\n", 1)
+    return int(index), exe_file
 
-_init()
\ No newline at end of file
+def _init():
+    dirs = _search_dirs()
+    cache = _cache_file(dirs)
+    try:
+        index, exe_file = _read_cache(cache)
+    except (OSError, ValueError):
+        index, exe_file = len(dirs), None
+    # the folders before the cached hit are still searched, one of them may have gained an mpy-cross
+    found_index, found = _find_mpy_cross_executable(dirs[:index])
+    if found == None and exe_file != None and exists(exe_file):
+        set_mpy_cross_executable(exe_file)
+        return
+    if found == None:
+        found_index, found = _find_mpy_cross_executable(dirs[index:])
+        found_index += index
+    set_mpy_cross_executable(found)
+    if found == None:
+        return # not cached, installing mpy-cross later must still be found
+    try:
+        make_cache_dir(os.path.dirname(cache))
+        tmppath = "{}.{}".format(cache, os.getpid())
+        with open(tmppath, "w", encoding="utf-8") as f:
+            f.write("{}\n{}".format(found_index, found))
+        os.replace(tmppath, cache)
+    except OSError: pass
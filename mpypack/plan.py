@@ -0,0 +1,154 @@
+try:
+    from agent import AGENT_CHUNK_SIZE
+except ImportError:
+    from mpypack.agent import AGENT_CHUNK_SIZE
+from os import path as syspath
+from typing import List, Union
+import json, time
+
+REPL_CHUNK_SIZE = 512      # FileExplorer.CHUNK_SIZE
+REPL_CHUNK_OVERHEAD = 120  # f.write(ubinascii.a2b_base64('...')) plus the pipeline guard and framing
+REPL_COMMAND_BYTES = 100   # a typical stat / mkdir / open / rename command and its answer
+AGENT_HEADER_BYTES = 10    # request and response header
+UPLOAD_ROUND_TRIPS = 6     # stat, mkdirs, partial file check, open, close, rename
+DELETE_ROUND_TRIPS = 2     # stat, remove
+MKDIR_ROUND_TRIPS = 2      # stat, mkdir
+LINK_RECORD_FILE = ".mpypack_link.json"
+
+OP_MKDIR = "mkdir"
+OP_UPLOAD = "upload"
+OP_DELETE = "delete"
+OP_COMPILE = "compile"
+OP_MANIFEST = "manifest"
+
+class LinkModel():
+    '''
+    Time of a transfer as round trips * round_trip_s + wire bytes / bytes_per_second.
+    source tells where the numbers come from: baudrate (8N1 estimate), probe or recorded.
+    '''
+    def __init__(self, bytes_per_second:float, round_trip_s:float, source="baudrate"):
+        self.bytes_per_second = bytes_per_second
+        self.round_trip_s = round_trip_s
+        self.source = source
+
+    @staticmethod
+    def from_baudrate(baudrate:int, round_trip_s=0.01):
+        return LinkModel(int(baudrate) / 10, round_trip_s)
+
+    def seconds(self, round_trips:int, wire_bytes:int) -> float:
+        return round_trips * self.round_trip_s + wire_bytes / self.bytes_per_second
+
+    def to_dict(self) -> dict:
+        return { "bytes_per_second": round(self.bytes_per_second, 1), "round_trip_s": round(self.round_trip_s, 6), "source": self.source }
+
+def _record_key(port:str, baudrate:int, agent:bool) -> str:
+    return "{}@{}{}".format(port, baudrate, "+agent" if agent else "")
+
+def load_link_model(port:str, baudrate:int, agent=False, record_file=LINK_RECORD_FILE) -> Union[LinkModel, None]:
+    ''' the recorded probe for this port, None if there is none '''
+    try:
+        with open(record_file, "r", encoding="utf-8") as f:
+            record = json.load(f)[_record_key(port, baudrate, agent)]
+        return LinkModel(record["bytes_per_second"], record["round_trip_s"], "recorded")
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def save_link_model(model:LinkModel, port:str, baudrate:int, agent=False, record_file=LINK_RECORD_FILE):
+    records = {}
+    if syspath.exists(record_file):
+        try:
+            with open(record_file, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except (OSError, ValueError): pass
+    records[_record_key(port, baudrate, agent)] = model.to_dict()
+    with open(record_file, "w", encoding="utf-8") as f:
+        json.dump(records, f, indent=2)
+
+def probe_link(fe, payload_size=2048, rounds=5) -> LinkModel:
+    '''
+    Calibrate a LinkModel on a ready FileExplorer: the median time of an empty command is the
+    round trip, a command carrying payload_size bytes gives the throughput.
+    '''
+    def timed(command):
+        times = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            fe.exec(command)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        return times[len(times) // 2]
+    round_trip = timed("pass")
+    payload = timed("_ = '{}'".format("A" * payload_size))
+    return LinkModel(payload_size / max(payload - round_trip, 1e-6), round_trip, "probe")
+
+def upload_cost(size:int, agent=False, window=4, window_bytes=256):
+    ''' (round trips, wire bytes) of FileExplorer.upload for size bytes '''
+    if agent:
+        chunks = max(1, (size + AGENT_CHUNK_SIZE - 1) // AGENT_CHUNK_SIZE)
+        return 4 + chunks, size + (4 + chunks) * AGENT_HEADER_BYTES + 2 * REPL_COMMAND_BYTES
+    chunks = (size + REPL_CHUNK_SIZE - 1) // REPL_CHUNK_SIZE
+    command = REPL_CHUNK_SIZE * 4 // 3 + REPL_CHUNK_OVERHEAD
+    # pipelining hides the round trips of the chunks queued behind the running one
+    inflight = 1 + max(0, min(window - 1, window_bytes // command))
+    trips = UPLOAD_ROUND_TRIPS + (chunks + inflight - 1) // inflight
+    wire = UPLOAD_ROUND_TRIPS * REPL_COMMAND_BYTES + (size * 4 // 3) + chunks * REPL_CHUNK_OVERHEAD
+    return trips, wire
+
+class PlanOperation():
+    def __init__(self, op:str, path:str, size=0, round_trips=0, wire_bytes=0, seconds=0.0):
+        self.op = op
+        self.path = path
+        self.size = size               # payload bytes (the .mpy size for compiled files)
+        self.round_trips = round_trips
+        self.wire_bytes = wire_bytes
+        self.seconds = seconds         # estimated, measured for local work like compiling
+
+    def to_dict(self) -> dict:
+        return {
+            "op": self.op, "path": self.path, "size": self.size, "round_trips": self.round_trips,
+            "wire_bytes": self.wire_bytes, "seconds": round(self.seconds, 4),
+        }
+
+class SyncPlan():
+    ''' what a sync would do and how long it should take on link '''
+    def __init__(self, link:LinkModel):
+        self.link = link
+        self.operations:List[PlanOperation] = []
+
+    def add(self, op:str, path:str, size=0, round_trips=0, wire_bytes=0, seconds=None) -> PlanOperation:
+        if seconds == None:
+            seconds = self.link.seconds(round_trips, wire_bytes)
+        operation = PlanOperation(op, path, size, round_trips, wire_bytes, seconds)
+        self.operations.append(operation)
+        return operation
+
+    def count(self, op:str) -> int:
+        return len([o for o in self.operations if o.op == op])
+
+    @property
+    def seconds(self) -> float:
+        return sum(o.seconds for o in self.operations)
+
+    def to_dict(self) -> dict:
+        return {
+            "link": self.link.to_dict(),
+            "operations": [o.to_dict() for o in self.operations],
+            "totals": {
+                "uploads": self.count(OP_UPLOAD), "deletes": self.count(OP_DELETE), "mkdirs": self.count(OP_MKDIR), "compiles": self.count(OP_COMPILE),
+                "upload_bytes": sum(o.size for o in self.operations if o.op == OP_UPLOAD),
+                "round_trips": sum(o.round_trips for o in self.operations),
+                "wire_bytes": sum(o.wire_bytes for o in self.operations),
+                "seconds": round(self.seconds, 3),
+            },
+        }
+
+    def report(self) -> str:
+        lines = ["{:<10}{:>10}{:>8}{:>10}{:>10}  {}".format("op", "bytes", "trips", "wire", "seconds", "path")]
+        for o in self.operations:
+            lines.append("{:<10}{:>10}{:>8}{:>10}{:>10.3f}  {}".format(o.op, o.size, o.round_trips, o.wire_bytes, o.seconds, o.path))
+        totals = self.to_dict()["totals"]
+        lines.append("{} uploads ({} bytes), {} deletes, {} mkdirs, {} compiles: {} round trips, {} bytes on the wire".format(
+            totals["uploads"], totals["upload_bytes"], totals["deletes"], totals["mkdirs"], totals["compiles"], totals["round_trips"], totals["wire_bytes"]))
+        lines.append("estimated {:.1f} s at {:.0f} bytes/s, {:.1f} ms per round trip ({})".format(
+            self.seconds, self.link.bytes_per_second, self.link.round_trip_s * 1000, self.link.source))
+        return "\n".join(lines)
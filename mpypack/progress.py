@@ -0,0 +1,132 @@
+from time import perf_counter
+from typing import Callable, Dict, Union
+
+PHASE_DONE = "done"
+
+class ProgressEvent():
+    def __init__(self, phase:str, path:str, files_done:int, files_total:int, file_bytes:int, file_size:int,
+            bytes_done:int, bytes_total:int, elapsed_s:float, rate:float, file_rate:float, eta_s:Union[float, None]):
+        self.phase = phase             # upload, download, delete, build ... or done
+        self.path = path
+        self.files_done = files_done
+        self.files_total = files_total
+        self.file_bytes = file_bytes   # of the current file
+        self.file_size = file_size
+        self.bytes_done = bytes_done   # of the whole run
+        self.bytes_total = bytes_total
+        self.elapsed_s = elapsed_s
+        self.rate = rate               # bytes/s since the transfers started
+        self.file_rate = file_rate     # bytes/s of the current file
+        self.eta_s = eta_s             # None while unknown
+
+    def to_dict(self) -> dict:
+        return {
+            "phase": self.phase, "path": self.path, "files_done": self.files_done, "files_total": self.files_total,
+            "file_bytes": self.file_bytes, "file_size": self.file_size, "bytes_done": self.bytes_done, "bytes_total": self.bytes_total,
+            "elapsed_s": round(self.elapsed_s, 3), "rate": round(self.rate, 1), "file_rate": round(self.file_rate, 1),
+            "eta_s": None if self.eta_s == None else round(self.eta_s, 1),
+        }
+
+ProgressListener = Callable[[ProgressEvent],None]
+
+class ProgressTracker():
+    '''
+    A SyncProgressCallback turning the (p, t, sub_p, sub_t, op, name) calls of FileSync into
+    ProgressEvents with byte totals, throughput and ETA. listener gets at most one event every
+    interval seconds, finish() always delivers the last one.
+    FileSync announces the bytes of the files it is going to transfer with expect_progress.
+    '''
+    def __init__(self, listener:ProgressListener, interval=0.2):
+        self.listener = listener
+        self.interval = interval
+        self.__start = perf_counter()
+        self.__transfer_start = None # expect() or the first call
+        self.__last_emit = None
+        self.__last_call = 0.0
+        self.__sizes:Dict[str, int] = {}
+        self.__finished_bytes = 0
+        self.__current = None # (op, name)
+        self.__file_start = 0.0
+        self.__file_bytes = 0
+        self.__file_size = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.files_total = 0
+        self.phase = ""
+        self.path = ""
+
+    def expect(self, sizes:Dict[str, int]):
+        ''' name -> bytes of the files coming, corrected once a file reports its real size '''
+        if self.__transfer_start == None:
+            self.__transfer_start = perf_counter() # the transfers start now
+            self.__last_call = self.__transfer_start
+        for name, size in sizes.items():
+            size = max(size, 0) # FILE_SIZE_UNKNOWN
+            self.bytes_total += size - self.__sizes.get(name, 0)
+            self.__sizes[name] = size
+
+    def __call__(self, p, t, sub_p, sub_t, op, name):
+        now = perf_counter()
+        if self.__transfer_start == None:
+            self.__transfer_start = now
+            self.__last_call = now
+        if (op, name) != self.__current:
+            self.__complete_file()
+            self.__current = (op, name)
+            # the first call comes with the first chunk, the file started after the previous one
+            self.__file_start = self.__last_call
+        if sub_t > 0 and name in self.__sizes and self.__sizes[name] != sub_t:
+            # compiled or minified files are smaller than their source
+            self.bytes_total += sub_t - self.__sizes[name]
+            self.__sizes[name] = sub_t
+        self.__file_bytes = sub_p
+        self.__file_size = sub_t
+        self.files_done = p
+        self.files_total = t
+        self.phase = op
+        self.path = name
+        self.__last_call = now
+        if self.__last_emit == None or now - self.__last_emit >= self.interval:
+            self.__emit(now)
+
+    def __complete_file(self):
+        self.__finished_bytes += self.__file_size
+        self.__current = None
+        self.__file_bytes = 0
+        self.__file_size = 0
+
+    def __emit(self, now):
+        self.__last_emit = now
+        self.listener(self.event(now))
+
+    def event(self, now=None) -> ProgressEvent:
+        now = perf_counter() if now == None else now
+        bytes_done = self.__finished_bytes + self.__file_bytes
+        transfer_s = 0 if self.__transfer_start == None else now - self.__transfer_start
+        rate = bytes_done / transfer_s if transfer_s > 0 else 0.0
+        file_s = now - self.__file_start
+        file_rate = self.__file_bytes / file_s if self.__current != None and file_s > 0 else 0.0
+        eta = None
+        if rate > 0 and self.bytes_total > 0:
+            eta = max(0.0, self.bytes_total - bytes_done) / rate
+        return ProgressEvent(self.phase, self.path, self.files_done, self.files_total, self.__file_bytes, self.__file_size,
+            bytes_done, max(self.bytes_total, bytes_done), now - self.__start, rate, file_rate, eta)
+
+    def finish(self) -> ProgressEvent:
+        ''' deliver the final event, phase done '''
+        self.__complete_file()
+        self.files_done = self.files_total
+        self.phase = PHASE_DONE
+        self.path = ""
+        now = perf_counter()
+        event = self.event(now)
+        event.eta_s = 0.0
+        self.__last_emit = now
+        self.listener(event)
+        return event
+
+def expect_progress(progress_callback, sizes:Dict[str, int]):
+    ''' tell a ProgressTracker (or any progress_callback with expect) the files coming '''
+    expect = getattr(progress_callback, "expect", None)
+    if expect != None:
+        expect(sizes)
@@ -50,19 +50,77 @@ Then:
 
 import sys
 import time
-import serial
+from collections import deque
+try:
+    from tracing import tracer, TracedSerial
+except ImportError:
+    from mpypack.tracing import tracer, TracedSerial
 
 class PyboardError(Exception):
     pass
 
+def error_message(e:Exception) -> str:
+    ''' the last traceback line of an exception raised on the board, str(e) for anything else '''
+    if isinstance(e, PyboardError) and len(e.args) == 3:
+        lines = e.args[2].decode("utf-8", "replace").strip().splitlines()
+        return lines[-1] if len(lines) > 0 else "exception"
+    return str(e)
+
+# reconfigure the repl uart, then wait for the probe token at the new rate
+# and fall back to the old rate if it never arrives
+BAUDRATE_SWITCH_COMMAND = """\
+import machine, sys, time
+try:
+    import select
+except ImportError:
+    import uselect as select
+_u = machine.UART({uart}, {old})
+time.sleep_ms({settle})
+_u.init(baudrate={new})
+_p = select.poll()
+_p.register(sys.stdin, select.POLLIN)
+_d = time.ticks_add(time.ticks_ms(), {probe})
+_b = ''
+while time.ticks_diff(_d, time.ticks_ms()) > 0:
+    if _p.poll(10):
+        _b = (_b + sys.stdin.read(1))[-{size}:]
+        if _b == '{token}':
+            sys.stdout.write(_b)
+            break
+else:
+    _u.init(baudrate={old})
+del _u, _p, _d, _b
+"""
+BAUDRATE_RESTORE_COMMAND = """\
+import machine, time
+time.sleep_ms({settle})
+machine.UART({uart}).init(baudrate={old})
+"""
+BAUDRATE_PROBE_TOKEN = "MPYPACK-BAUD"
+# sys.platform of ports with a native USB REPL, their UART 0 is on user pins
+USB_REPL_PLATFORMS = ["rp2", "pyboard", "samd", "mimxrt", "renesas-ra"]
+
+# pipelined commands skip themselves once an earlier one in the batch failed
+# (kept short, every byte of it has to fit into the window)
+PIPELINE_RESET_COMMAND = "_mpp_abort=0\n"
+PIPELINE_GUARD_COMMAND = "if not _mpp_abort:\n try:exec({!r})\n except:\n  _mpp_abort=1\n  raise\n"
+# bytes that may wait in the board's stdin buffer behind the running command:
+# the ring buffer of a uart repl holds 260 (esp32, esp8266), usb repls have flow control.
+# A guarded upload chunk (about 700 bytes) never fits into the uart window, so uploads are
+# only pipelined on usb repls, downloads (about 130 bytes a command) on both
+PIPELINE_BYTES_UART = 256
+PIPELINE_BYTES_USB = 4096
+
 class Pyboard:
     def __init__(self, device, baudrate=115200, wait=0):
         self.device = device
         self.baudrate = int(baudrate)
         self.wait = wait
         self.serial = None
+        self.uart_id = None
 
     def init(self):
+        import serial # only needed once connecting, keeps the cli startup fast
         delayed = False
         for attempt in range(self.wait + 1):
             try:
@@ -83,14 +141,18 @@ class Pyboard:
             raise PyboardError("failed to access " + self.device)
         if delayed:
             print("")
+        if tracer.enabled:
+            self.serial = TracedSerial(self.serial)
 
     def close(self):
+        self.uart_id = None
         self.serial.close()
 
     def read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None):
         # if data_consumer is used then data is not accumulated and the ending must be 1 byte long
         assert data_consumer is None or len(ending) == 1
 
+        start = time.perf_counter()
         data = self.serial.read(min_num_bytes)
         if data_consumer:
             data_consumer(data)
@@ -111,8 +173,20 @@ class Pyboard:
                 if timeout is not None and timeout_count >= 100 * timeout:
                     break
                 time.sleep(0.01)
+        tracer.count("device.wait_s", time.perf_counter() - start)
         return data
 
+    def read_exact(self, num_bytes, timeout=10):
+        # blocking read of num_bytes, returns less on timeout
+        old_timeout = self.serial.timeout
+        self.serial.timeout = timeout
+        start = time.perf_counter()
+        try:
+            return self.serial.read(num_bytes)
+        finally:
+            self.serial.timeout = old_timeout
+            tracer.count("device.wait_s", time.perf_counter() - start)
+
     def enter_raw_repl(self):
         self.serial.write(b"\r\x03\x03")  # ctrl-C twice: interrupt any running program
         # flush input (without relying on serial.flushInput())
@@ -139,6 +213,60 @@ class Pyboard:
             # print(data)
             raise PyboardError("could not enter raw repl")
 
+    def negotiate_baudrate(self, baudrate, uart_id=None, settle_ms=50, probe_ms=1000):
+        # must be in raw repl; returns the baud rate actually in use
+        # without uart_id the repl is taken to be UART 0, except on ports with a USB repl
+        baudrate = int(baudrate)
+        if baudrate == self.serial.baudrate:
+            return baudrate
+        if uart_id == None:
+            if self.eval("__import__('sys').platform").decode("utf-8") in USB_REPL_PLATFORMS:
+                return self.serial.baudrate
+            uart_id = 0
+        import serial
+        old = self.serial.baudrate
+        command = BAUDRATE_SWITCH_COMMAND.format(
+            uart=uart_id,
+            old=old,
+            new=baudrate,
+            settle=settle_ms,
+            probe=probe_ms,
+            size=len(BAUDRATE_PROBE_TOKEN),
+            token=BAUDRATE_PROBE_TOKEN,
+        )
+        self.exec_raw_no_follow(command)
+        try:
+            self.serial.baudrate = baudrate
+            time.sleep(settle_ms * 2 / 1000)
+            self.serial.write(BAUDRATE_PROBE_TOKEN.encode("utf8"))
+            data, data_err = self.follow(probe_ms * 2 / 1000)
+            if data == BAUDRATE_PROBE_TOKEN.encode("utf8") and not data_err:
+                self.uart_id = uart_id
+                return baudrate
+        except (PyboardError, ValueError, serial.SerialException):
+            pass
+        # fall back, the device gives up after probe_ms
+        self.serial.baudrate = old
+        time.sleep(probe_ms * 2 / 1000)
+        self.resync_raw_repl()
+        return old
+
+    def restore_baudrate(self, settle_ms=50):
+        if self.uart_id == None or self.serial.baudrate == self.baudrate:
+            return
+        command = BAUDRATE_RESTORE_COMMAND.format(uart=self.uart_id, old=self.baudrate, settle=settle_ms)
+        self.uart_id = None
+        self.exec_raw_no_follow(command)
+        self.serial.baudrate = self.baudrate
+        self.follow(10)
+
+    def resync_raw_repl(self):
+        # drop anything pending and ask for a fresh raw repl prompt
+        self.serial.write(b"\r\x03\x01")  # clear line, then ctrl-A: reset raw REPL
+        data = self.read_until(1, b"raw REPL; CTRL-B to exit\r\n", timeout=1)
+        if not data.endswith(b"raw REPL; CTRL-B to exit\r\n"):
+            raise PyboardError("could not enter raw repl")
+
     def exit_raw_repl(self):
         self.serial.write(b"\r\x02")  # ctrl-B: enter friendly REPL
 
@@ -158,6 +286,39 @@ class Pyboard:
         # return normal and error output
         return data, data_err
 
+    def follow_stream(self, data_consumer, timeout=None, block_size=256):
+        # follow for long running commands: normal output is handed to data_consumer in blocks
+        # as it arrives, timeout (None waits forever) counts from the last byte received.
+        # The last two bytes waiting are never read in a block, they may be the final EOF and
+        # the next prompt, which belong to the following read_until.
+        start = time.perf_counter()
+        data_err = None
+        idle = 0
+        while data_err == None:
+            waiting = self.serial.inWaiting()
+            if waiting == 0:
+                idle += 1
+                if timeout is not None and idle >= 100 * timeout:
+                    raise PyboardError("timeout waiting for first EOF reception")
+                time.sleep(0.01)
+                continue
+            idle = 0
+            data = self.serial.read(min(waiting - 2 if waiting > 2 else 1, block_size))
+            end = data.find(b"\x04")
+            if end < 0:
+                data_consumer(data)
+            else:
+                if end > 0:
+                    data_consumer(data[:end])
+                data_err = data[end + 1:]
+        tracer.count("device.wait_s", time.perf_counter() - start)
+        # wait for error output
+        if not data_err.endswith(b"\x04"):
+            data_err += self.read_until(1, b"\x04", timeout=10)
+        if not data_err.endswith(b"\x04"):
+            raise PyboardError("timeout waiting for second EOF reception")
+        return data_err[:-1]
+
     def exec_raw_no_follow(self, command):
         if isinstance(command, bytes):
             command_bytes = command
@@ -170,19 +331,104 @@ class Pyboard:
             raise PyboardError("could not enter raw repl")
 
         # write command
-        for i in range(0, len(command_bytes), 256):
-            self.serial.write(command_bytes[i : min(i + 256, len(command_bytes))])
-            time.sleep(0.01)
-        self.serial.write(b"\x04")
+        self.__write_command(command_bytes)
 
         # check if we could exec command
         data = self.serial.read(2)
         if data != b"OK":
             raise PyboardError("could not exec command (response: %r)" % data)
 
+    def __write_command(self, command_bytes):
+        # pause between 256 byte blocks to let the board drain its stdin buffer,
+        # no need to pause before the final ctrl-D
+        tracer.count("repl.commands")
+        tracer.count("device.round_trips")
+        for i in range(0, len(command_bytes), 256):
+            if i > 0:
+                time.sleep(0.01)
+            self.serial.write(command_bytes[i : min(i + 256, len(command_bytes))])
+        self.serial.write(b"\x04")
+
+    def exec_pipelined(self, commands, window=4, window_bytes=PIPELINE_BYTES_UART, timeout=10):
+        # Write the next commands while the board still runs the current one and
+        # yield the outputs in order. The board has read the running command, the
+        # ones queued behind it wait in its stdin buffer, hence window_bytes;
+        # one command is always allowed so large commands degrade to exec_raw.
+        # If one command fails the rest of the window is skipped on the board and
+        # the error is raised after their (empty) responses are drained. A command
+        # that runs alone skips the guard.
+        def take():
+            command = next(commands, None)
+            return command.decode("utf8") if isinstance(command, bytes) else command
+        def guarded(command):
+            return bytes(PIPELINE_GUARD_COMMAND.format(command), encoding="utf8")
+        commands = iter(commands)
+        inflight = deque()
+        inflight_bytes = 0
+        error = None
+        pending = take()
+        if pending == None:
+            return # leave the prompt for the next command
+        following = take()
+        # check we have a prompt
+        data = self.read_until(1, b">")
+        if not data.endswith(b">"):
+            raise PyboardError("could not enter raw repl")
+        tracer.count("repl.pipelined_batches")
+        prompt_pending = False
+        def collect():
+            nonlocal inflight_bytes, prompt_pending
+            if prompt_pending:
+                data = self.read_until(1, b">")
+                if not data.endswith(b">"):
+                    raise PyboardError("could not enter raw repl")
+            data = self.serial.read(2)
+            if data != b"OK":
+                raise PyboardError("could not exec command (response: %r)" % data)
+            ret, ret_err = self.follow(timeout)
+            inflight_bytes -= inflight.popleft()
+            prompt_pending = True
+            return ret, ret_err
+        try:
+            while pending != None or len(inflight) > 0:
+                # fill the window
+                while pending != None and error == None:
+                    if len(inflight) > 0:
+                        command_bytes = guarded(pending)
+                        if len(inflight) >= window or inflight_bytes - inflight[0] + len(command_bytes) > window_bytes:
+                            break
+                    elif following != None and window > 1 and len(guarded(following)) <= window_bytes:
+                        # the next one is queued behind it, start a new batch
+                        command_bytes = bytes(PIPELINE_RESET_COMMAND, encoding="utf8") + guarded(pending)
+                    else:
+                        command_bytes = bytes(pending, encoding="utf8")
+                    self.__write_command(command_bytes)
+                    inflight.append(len(command_bytes))
+                    inflight_bytes += len(command_bytes)
+                    pending, following = following, take()
+                if error != None:
+                    pending = None
+                if len(inflight) == 0:
+                    break
+                # collect the oldest response
+                ret, ret_err = collect()
+                if error != None:
+                    continue
+                if ret_err:
+                    error = PyboardError("exception", ret, ret_err)
+                    continue
+                yield ret
+        finally:
+            # keep the protocol in sync if the caller stopped early
+            while len(inflight) > 0:
+                collect()
+        if error != None:
+            raise error
+
     def exec_raw(self, command, timeout=10, data_consumer=None):
-        self.exec_raw_no_follow(command)
-        return self.follow(timeout, data_consumer)
+        with tracer.span("exec_raw", "pyboard", bytes=len(command)):
+            self.exec_raw_no_follow(command)
+            return self.follow(timeout, data_consumer)
 
     def eval(self, expression):
         ret = self.exec("print({})".format(expression))
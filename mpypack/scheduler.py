@@ -0,0 +1,83 @@
+from threading import Condition, Lock, get_ident
+from heapq import heappush, heappop
+from itertools import count
+
+PRIORITY_CONTROL = 0  # short operations: stat, ls, mkdir, rm, exec ...
+PRIORITY_BULK = 1     # transfers and whole sync sessions
+
+class OperationScheduler():
+    '''
+    Reentrant device lock with priorities, replaces a plain RLock.
+    Waiters are served by priority, then in arrival order. The owner calls yield_point()
+    between two chunks of a long operation, it lends the device to waiters of a higher
+    priority than its own and continues when they are done, before anyone of its own priority.
+    '''
+    def __init__(self):
+        self.__cond = Condition(Lock())
+        self.__sequence = count()
+        self.__waiting = [] # heap of (priority, sequence, thread)
+        self.__owner = None
+        self.__depth = 0
+        self.__priority = PRIORITY_BULK
+        self.__owner_sequence = 0
+
+    def __wait_turn(self, priority, sequence=None):
+        # with the condition held, queue and wait until first in the queue and the device is free
+        entry = (priority, next(self.__sequence) if sequence == None else sequence, get_ident())
+        heappush(self.__waiting, entry)
+        while self.__owner != None or self.__waiting[0] is not entry:
+            self.__cond.wait()
+        heappop(self.__waiting)
+        self.__owner = entry[2]
+        self.__priority = priority
+        self.__owner_sequence = entry[1]
+
+    def acquire(self, priority=PRIORITY_BULK, blocking=True) -> bool:
+        with self.__cond:
+            if self.__owner == get_ident():
+                self.__depth += 1
+                return True
+            if not blocking and (self.__owner != None or len(self.__waiting) > 0):
+                return False
+            self.__wait_turn(priority)
+            self.__depth = 1
+            return True
+
+    def release(self):
+        with self.__cond:
+            if self.__owner != get_ident():
+                raise RuntimeError("cannot release un-acquired device")
+            self.__depth -= 1
+            if self.__depth == 0:
+                self.__owner = None
+                self.__cond.notify_all()
+
+    def owned(self) -> bool:
+        ''' the device is held by the current thread '''
+        return self.__owner == get_ident()
+
+    def busy(self) -> bool:
+        ''' the device is held by another thread '''
+        owner = self.__owner
+        return owner != None and owner != get_ident()
+
+    def should_yield(self) -> bool:
+        ''' a caller of higher priority than the owner waits '''
+        with self.__cond:
+            return len(self.__waiting) > 0 and self.__waiting[0][0] < self.__priority
+
+    def yield_point(self) -> bool:
+        ''' lend the device to waiters of higher priority, True if anyone ran meanwhile '''
+        with self.__cond:
+            if self.__owner != get_ident():
+                return False
+            if len(self.__waiting) == 0 or self.__waiting[0][0] >= self.__priority:
+                return False
+            depth, priority, sequence = self.__depth, self.__priority, self.__owner_sequence
+            self.__owner = None
+            self.__depth = 0
+            self.__cond.notify_all()
+            # back in the queue with the old place, ahead of later waiters of the same priority
+            self.__wait_turn(priority, sequence)
+            self.__depth = depth
+            return True
@@ -0,0 +1,121 @@
+try:
+    import version
+    from simboard import SimulatedBoard
+    from fileexplorer import FileExplorer
+    from filesync import FileSync
+except ImportError:
+    from mpypack import version
+    from mpypack.simboard import SimulatedBoard
+    from mpypack.fileexplorer import FileExplorer
+    from mpypack.filesync import FileSync
+from os import path as syspath, makedirs
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List, Union
+import time, platform, sys, os, subprocess
+
+# name -> (folders, files per folder, file size), folders are nested for deep
+SCENARIOS = {
+    "small": (4, 50, 256),       # many small files
+    "big": (1, 3, 64 * 1024),    # few big files
+    "deep": (12, 2, 1024),       # deep tree
+}
+OPERATIONS = ["upload", "resync", "change", "walk", "download"]
+# cli invocations timed by measure_startup, none of them touches a board
+STARTUP_COMMANDS = [["--help"], ["build", "--help"], ["sync", "--help"]]
+SimBenchProgressCallback = Union[None, Callable[[int, int, str, str],None]]
+
+class SimBenchResult():
+    def __init__(self, scenario:str, operation:str):
+        self.scenario = scenario
+        self.operation = operation
+        self.round_trips = 0   # raw REPL commands run by the board
+        self.bytes_to_board = 0
+        self.bytes_from_board = 0
+        self.seconds = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "scenario": self.scenario, "operation": self.operation, "round_trips": self.round_trips,
+            "bytes_to_board": self.bytes_to_board, "bytes_from_board": self.bytes_from_board, "seconds": round(self.seconds, 4),
+        }
+
+def make_scenario(scenario:str, folder:str) -> List[str]:
+    ''' write the files of scenario into folder, their relative paths '''
+    folders, files, size = SCENARIOS[scenario]
+    created = []
+    for d in range(folders):
+        if scenario == "deep":
+            rel_dir = "/".join("d{}".format(i) for i in range(d + 1))
+        else:
+            rel_dir = "d{}".format(d)
+        makedirs(syspath.join(folder, *rel_dir.split("/")), exist_ok=True)
+        for n in range(files):
+            rel = "{}/f{}.bin".format(rel_dir, n)
+            with open(syspath.join(folder, *rel.split("/")), "wb") as f:
+                f.write(bytes((d * 31 + n * 7 + i) & 0xFF for i in range(size)))
+            created.append(rel)
+    return created
+
+def run_simbench(scenarios:List[str]=list(SCENARIOS), baudrate=None, latency=0.0, micropython=None,
+        pipeline_window=4, pipeline_bytes=None, use_agent=False, progress_callback:SimBenchProgressCallback=None) -> List[SimBenchResult]:
+    '''
+    Run each scenario against a fresh simulated board: upload with a sync, a sync with nothing
+    to do, a sync after changing one file, a walk and a download of every file.
+    '''
+    results = []
+    steps = len(scenarios) * len(OPERATIONS)
+    for scenario in scenarios:
+        with TemporaryDirectory() as local, TemporaryDirectory() as root:
+            files = make_scenario(scenario, local)
+            with SimulatedBoard(root, baudrate, latency, micropython) as board:
+                fe = FileExplorer(board.port, pipeline_window=pipeline_window, pipeline_bytes=pipeline_bytes, use_agent=use_agent)
+                with fe:
+                    fs = FileSync(fe, local_path=local, remote_path="/")
+                    for operation in OPERATIONS:
+                        if progress_callback != None:
+                            progress_callback(len(results), steps, scenario, operation)
+                        if operation == "change":
+                            with open(syspath.join(local, *files[0].split("/")), "ab") as f:
+                                f.write(b"changed")
+                        result = SimBenchResult(scenario, operation)
+                        commands, bytes_in, bytes_out = board.commands, board.bytes_in, board.bytes_out
+                        start = time.perf_counter()
+                        if operation in ("upload", "resync", "change"):
+                            fs.sync_dir_remote_with_local()
+                        elif operation == "walk":
+                            fe.walk("/")
+                        elif operation == "download":
+                            for rel in files:
+                                fe.download("/" + rel)
+                        result.seconds = time.perf_counter() - start
+                        result.round_trips = board.commands - commands
+                        result.bytes_to_board = board.bytes_in - bytes_in
+                        result.bytes_from_board = board.bytes_out - bytes_out
+                        results.append(result)
+    return results
+
+def measure_startup(commands:List[List[str]]=STARTUP_COMMANDS, runs=10) -> List[dict]:
+    ''' wall time of fresh `python -m mpypack.cli` processes, min and median of runs '''
+    env = dict(os.environ)
+    package_parent = syspath.dirname(syspath.dirname(syspath.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join([package_parent] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    results = []
+    for args in commands:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-m", "mpypack.cli"] + args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        results.append({"command": " ".join(args), "runs": runs, "min_s": round(times[0], 4), "median_s": round(times[len(times) // 2], 4)})
+    return results
+
+def simbench_report(results:List[SimBenchResult], config:Dict, startup:List[dict]=[]) -> dict:
+    ''' the machine readable report, config holds the run parameters '''
+    return {
+        "mpypack": version.FULL,
+        "python": platform.python_version(),
+        "config": config,
+        "results": [r.to_dict() for r in results],
+        "startup": startup,
+    }
@@ -0,0 +1,500 @@
+import os, sys, io, time, errno, struct, json, binascii, hashlib, threading, types, collections, subprocess
+import builtins as _builtins
+
+RAW_BANNER = b"raw REPL; CTRL-B to exit\r\n>"
+# runs in the MicroPython unix port: the board filesystem is mounted at /,
+# commands arrive as "<length>\n<source>" on stdin, output is framed like the raw REPL
+DELEGATE_DRIVER = """
+import sys, os
+try:
+    os.umount("/")
+except Exception:
+    pass
+os.mount(os.VfsPosix({root!r}), "/")
+os.chdir("/")
+sys.path[:] = ["", "/lib"]
+_i = sys.stdin.buffer
+_o = sys.stdout.buffer
+_g = {{"__name__": "__main__"}}
+while True:
+    _l = _i.readline()
+    if not _l:
+        break
+    _s = _i.read(int(_l))
+    try:
+        exec(_s, _g)
+        _o.write(b"\\x04\\x04>")
+    except BaseException as _e:
+        _o.write(b"\\x04")
+        sys.print_exception(_e, sys.stdout)
+        _o.write(b"\\x04>")
+    sys.stderr.write("\\n")
+"""
+
+
+class _Stdout():
+    def __init__(self, board):
+        self._board = board
+        self.buffer = _StdoutBuffer(board)
+    def write(self, s):
+        if isinstance(s, (bytes, bytearray)):
+            data = bytes(s)
+        else:
+            data = str(s).encode("utf-8")
+        self._board._emit(data.replace(b"\n", b"\r\n"))
+        return len(s)
+    def flush(self):
+        pass
+
+
+class _StdoutBuffer():
+    def __init__(self, board):
+        self._board = board
+    def write(self, b):
+        self._board._emit(bytes(b))
+        return len(b)
+    def flush(self):
+        pass
+
+
+class _Stdin():
+    def __init__(self, board):
+        self._board = board
+        self.buffer = _StdinBuffer(board)
+    def read(self, n=1):
+        return self._board._recv(n).decode("utf-8", "replace")
+
+
+class _StdinBuffer():
+    def __init__(self, board):
+        self._board = board
+    def read(self, n=1):
+        return self._board._recv(n)
+    def readinto(self, buf):
+        data = self._board._recv(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+
+class _Delegate():
+    ''' a MicroPython unix port process that runs the commands for the simulated board '''
+    def __init__(self, executable, root):
+        self.executable = executable
+        self.root = root
+        self.__process = None
+
+    def start(self):
+        self.stop()
+        self.__process = subprocess.Popen([self.executable, "-c", DELEGATE_DRIVER.format(root=self.root)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+
+    def stop(self):
+        if self.__process != None:
+            try:
+                self.__process.stdin.close()
+                self.__process.wait(1)
+            except Exception:
+                self.__process.kill()
+            self.__process = None
+
+    def exec(self, source, board):
+        # the command can't read the board's stdin, its stdin carries the commands
+        import select
+        if self.__process == None or self.__process.poll() != None:
+            self.start()
+        self.__process.stdin.write(str(len(source)).encode("ascii") + b"\n" + source)
+        out = self.__process.stdout.fileno()
+        err = self.__process.stderr.fileno()
+        while True:
+            r, _, _ = select.select([out, err], [], [], 1)
+            if out in r:
+                data = os.read(out, 4096)
+                if not data:
+                    break
+                board._emit(data)
+            elif err in r:
+                if os.read(err, 1) in (b"\n", b""):
+                    break
+        while len(select.select([out], [], [], 0)[0]) > 0:
+            data = os.read(out, 4096)
+            if not data:
+                break
+            board._emit(data)
+        if self.__process.poll() != None:
+            board._emit(b"\x04micropython exited\r\n\x04>")
+
+class SimulatedBoard():
+    '''
+    A raw REPL board on a pty for tests and benchmarks without hardware, posix only.
+    The filesystem lives in the root folder, commands run in this process against small stand-ins
+    of the MicroPython modules, or in the MicroPython unix port when micropython (the executable)
+    is set. baudrate throttles both directions, latency is added before every command.
+    '''
+    def __init__(self, root, baudrate=None, latency=0.0, micropython=None):
+        import tty
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.baudrate = baudrate
+        self.latency = latency
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.commands = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.__delegate = None if micropython == None else _Delegate(micropython, self.root)
+        self._rx = bytearray()
+        self._running = False
+        self._thread = None
+        self._kbd_intr = True
+        self._mounts = {}
+        self._reset()
+
+    # lifecycle
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self.__delegate != None:
+            self.__delegate.stop()
+        try: os.close(self.slave)
+        except OSError: pass
+        if self._thread != None:
+            self._thread.join(1)
+        try: os.close(self.master)
+        except OSError: pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # wire
+    def _throttle(self, n):
+        if self.baudrate:
+            time.sleep(n * 10 / self.baudrate)
+
+    def _emit(self, data):
+        if not data:
+            return
+        self._throttle(len(data))
+        self.bytes_out += len(data)
+        os.write(self.master, data)
+
+    def _fill(self, timeout=None):
+        import select
+        r, _, _ = select.select([self.master], [], [], timeout)
+        if not r:
+            return False
+        try:
+            data = os.read(self.master, 4096)
+        except OSError:
+            self._running = False
+            return False
+        if not data:
+            return False
+        self._throttle(len(data))
+        self.bytes_in += len(data)
+        self._rx.extend(data)
+        return True
+
+    def _recv(self, n):
+        while len(self._rx) < n and self._running:
+            self._fill(0.1)
+        data = bytes(self._rx[:n])
+        del self._rx[:n]
+        return data
+
+    def _check_interrupt(self):
+        if not self._kbd_intr:
+            return
+        self._fill(0)
+        if 3 in self._rx:
+            del self._rx[:self._rx.index(3) + 1]
+            raise KeyboardInterrupt()
+
+    # device state
+    def _reset(self):
+        if self.__delegate != None:
+            self.__delegate.stop() # soft reset, started again by the next command
+        self._modules = {}
+        self._mounts = {}
+        self._kbd_intr = True
+        self._sys = self._make_sys()
+        self._globals = {"__name__": "__main__", "__builtins__": self._make_builtins()}
+
+    def _path(self, p):
+        p = str(p)
+        if not p.startswith("/"):
+            p = "/" + p
+        parts = [x for x in p.split("/") if x not in ("", ".")]
+        return os.path.join(self.root, *parts)
+
+    def _mount_of(self, p):
+        p = "/" + "/".join(x for x in str(p).split("/") if x)
+        for mp, vfs in self._mounts.items():
+            if p == mp or p.startswith(mp + "/"):
+                return vfs, p[len(mp):] or "/"
+        return None, p
+
+    def _open(self, p, mode="r", *args, **kwargs):
+        vfs, rel = self._mount_of(p)
+        if vfs != None:
+            return vfs.open(rel, mode)
+        return _builtins.open(self._path(p), mode, *args, **kwargs)
+
+    def _make_os(self):
+        board = self
+        m = types.ModuleType("uos")
+        def stat(p):
+            vfs, rel = board._mount_of(p)
+            if vfs != None:
+                return vfs.stat(rel)
+            st = os.stat(board._path(p))
+            mode = 0x4000 if os.path.isdir(board._path(p)) else 0x8000
+            return (mode, 0, 0, 0, 0, 0, st.st_size, int(st.st_mtime), int(st.st_mtime), int(st.st_mtime))
+        def ilistdir(p="/"):
+            real = board._path(p)
+            for name in sorted(os.listdir(real)):
+                full = os.path.join(real, name)
+                if os.path.isdir(full):
+                    yield (name, 0x4000, 0, 0)
+                else:
+                    yield (name, 0x8000, 0, os.path.getsize(full))
+        def mount(vfs, mp, *args, **kwargs):
+            board._mounts["/" + "/".join(x for x in mp.split("/") if x)] = vfs
+        def umount(mp):
+            board._mounts.pop("/" + "/".join(x for x in mp.split("/") if x), None)
+        m.getcwd = lambda: "/"
+        m.chdir = lambda p: None
+        m.uname = lambda: ("simboard", "simboard", "1.0", "simulated", "cpython")
+        m.stat = stat
+        m.ilistdir = ilistdir
+        m.listdir = lambda p="/": sorted(os.listdir(board._path(p)))
+        m.mkdir = lambda p: os.mkdir(board._path(p))
+        m.rmdir = lambda p: os.rmdir(board._path(p))
+        m.remove = lambda p: os.remove(board._path(p))
+        m.rename = lambda a, b: os.replace(board._path(a), board._path(b))
+        m.statvfs = lambda p: (4096, 4096, 1024, 512, 512, 0, 0, 0, 0, 255)
+        m.mount = mount
+        m.umount = umount
+        m.sep = "/"
+        return m
+
+    def _make_time(self):
+        board = self
+        m = types.ModuleType("utime")
+        def sleep(s):
+            end = time.time() + s
+            while True:
+                board._check_interrupt()
+                left = end - time.time()
+                if left <= 0:
+                    break
+                time.sleep(min(left, 0.02))
+        m.sleep = sleep
+        m.sleep_ms = lambda ms: sleep(ms / 1000)
+        m.sleep_us = lambda us: sleep(us / 1000000)
+        m.ticks_us = lambda: int(time.perf_counter() * 1000000) & 0x3FFFFFFF
+        m.ticks_ms = lambda: int(time.perf_counter() * 1000) & 0x3FFFFFFF
+        m.ticks_diff = lambda a, b: ((a - b + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+        m.ticks_add = lambda a, b: (a + b) & 0x3FFFFFFF
+        m.time = time.time
+        return m
+
+    def _make_sys(self):
+        m = types.ModuleType("sys")
+        m.stdout = _Stdout(self)
+        m.stderr = m.stdout
+        m.stdin = _Stdin(self)
+        m.path = ["", "/lib"]
+        m.modules = self._modules
+        m.platform = "simboard"
+        m.implementation = types.SimpleNamespace(name="micropython", version=(1, 20, 0))
+        m.exit = sys.exit
+        m.print_exception = lambda e, f=None: self._print_exception(e)
+        return m
+
+    def _make_modules(self):
+        board = self
+        gc = types.ModuleType("gc")
+        gc.collect = lambda: None
+        gc.mem_free = lambda: 200000 - 1000 * len(board._modules)
+        gc.mem_alloc = lambda: 1000 * len(board._modules)
+        mpy = types.ModuleType("micropython")
+        def kbd_intr(c):
+            board._kbd_intr = c != -1
+        mpy.kbd_intr = kbd_intr
+        mpy.const = lambda x: x
+        mpy.opt_level = lambda *a: 0
+        machine = types.ModuleType("machine")
+        class UART:
+            def __init__(self, uid, baudrate=None, **kw):
+                if baudrate:
+                    self.init(baudrate)
+            def init(self, baudrate=None, **kw):
+                if baudrate and board.baudrate:
+                    board.baudrate = baudrate
+        machine.UART = UART
+        machine.freq = lambda *a: 160000000
+        sel = types.ModuleType("uselect")
+        class _Poll:
+            def register(self, *a): pass
+            def unregister(self, *a): pass
+            def poll(self, timeout=-1):
+                if not board._rx:
+                    board._fill(None if timeout < 0 else timeout / 1000)
+                return [(board._sys.stdin, 1)] if board._rx else []
+            ipoll = poll
+        sel.poll = _Poll
+        sel.POLLIN = 1
+        hl = types.ModuleType("uhashlib")
+        hl.sha256 = hashlib.sha256
+        hl.sha1 = hashlib.sha1
+        ba = types.ModuleType("ubinascii")
+        ba.b2a_base64 = binascii.b2a_base64
+        ba.a2b_base64 = binascii.a2b_base64
+        ba.hexlify = binascii.hexlify
+        ba.unhexlify = binascii.unhexlify
+        uos = self._make_os()
+        utime = self._make_time()
+        mods = {
+            "uos": uos, "os": uos, "utime": utime, "time": utime, "gc": gc, "micropython": mpy,
+            "machine": machine, "uselect": sel, "select": sel, "uhashlib": hl, "hashlib": hl,
+            "ubinascii": ba, "binascii": ba, "sys": self._sys, "usys": self._sys,
+            "ustruct": struct, "struct": struct, "ujson": json, "json": json, "uio": io, "io": io,
+            "uerrno": errno, "errno": errno, "ucollections": collections, "collections": collections,
+        }
+        return mods
+
+    def _make_builtins(self):
+        board = self
+        b = dict(vars(_builtins))
+        fake = self._make_modules()
+        def _print(*args, sep=" ", end="\n", file=None):
+            board._check_interrupt()
+            (file or board._sys.stdout).write(sep.join(str(a) for a in args) + end)
+        def _load(name):
+            if name in board._modules:
+                return board._modules[name]
+            if name in fake:
+                return fake[name]
+            rel = name.replace(".", "/")
+            for base in board._sys.path:
+                for cand, pkg in ((rel + ".py", False), (rel + "/__init__.py", True)):
+                    p = (base.rstrip("/") + "/" + cand) if base else "/" + cand
+                    try:
+                        with board._open(p, "r") as f:
+                            src = f.read()
+                    except OSError:
+                        continue
+                    mod = types.ModuleType(name)
+                    mod.__file__ = p
+                    mod.__dict__["__builtins__"] = b
+                    if pkg:
+                        mod.__path__ = [p.rsplit("/", 1)[0]]
+                    board._modules[name] = mod
+                    try:
+                        exec(compile(src, p, "exec"), mod.__dict__)
+                    except BaseException:
+                        board._modules.pop(name, None)
+                        raise
+                    if "." in name:
+                        parent, _, child = name.rpartition(".")
+                        setattr(_load(parent), child, mod)
+                    return mod
+            raise ImportError("no module named '{}'".format(name))
+        def _import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level:
+                pkg = (globals or {}).get("__name__", "")
+                if not (globals or {}).get("__path__"):
+                    pkg = pkg.rpartition(".")[0]
+                for _ in range(level - 1):
+                    pkg = pkg.rpartition(".")[0]
+                name = pkg + ("." + name if name else "")
+            parts = name.split(".")
+            for i in range(len(parts)):
+                mod = _load(".".join(parts[:i + 1]))
+            if fromlist:
+                for item in fromlist:
+                    if item != "*" and not hasattr(mod, item) and name not in fake:
+                        try: _load(name + "." + item)
+                        except ImportError: pass
+                return mod
+            return _load(parts[0])
+        b["__import__"] = _import
+        b["print"] = _print
+        b["open"] = board._open
+        b["input"] = lambda prompt="": ""
+        return b
+
+    def _print_exception(self, e):
+        if isinstance(e, OSError) and e.errno:
+            name = errno.errorcode.get(e.errno, str(e.errno))
+            msg = "OSError: [Errno {}] {}".format(e.errno, name)
+        else:
+            msg = "{}: {}".format(type(e).__name__, e) if str(e) else type(e).__name__
+        self._emit("Traceback (most recent call last):\r\n  File \"<stdin>\", line 1, in <module>\r\n{}\r\n".format(msg).encode("utf-8"))
+
+    def _exec(self, source):
+        self.commands += 1
+        if self.latency:
+            time.sleep(self.latency)
+        self._emit(b"OK")
+        if self.__delegate != None:
+            self.__delegate.exec(source, self)
+            return
+        try:
+            code = compile(source.decode("utf-8"), "<stdin>", "exec")
+            exec(code, self._globals)
+        except SystemExit:
+            pass
+        except BaseException as e:
+            self._emit(b"\x04")
+            self._print_exception(e)
+            self._emit(b"\x04>")
+            return
+        self._emit(b"\x04\x04>")
+
+    def _loop(self):
+        raw = False
+        cmd = bytearray()
+        while self._running:
+            if not self._rx and not self._fill(0.1):
+                continue
+            c = self._rx[0]
+            del self._rx[0]
+            if not raw:
+                if c == 0x01:
+                    raw = True
+                    cmd = bytearray()
+                    self._emit(b"\r\n" + RAW_BANNER)
+                elif c == 0x04:
+                    self._reset()
+                    self._emit(b"MPY: soft reboot\r\n>>> ")
+                elif c == 0x0D:
+                    self._emit(b"\r\n>>> ")
+                continue
+            if c == 0x01:
+                cmd = bytearray()
+                self._emit(b"\r\n" + RAW_BANNER)
+            elif c == 0x02:
+                raw = False
+                self._emit(b"\r\nMicroPython simboard\r\n>>> ")
+            elif c == 0x03:
+                cmd = bytearray()
+            elif c == 0x04:
+                if not cmd:
+                    self._reset()
+                    self._emit(b"OK\r\nMPY: soft reboot\r\n" + RAW_BANNER)
+                else:
+                    source = bytes(cmd)
+                    cmd = bytearray()
+                    self._exec(source)
+            else:
+                cmd.append(c)
@@ -0,0 +1,142 @@
+from time import perf_counter
+from threading import Lock, get_ident
+from functools import wraps
+from typing import Dict
+import os, json
+
+class _NullSpan():
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span():
+    def __init__(self, tracer, name, category, args):
+        self.__tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        end = perf_counter()
+        if exc_type != None:
+            self.args["error"] = exc_type.__name__
+        self.__tracer._record(self, end)
+        return False
+
+class Tracer():
+    '''
+    Counters and timed spans of one run, off unless enabled.
+    summary() aggregates them, chrome_trace() is a timeline for chrome://tracing or Perfetto.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.__lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.__origin = perf_counter()
+        self.counters:Dict[str, float] = {}
+        self.events = [] # (name, category, start, end, thread, args)
+
+    def enable(self):
+        self.reset()
+        self.enabled = True
+
+    def count(self, name:str, value=1):
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def span(self, name:str, category="mpypack", **args):
+        ''' with tracer.span("upload", path=p): ... '''
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def _record(self, span:_Span, end:float):
+        with self.__lock:
+            self.events.append((span.name, span.category, span.start, end, get_ident(), span.args))
+
+    def summary(self) -> dict:
+        spans = {}
+        for name, category, start, end, _, _ in self.events:
+            key = category + "." + name
+            s = spans.setdefault(key, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+            s["count"] += 1
+            s["total_s"] += end - start
+            s["max_s"] = max(s["max_s"], end - start)
+        for s in spans.values():
+            s["total_s"] = round(s["total_s"], 6)
+            s["max_s"] = round(s["max_s"], 6)
+        counters = dict((k, round(v, 6) if isinstance(v, float) else v) for k, v in sorted(self.counters.items()))
+        return {
+            "wall_s": round(perf_counter() - self.__origin, 6),
+            "counters": counters,
+            "spans": dict(sorted(spans.items(), key=lambda i: i[1]["total_s"], reverse=True)),
+        }
+
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        events = []
+        for name, category, start, end, thread, args in self.events:
+            events.append({
+                "name": name, "cat": category, "ph": "X", "pid": pid, "tid": thread,
+                "ts": round((start - self.__origin) * 1000000, 1), "dur": round((end - start) * 1000000, 1),
+                "args": dict((k, str(v)) for k, v in args.items()),
+            })
+        events.sort(key=lambda e: e["ts"])
+        events.append({"name": "counters", "ph": "C", "pid": pid, "tid": 0,
+            "ts": round((perf_counter() - self.__origin) * 1000000, 1), "args": self.summary()["counters"]})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+tracer = Tracer()
+
+def traced(name:str, category="mpypack"):
+    ''' decorator, a span around every call '''
+    def decorator(fn):
+        @wraps(fn)
+        def func(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(name, category):
+                return fn(*args, **kwargs)
+        return func
+    return decorator
+
+class TracedSerial():
+    ''' serial.Serial wrapper counting bytes and the time spent in read / write '''
+    def __init__(self, serial):
+        object.__setattr__(self, "_serial", serial)
+
+    def __getattr__(self, name):
+        return getattr(self._serial, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._serial, name, value)
+
+    def read(self, size=1):
+        start = perf_counter()
+        data = self._serial.read(size)
+        tracer.count("serial.read_s", perf_counter() - start)
+        tracer.count("serial.rx_bytes", len(data))
+        return data
+
+    def write(self, data):
+        start = perf_counter()
+        n = self._serial.write(data)
+        tracer.count("serial.write_s", perf_counter() - start)
+        tracer.count("serial.tx_bytes", len(data))
+        return n
@@ -0,0 +1,19 @@
+from mpypack.freeze import freeze_entries
+
+FILES = ["main.py", "lib/m.py", "lib/foo/__init__.py", "lib/foo/a.py"]
+
+def _tree(tmp_path, files):
+    for f in files:
+        path = tmp_path.joinpath(*f.split("/"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    return {f: None for f in files}
+
+def test_lib_search_path(tmp_path):
+    frozen = _tree(tmp_path, FILES)
+    assert freeze_entries(str(tmp_path), frozen) == [
+        ("module", "main.py", "", None), ("module", "m.py", "lib", None), ("package", "foo", "lib", None)]
+
+def test_lib_package(tmp_path):
+    frozen = _tree(tmp_path, FILES + ["lib/__init__.py"])
+    assert freeze_entries(str(tmp_path), frozen) == [("module", "main.py", "", None), ("package", "lib", "", None)]
@@ -0,0 +1,57 @@
+import pytest
+from mpypack.fsimage import build_image, read_image, ImageError, IMAGE_FAT, IMAGE_LITTLEFS
+
+# a small image of each format
+FORMATS = [(IMAGE_FAT, 128), (IMAGE_LITTLEFS, 32)] # 64 KiB, 128 KiB
+
+def _format(format):
+    if format == IMAGE_LITTLEFS:
+        pytest.importorskip("littlefs")
+    return format
+
+def _write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+@pytest.mark.parametrize("format,block_count", FORMATS)
+def test_round_trip(tmp_path, format, block_count):
+    format = _format(format)
+    files = {
+        "/main.py": b"import app\n",
+        "/lib/app/__init__.py": b"",
+        "/lib/app/a_rather_long_module_name.py": bytes(range(256)) * 20,
+        "/lib/app/Mixed Case.Name.txt": b"x" * 513,
+        "/lib/app/deep/er/still/data.bin": b"\0" * 5000,
+    }
+    folders = ["/lib", "/lib/app", "/lib/app/deep", "/lib/app/deep/er", "/lib/app/deep/er/still"]
+    entries = [(f, None) for f in folders]
+    for n, (path, data) in enumerate(files.items()):
+        entries.append((path, _write(tmp_path, "f{}".format(n), data)))
+    image = build_image(entries, format, block_count=block_count)
+    result = read_image(image, format)
+    assert {p: d for p, d in result.items() if d != None} == files
+    assert set(p for p, d in result.items() if d == None) == set(folders + ["/"])
+    # same input, same image
+    assert build_image(entries, format, block_count=block_count) == image
+
+@pytest.mark.parametrize("format,block_count", FORMATS)
+def test_image_full(tmp_path, format, block_count):
+    format = _format(format)
+    big = _write(tmp_path, "big", b"\xff" * (256 * 1024))
+    with pytest.raises(ImageError, match="Image full"):
+        build_image([("/big.bin", big)], format, block_count=block_count)
+
+def test_block_count_required():
+    with pytest.raises(ImageError):
+        build_image([], IMAGE_FAT)
+
+def test_cli_image_full(tmp_path, monkeypatch):
+    from click.testing import CliRunner
+    from mpypack.cli import cli
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "src").mkdir()
+    _write(tmp_path / "src", "big.bin", b"\xff" * (256 * 1024))
+    result = CliRunner().invoke(cli, ["build", "-s", "src", "-o", "out", "--image", "fs.img", "--image-fs", IMAGE_FAT, "--block-count", "128"])
+    assert result.exit_code == 1
+    assert "Error: Image full" in result.output
@@ -0,0 +1,15 @@
+import ast
+import pytest
+from mpypack.minify import minify_source
+
+@pytest.mark.parametrize("source,expected", [
+    ('def h(): "doc"; return 1\n', "def h():return 1\n"),
+    ("def f():\n    y: int; return 1\n", "def f():\n return 1\n"),
+    ('class A: "doc"; x: int\n', "class A:pass\n"),
+    ("x = 1; y: int\n", "x=1;\n"),
+])
+def test_semicolon_after_removed_statement(source, expected):
+    for keep_lines in (False, True):
+        result = minify_source(source, keep_lines)
+        assert result == expected
+        ast.parse(result)
@@ -0,0 +1,39 @@
+import os
+import pytest
+from mpypack import mpycross
+
+@pytest.fixture
+def search(tmp_path, monkeypatch):
+    # cwd, then one sys.path entry
+    cwd = tmp_path / "cwd"
+    site = tmp_path / "site"
+    (site / "mpy_cross").mkdir(parents=True)
+    cwd.mkdir()
+    monkeypatch.chdir(cwd)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(mpycross, "import_path", [str(site)])
+    monkeypatch.setattr(mpycross, "mpy_cross_exe", None)
+    monkeypatch.setattr(mpycross, "_resolved", False)
+    return cwd, site / "mpy_cross"
+
+def _resolve():
+    mpycross._resolved = False
+    return mpycross.get_mpy_cross_executable()
+
+def _exe(folder):
+    path = folder / "mpy-cross"
+    path.write_bytes(b"")
+    return str(path)
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="posix cache permissions")
+def test_cache_keeps_priority(search):
+    cwd, site = search
+    assert _resolve() == None
+    site_exe = _exe(site)
+    assert _resolve() == site_exe
+    assert _resolve() == site_exe # from the cache
+    # cwd comes first, even with a cached hit further down
+    cwd_exe = _exe(cwd)
+    assert _resolve() == cwd_exe
+    os.remove(cwd_exe)
+    assert _resolve() == site_exe
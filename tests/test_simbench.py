@@ -0,0 +1,50 @@
+import sys
+import pytest
+from mpypack import simbench
+from mpypack.simbench import run_simbench, OPERATIONS
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="the simulated board needs a pty")
+
+# folders, files per folder, file size: small enough for the REPL mode to finish quickly
+TINY = (2, 3, 600)
+FILES = TINY[0] * TINY[1]
+FILE_BYTES = FILES * TINY[2]
+
+@pytest.fixture
+def tiny(monkeypatch):
+    monkeypatch.setitem(simbench.SCENARIOS, "tiny", TINY)
+    return "tiny"
+
+def _results(tiny, use_agent):
+    results = run_simbench([tiny], use_agent=use_agent)
+    assert [r.operation for r in results] == OPERATIONS
+    return {r.operation: r for r in results}
+
+def test_repl(tiny):
+    r = _results(tiny, False)
+    # base64 over the raw REPL, a command per 512 byte chunk
+    assert r["upload"].bytes_to_board > FILE_BYTES * 4 // 3
+    assert r["upload"].round_trips >= FILES * 2
+    # nothing changed: no file content goes to the board
+    assert r["resync"].bytes_to_board < TINY[2]
+    assert r["resync"].round_trips < r["upload"].round_trips
+    # one changed file is uploaded again
+    assert TINY[2] * 4 // 3 < r["change"].bytes_to_board < r["upload"].bytes_to_board
+    # the whole tree in one command
+    assert 1 <= r["walk"].round_trips <= 2
+    assert r["walk"].bytes_from_board < FILE_BYTES
+    assert r["download"].bytes_from_board > FILE_BYTES * 4 // 3
+    assert r["download"].round_trips >= FILES * 2
+
+def test_agent(tiny):
+    repl = _results(tiny, False)
+    r = _results(tiny, True)
+    # installing the agent is the only raw REPL command, agent requests are not counted
+    assert r["upload"].round_trips <= 2
+    assert r["upload"].bytes_to_board > FILE_BYTES
+    for operation in ("resync", "change", "walk", "download"):
+        assert r[operation].round_trips == 0
+    # binary payloads, no base64
+    assert FILE_BYTES < r["download"].bytes_from_board < repl["download"].bytes_from_board
+    assert r["change"].bytes_to_board < repl["change"].bytes_to_board
+    assert r["walk"].bytes_to_board < repl["walk"].bytes_to_board
@@ -0,0 +1,23 @@
+import sys
+from os import path as syspath
+import pytest
+from mpypack.simboard import SimulatedBoard
+from mpypack.fileexplorer import FileExplorer
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="the simulated board needs a pty")
+
+@pytest.mark.parametrize("use_agent", [False, True])
+def test_upload_download(tmp_path, use_agent):
+    data = bytes(i & 0xFF for i in range(3000))
+    with SimulatedBoard(str(tmp_path)) as board:
+        with FileExplorer(board.port, use_agent=use_agent) as fe:
+            fe.upload("/d/e/f.bin", data)
+            commands = board.commands
+            assert fe.download("/d/e/f.bin") == data
+            assert [f.name for f in fe.ls("/d/e")] == ["f.bin"]
+            if use_agent:
+                assert board.commands == commands
+            else:
+                assert board.commands > commands
+    with open(syspath.join(str(tmp_path), "d", "e", "f.bin"), "rb") as f:
+        assert f.read() == data